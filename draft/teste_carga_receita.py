@@ -0,0 +1,109 @@
+'''Benchmark da carga da table DADOS_RECEITA do consulta_cnpj_v0.5.py, com um arquivo .ESTABELE sintético
+
+Mede linhas/s da leitura + parsing + insert do arquivo inteiro em um database novo em disco, pelos dois caminhos:
+antes: um execute('INSERT OR REPLACE ...') por linha, PRAGMAs padrão do SQLite, um commit no final
+depois: lotes do le_lotes_trecho() gravados com executemany, com os PRAGMAs de carga do Dados.modo_carga()
+Os dois usam o mesmo parse_linha_receita() e o mesmo layout da table, a diferença é só a forma de gravar
+No fim confere que os dois databases têm as mesmas linhas
+
+Uso: python "draft/teste_carga_receita.py" [linhas]'''
+
+import importlib.util
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+
+def carrega_script():
+    '''Importa o consulta_cnpj_v0.5.py da pasta main (o nome do arquivo não permite import direto)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    spec = importlib.util.spec_from_file_location('consulta_cnpj', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def gera_estabele(path : str, linhas : int):
+    '''Grava um arquivo sintético com o layout de Estabelecimentos da receita, CNPJs fora de ordem como nos arquivos reais'''
+
+    gerador = random.Random(linhas)
+    basicos = random.Random(0).sample(range(10 ** 8), linhas)
+    with open(path, mode='w', encoding='latin-1') as arq:
+        bloco = list()
+        for i in range(linhas):
+            campos = [f'{basicos[i]:08d}', '0001', f'{i % 100:02d}', '1', 'FANTASIA; LTDA' if i % 50 == 0 else 'FANTASIA',
+                      gerador.choice(['02', '04', '08']), '20200101', '00', '', '', '20100101', f'{4711302 + i % 1000}',
+                      gerador.choice(['', '4712100', '4712100,4713001']), 'RUA', 'DAS FLORES', '123', 'SALA 1', 'CENTRO',
+                      '01001000', 'SP', '7107', '11', '12345678', '', '', '', '', 'contato@empresa.com', '', '']
+            bloco.append(';'.join(f'"{c}"' for c in campos) + '\n')
+            if len(bloco) == 100000:
+                arq.writelines(bloco)
+                bloco = list()
+        arq.writelines(bloco)
+
+
+def carga_antiga(modulo, arquivo : str, path_database : str) -> int:
+    '''Um execute por linha, PRAGMAs padrão'''
+
+    connection = sqlite3.connect(path_database)
+    cursor = connection.cursor()
+    cursor.execute(modulo.DDL_DADOS_RECEITA)
+    linhas = 0
+    with open(arquivo, mode='r', encoding='latin-1') as arq:
+        for z in arq:
+            cursor.execute('''INSERT OR REPLACE INTO DADOS_RECEITA VALUES (?,?,?,?,?)''', modulo.parse_linha_receita(z))
+            linhas += 1
+    connection.commit()
+    connection.close()
+    return linhas
+
+
+def carga_nova(modulo, arquivo : str, path_database : str) -> int:
+    '''Lotes com executemany e PRAGMAs de carga, como o atualizar_receita() faz no database novo'''
+
+    connection = sqlite3.connect(path_database)
+    cursor = connection.cursor()
+    cursor.execute(modulo.DDL_DADOS_RECEITA)
+    # modo_carga() não usa nada da instância, só a conexão
+    modulo.Dados.modo_carga(None, connection, True)
+    linhas = 0
+    try:
+        for lote, lidas, erros in modulo.le_lotes_trecho((arquivo, 0, None)):
+            cursor.executemany('''INSERT OR REPLACE INTO DADOS_RECEITA VALUES (?,?,?,?,?)''', lote)
+            linhas += lidas
+        connection.commit()
+    finally:
+        modulo.Dados.modo_carga(None, connection, False)
+        connection.close()
+    return linhas
+
+
+if __name__ == '__main__':
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    modulo = carrega_script()
+    with tempfile.TemporaryDirectory() as pasta:
+        arquivo = os.path.join(pasta, 'sintetico.ESTABELE')
+        gera_estabele(arquivo, quantidade)
+        print(f'{quantidade} linhas ({os.path.getsize(arquivo) / 1024 ** 2:.0f} MB)')
+        databases = list()
+        for nome, carga in (('antes: execute por linha, PRAGMAs padrão', carga_antiga),
+                            (f'depois: executemany em lotes de {modulo.TAMANHO_LOTE_RECEITA}, PRAGMAs de carga', carga_nova)):
+            path_database = os.path.join(pasta, f'{carga.__name__}.db')
+            inicio = time.perf_counter()
+            linhas = carga(modulo, arquivo, path_database)
+            segundos = time.perf_counter() - inicio
+            assert linhas == quantidade, linhas
+            databases.append(path_database)
+            print(f'{nome}: {segundos:.1f} s, {linhas / segundos / 1000:.0f} mil linhas/s')
+
+        connection = sqlite3.connect(databases[0])
+        connection.execute('''ATTACH DATABASE ? AS nova''', (databases[1],))
+        diferentes = connection.execute('''SELECT COUNT(*) FROM (SELECT * FROM main.DADOS_RECEITA EXCEPT SELECT * FROM nova.DADOS_RECEITA)''').fetchone()[0]
+        diferentes += connection.execute('''SELECT COUNT(*) FROM (SELECT * FROM nova.DADOS_RECEITA EXCEPT SELECT * FROM main.DADOS_RECEITA)''').fetchone()[0]
+        connection.close()
+        assert diferentes == 0, f'{diferentes} linhas diferentes entre os dois databases'
+        print('Mesmas linhas nos dois databases: OK')
@@ -0,0 +1,158 @@
+'''Benchmark da carga dos CNPJs determinados da ABECS do consulta_cnpj_v0.5.py, com uma lista sintética de determinações
+
+1) Conferência: a view MCCS_DETERMINADOS montada pelo normaliza_cnpjs_abecs() tem, para cada CNPJ, os MCCs e as datas
+   sem repetir e na ordem da planilha, e o tipo da primeira determinação
+2) Benchmark em 2M de determinações, em duas etapas, partindo das linhas já lidas da planilha:
+   agregação: laço antigo (zeros à esquerda linha a linha, dict de listas, textos juntados com while) x normaliza_cnpjs_abecs()
+   gravação em um database em memória: um INSERT por CNPJ na table antiga x executemany na MCCS_DETERMINACOES e os índices
+   A MCCS_DETERMINACOES tem uma linha por determinação (e não por CNPJ) e índices para a busca por MCC, então grava mais
+
+Uso: python "draft/teste_cnpjs_abecs.py" [determinações]'''
+
+import importlib.util
+import os
+import random
+import sqlite3
+import sys
+import time
+
+# Determinações da conferência
+DETERMINACOES_CONFERENCIA = 50000
+# Média de determinações por CNPJ na lista sintética
+DETERMINACOES_POR_CNPJ = 4
+
+
+def carrega_script():
+    '''Importa o consulta_cnpj_v0.5.py da pasta main (o nome do arquivo não permite import direto)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    spec = importlib.util.spec_from_file_location('consulta_cnpj', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def gera_determinacoes(quantidade : int) -> list:
+    '''Lista sintética no formato do le_planilha_cnpjs(): [CNPJ, MCC, TIPO, DATA] como texto
+    CNPJs sem os zeros à esquerda (como o excel grava), CNPJs com várias determinações, e linhas repetidas'''
+
+    gerador = random.Random(quantidade)
+    cnpjs = [str(gerador.randrange(10 ** 11, 10 ** 14)) for _ in range(max(1, quantidade // DETERMINACOES_POR_CNPJ))]
+    mccs = [f'{gerador.randrange(1000, 9999)}' for _ in range(300)]
+    datas = [f'{gerador.randint(1, 28):02d}/{gerador.randint(1, 12):02d}/2023 {gerador.randint(0, 23):02d}:00' for _ in range(500)]
+    linhas = list()
+    for _ in range(quantidade):
+        if linhas and gerador.random() < 0.05:
+            linhas.append(list(gerador.choice(linhas)))
+        else:
+            linhas.append([gerador.choice(cnpjs), gerador.choice(mccs), gerador.choice(['MCC PRINCIPAL', 'MCC SECUNDARIO']), gerador.choice(datas)])
+    return linhas
+
+
+def agrega_antiga(lista : list) -> dict:
+    '''Laço usado antes do normaliza_cnpjs_abecs(), como no update_cnpjs_abecs() antigo: {CNPJ : (MCCs, tipo, datas)} em texto'''
+
+    d = dict()
+    for e in lista:
+        if len(e[0]) < 14:
+            e[0] = ((14 - len(e[0])) * '0' ) + e[0]
+        if e[0] not in d.keys():
+            d[e[0]] = (list(), e[2], list())
+            d[e[0]][0].append(e[1])
+            d[e[0]][2].append(e[3])
+        else:
+            d[e[0]][0].append(e[1])
+            d[e[0]][2].append(e[3])
+    agregado = dict()
+    for e in d.keys():
+        i = 1
+        if len(d[e][0]) == 1:
+            mccs_principais = "".join(d[e][0])
+        else:
+            mccs_principais = str(d[e][0][0])
+            while i < len(d[e][0]):
+                mccs_principais += ',' + str(d[e][0][i])
+                i += 1
+        tipo = str(d[e][1])
+        i = 1
+        if len(d[e][2]) == 1:
+            data = "".join(d[e][2])
+        else:
+            data = "".join(d[e][2][0])
+            while i < len(d[e][2]):
+                if data == str(d[e][2][i]):
+                    i += 1
+                else:
+                    data += ' | ' + str(d[e][2][i])
+                    i += 1
+        agregado[e] = (mccs_principais, tipo, data)
+    return agregado
+
+
+def grava_antiga(agregado : dict, connection : sqlite3.Connection):
+    '''Table antiga, um CNPJ por linha, um INSERT por vez'''
+
+    cursor = connection.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS MCCS_DETERMINADOS_ANTIGA
+    ([CNPJ_BANDEIRA_ABECS] TEXT PRIMARY KEY, [MCC_BANDEIRA_ABECS] TEXT, [TIPO_ABECS] TEXT, [DATA_DETERMINACAO_ABECS] TEXT)''')
+    for cnpj, (mccs_principais, tipo, data) in agregado.items():
+        cursor.execute('''INSERT OR REPLACE INTO MCCS_DETERMINADOS_ANTIGA VALUES (?,?,?,?)''', (cnpj, mccs_principais, tipo, data))
+    connection.commit()
+
+
+def grava_nova(modulo, determinacoes, connection : sqlite3.Connection):
+    '''Mesmo caminho do update_cnpjs_abecs(): executemany das determinações normalizadas e índices'''
+
+    cursor = connection.cursor()
+    cursor.execute(modulo.DDL_MCCS_DETERMINACOES.format(tabela='MCCS_DETERMINACOES'))
+    cursor.executemany('''INSERT INTO MCCS_DETERMINACOES VALUES (?,?,?,?,?)''', determinacoes.itertuples(index=False, name=None))
+    for indice in modulo.INDICES_MCCS_DETERMINACOES:
+        cursor.execute(indice)
+    cursor.execute(modulo.DDL_VIEW_MCCS_DETERMINADOS)
+    connection.commit()
+
+
+def esperado(lista : list) -> dict:
+    '''Resultado esperado por CNPJ: (MCCs sem repetir, tipo da primeira determinação, datas sem repetir), na ordem da planilha'''
+
+    resultado = dict()
+    for cnpj, mcc, tipo, data in lista:
+        mccs, _, datas = resultado.setdefault(cnpj.zfill(14), (list(), tipo, list()))
+        if mcc not in mccs:
+            mccs.append(mcc)
+        if data not in datas:
+            datas.append(data)
+    return {cnpj : (','.join(mccs), tipo, ' | '.join(datas)) for cnpj, (mccs, tipo, datas) in resultado.items()}
+
+
+def testa_conferencia(modulo):
+    lista = gera_determinacoes(DETERMINACOES_CONFERENCIA)
+    connection = sqlite3.connect(':memory:')
+    grava_nova(modulo, modulo.normaliza_cnpjs_abecs([list(e) for e in lista]), connection)
+    view = {cnpj : (mccs, tipo, datas) for cnpj, mccs, tipo, datas in connection.execute('''SELECT * FROM MCCS_DETERMINADOS''')}
+    assert view == esperado(lista)
+    print(f'Conferência da view em {DETERMINACOES_CONFERENCIA} determinações ({len(view)} CNPJs): OK')
+
+
+def benchmark(modulo, quantidade : int):
+    lista = gera_determinacoes(quantidade)
+    print(f'{quantidade} determinações:')
+    for nome, agrega, grava in (('laço antigo', agrega_antiga, grava_antiga),
+                                ('normaliza_cnpjs_abecs', modulo.normaliza_cnpjs_abecs, lambda dados, connection : grava_nova(modulo, dados, connection))):
+        # O laço antigo altera as linhas (zeros à esquerda), cada um recebe a sua cópia
+        copia = [list(e) for e in lista]
+        connection = sqlite3.connect(':memory:')
+        inicio = time.perf_counter()
+        agregado = agrega(copia)
+        meio = time.perf_counter()
+        grava(agregado, connection)
+        fim = time.perf_counter()
+        connection.close()
+        print(f'{nome}: agregação {meio - inicio:.1f} s, gravação {fim - meio:.1f} s ({len(agregado)} linhas), total {fim - inicio:.1f} s')
+
+
+if __name__ == '__main__':
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    modulo = carrega_script()
+    testa_conferencia(modulo)
+    benchmark(modulo, quantidade)
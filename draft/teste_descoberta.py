@@ -0,0 +1,123 @@
+'''Benchmark da descoberta de versões do consulta_cnpj_v0.5.py, com páginas gravadas servidas localmente
+
+Cada motor (Web = requests, Browser = selenium) é criado do zero e busca as versões da receita e da ABECS
+pelo web_scrape(), em páginas de exemplo com a mesma estrutura das reais (API do dados.gov.br, página do
+conjunto de dados para o XPATH do selenium e página da ABECS), servidas por um http.server local
+Antes do Agendador a GUI só abria depois dessa busca, então esse é o tempo até a GUI que cada motor custava
+Sem Chrome/ChromeDriver na máquina o selenium não abre: o tempo mostrado é até o Browser desistir
+
+Uso: python "draft/teste_descoberta.py" [rodadas]'''
+
+import functools
+import http.server
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Versões nas páginas de exemplo, que os dois motores têm que encontrar
+DATA_RECEITA = '12/01/2024'
+LINK_DEPARA = '/wp-content/uploads/2023/07/Planilha-DE-PARA-com-MCCs-atualizado-julho-2023.xlsx'
+LINK_CNPJS = '/wp-content/uploads/2023/09/31-08-2023.xlsx'
+
+API_RECEITA = {'title' : 'Cadastro Nacional da Pessoa Jurídica - CNPJ',
+               'notes' : f'Dados abertos do CNPJ. Criado em 01/03/2019. Data da última atualização: {DATA_RECEITA}'}
+
+# Mesmo caminho do XPATH do Browser.busca_receita()
+PAGINA_RECEITA = f'''<html><body><div><section><div>
+<div></div><div></div>
+<div><div><div><div></div><div><span>Data da última atualização: {DATA_RECEITA}</span></div></div></div></div>
+</div></section></div></body></html>'''
+
+# Mesmos caminhos dos XPATH do Browser.busca_abecs()
+PAGINA_ABECS = f'''<html><body><div><main><section><div><div>
+<div><div>De:para</div><div><a href="{LINK_DEPARA}">Planilha de:para</a></div></div>
+<div><div>CNPJs</div><div><p><a href="{LINK_CNPJS}">CNPJs determinados</a></p></div></div>
+</div></div></section></main></div></body></html>'''
+
+
+def carrega_script():
+    '''Importa o consulta_cnpj_v0.5.py da pasta main (o nome do arquivo não permite import direto)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    spec = importlib.util.spec_from_file_location('consulta_cnpj', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+class Paginas(http.server.SimpleHTTPRequestHandler):
+    '''Serve a pasta das páginas sem log de cada requisição'''
+    def log_message(self, *args):
+        pass
+
+
+class DadosFalso():
+    '''Só o que o web_scrape() usa do Dados: as versões lidas'''
+    def __init__(self):
+        self.current_versions = {'receita' : ['nula'], 'depara_abecs' : ['nula'], 'lista_cnpj' : ['nula']}
+
+
+def servidor_paginas(pasta : str) -> http.server.ThreadingHTTPServer:
+    '''Grava as páginas de exemplo na pasta e serve por http em uma porta livre'''
+
+    with open(os.path.join(pasta, 'api.json'), mode='w', encoding='utf-8') as arq:
+        json.dump(API_RECEITA, arq)
+    for nome, pagina in (('receita.html', PAGINA_RECEITA), ('abecs.html', PAGINA_ABECS)):
+        with open(os.path.join(pasta, nome), mode='w', encoding='utf-8') as arq:
+            arq.write(pagina)
+    handler = functools.partial(Paginas, directory=pasta)
+    servidor = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def rodada(modulo, motor : str, base : str) -> tuple:
+    '''Cria o motor, busca as versões e retorna (segundos, versões encontradas, erros)'''
+
+    dados = DadosFalso()
+    inicio = time.perf_counter()
+    if motor == 'http':
+        browser = modulo.Web()
+        browser.url_api = base + 'api.json'
+    else:
+        browser = modulo.Browser()
+        browser.url_receita = base + 'receita.html'
+        browser.abrir_navegador()
+        if not browser.aberto:
+            return time.perf_counter() - inicio, None, ['navegador']
+    browser.url_abecs = base + 'abecs.html'
+    fontes, erros = modulo.web_scrape(browser, dados, ())
+    segundos = time.perf_counter() - inicio
+    versoes = {fonte : dados.current_versions[fonte][1] for fonte in fontes}
+    return segundos, versoes, erros
+
+
+if __name__ == '__main__':
+    rodadas = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    modulo = carrega_script()
+    resultados = dict()
+    with tempfile.TemporaryDirectory() as pasta:
+        servidor = servidor_paginas(pasta)
+        base = f'http://127.0.0.1:{servidor.server_address[1]}/'
+        esperado = {'receita' : DATA_RECEITA, 'depara_abecs' : base + LINK_DEPARA[1:], 'lista_cnpj' : base + LINK_CNPJS[1:]}
+        for motor in ('http', 'selenium'):
+            tempos = list()
+            for _ in range(rodadas):
+                segundos, versoes, erros = rodada(modulo, motor, base)
+                tempos.append(segundos)
+                if versoes is None:
+                    break
+                assert not erros and versoes == esperado, f'{motor}: {versoes} {erros}'
+            resultados[motor] = (sorted(tempos)[len(tempos) // 2], versoes is not None)
+        servidor.shutdown()
+
+    print()
+    for motor, (mediana, aberto) in resultados.items():
+        if aberto:
+            print(f'{motor}: versões encontradas em {mediana * 1000:.0f} ms (mediana de {rodadas} rodadas)')
+        else:
+            print(f'{motor}: navegador não abriu nesta máquina, {mediana * 1000:.0f} ms até desistir')
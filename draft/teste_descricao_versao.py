@@ -0,0 +1,134 @@
+'''Testes do descreve_versao() / ultima_data() do consulta_cnpj_v0.5.py, com páginas de exemplo, e micro-benchmark
+
+1) Páginas de exemplo: listagem da pasta da receita (formato pre e table, com e sem tamanho) e página da ABECS
+2) Equivalência da data com o laço caractere a caractere antigo, em textos aleatórios de dígitos e barras
+3) Micro-benchmark da última data em textos grandes, laço antigo x padrão compilado
+
+Uso: python "draft/teste_descricao_versao.py"'''
+
+import importlib.util
+import os
+import random
+import time
+
+# Quantidade de textos aleatórios comparados com o laço antigo
+TEXTOS_EQUIVALENCIA = 20000
+# Tamanhos dos textos do benchmark, em MB
+TAMANHOS_BENCHMARK = (0.1, 1)
+
+LISTAGEM_PRE = '''<html><head><title>Index of /CNPJ</title></head><body><h1>Index of /CNPJ</h1><pre>
+<a href="?C=N;O=D">Name</a>                    <a href="?C=M;O=A">Last modified</a>      <a href="?C=S;O=A">Size</a>
+<a href="/">Parent Directory</a>                             -
+<a href="Empresas0.zip">Empresas0.zip</a>           2024-01-12 10:31  341M
+<a href="Estabelecimentos0.zip">Estabelecimentos0.zip</a>   2024-01-12 10:35  503M
+<a href="Estabelecimentos1.zip">Estabelecimentos1.zip</a>   2024-01-12 10:36  198M
+<a href="Estabelecimentos10.zip">Estabelecimentos10.zip</a>  2024-01-12 10:40  1.2G
+<a href="LAYOUT_DADOS_ABERTOS_CNPJ.pdf">LAYOUT_DADOS_ABERTOS_CNPJ.pdf</a> 2024-01-12 10:41  1.0M
+</pre></body></html>'''
+
+LISTAGEM_TABLE = '''<table>
+<tr><td><a href="Estabelecimentos0.zip">Estabelecimentos0.zip</a></td><td align="right">2024-01-12 10:35  </td><td align="right">503M</td></tr>
+<tr><td><a href="Estabelecimentos1.zip">Estabelecimentos1.zip</a></td><td align="right">2024-01-12 10:36  </td><td align="right">198M</td></tr>
+</table>'''
+
+LISTAGEM_SEM_TAMANHO = '''<ul>
+<li><a href="Estabelecimentos0.zip">Estabelecimentos0.zip</a></li>
+<li><a href="Estabelecimentos1.zip">Estabelecimentos1.zip</a></li>
+</ul>'''
+
+PAGINA_ABECS = '''<div>
+<a href="/wp-content/uploads/2023/07/Planilha-DE-PARA-com-MCCs-atualizado-julho-2023.xlsx">De:para</a>
+<a href="https://www.abecs.org.br/wp-content/uploads/2023/09/31-08-2023.xlsx?ver=2&amp;x=1">CNPJs</a>
+<a href="/wp-content/uploads/2023/07/Planilha-DE-PARA-com-MCCs-atualizado-julho-2023.xlsx">De:para de novo</a>
+</div>'''
+
+DESCRICAO_RECEITA = 'Data da última atualização: 12/01/2024. Criado em 01/03/2019, metadados de 15/12/2023'
+
+
+def carrega_script():
+    '''Importa o consulta_cnpj_v0.5.py da pasta main (o nome do arquivo não permite import direto)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    spec = importlib.util.spec_from_file_location('consulta_cnpj', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def ultima_data_antiga(texto : str) -> str:
+    '''Laço caractere a caractere usado antes do descreve_versao(), como referência da equivalência'''
+
+    data = list()
+    lista = list(texto)
+    i = 0
+    numeros = {'0','1','2','3','4','5','6','7','8','9'}
+    while i < len(lista):
+        if lista[i] in numeros:
+            try:
+                next_num = (lista[i+1], lista[i+3], lista[i+4], lista[i+6], lista[i+7], lista[i+8], lista[i+9])
+                next_slash = (lista[i+2], lista[i+5])
+                if all(e in numeros for e in next_num) and all(e == '/' for e in next_slash):
+                    data.append(''.join(lista[i:i+10]))
+            except IndexError:
+                pass
+        i += 1
+    return data[-1]
+
+
+def testa_paginas(modulo):
+    base = 'https://dadosabertos.rfb.gov.br/CNPJ/'
+    descricao = modulo.descreve_versao(LISTAGEM_PRE, base)
+    assert descricao['arquivos'] == [base + 'Estabelecimentos0.zip', base + 'Estabelecimentos1.zip', base + 'Estabelecimentos10.zip']
+    assert list(descricao['tamanhos'].values()) == [503 * 1024 ** 2, 198 * 1024 ** 2, int(1.2 * 1024 ** 3)]
+    assert descricao['data'] is None
+
+    descricao = modulo.descreve_versao(LISTAGEM_TABLE, base)
+    assert list(descricao['tamanhos'].values()) == [503 * 1024 ** 2, 198 * 1024 ** 2]
+
+    descricao = modulo.descreve_versao(LISTAGEM_SEM_TAMANHO, base)
+    assert len(descricao['arquivos']) == 2 and set(descricao['tamanhos'].values()) == {None}
+
+    descricao = modulo.descreve_versao(PAGINA_ABECS, 'https://www.abecs.org.br/consulta-mcc-individual', modulo.PADRAO_PLANILHA)
+    assert descricao['arquivos'] == ['https://www.abecs.org.br/wp-content/uploads/2023/07/Planilha-DE-PARA-com-MCCs-atualizado-julho-2023.xlsx',
+                                     'https://www.abecs.org.br/wp-content/uploads/2023/09/31-08-2023.xlsx?ver=2&x=1']
+
+    assert modulo.ultima_data(DESCRICAO_RECEITA) == '15/12/2023'
+    try:
+        modulo.ultima_data('sem data nenhuma')
+        raise AssertionError('Texto sem data deveria dar ValueError')
+    except ValueError:
+        pass
+    print('Páginas de exemplo: OK')
+
+
+def testa_equivalencia(modulo):
+    gerador = random.Random(20)
+    for _ in range(TEXTOS_EQUIVALENCIA):
+        texto = ''.join(gerador.choice('0123456789//  ') for _ in range(gerador.randint(10, 60)))
+        try:
+            esperado = ultima_data_antiga(texto)
+        except IndexError:
+            esperado = None
+        assert modulo.descreve_versao(texto)['data'] == esperado, texto
+    print(f'Equivalência com o laço antigo em {TEXTOS_EQUIVALENCIA} textos: OK')
+
+
+def benchmark(modulo):
+    gerador = random.Random(1)
+    for tamanho in TAMANHOS_BENCHMARK:
+        palavras = ['receita', 'federal', 'cnpj', '2023', '12/01/2024', 'dados', 'abertos', '1/2/3']
+        texto = ' '.join(gerador.choice(palavras) for _ in range(int(tamanho * 1024 ** 2 / 7)))
+        inicio = time.perf_counter()
+        antiga = ultima_data_antiga(texto)
+        meio = time.perf_counter()
+        nova = modulo.ultima_data(texto)
+        fim = time.perf_counter()
+        assert antiga == nova
+        print(f'{tamanho} MB: laço antigo {(meio - inicio) * 1000:.1f} ms -> padrão compilado {(fim - meio) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    modulo = carrega_script()
+    testa_paginas(modulo)
+    testa_equivalencia(modulo)
+    benchmark(modulo)
@@ -0,0 +1,227 @@
+'''Teste dos downloads do consulta_cnpj_v0.5.py contra um http.server local que limita a velocidade e derruba conexões
+
+O servidor manda cada conexão a uma taxa fixa (como o servidor da receita) e pode cortar a conexão depois de N bytes,
+conta as conexões simultâneas e guarda os Range pedidos para cada arquivo
+
+1) Limite de conexões por servidor: vários arquivos em paralelo não passam do BoundedSemaphore do host
+2) Continuação pelo Range: a conexão cai no meio e baixa_arquivo() pede só o que falta do .part
+3) 206 que não continua o .part (Content-Range de outro ponto): o .part é descartado e o arquivo vem inteiro, sem Range
+4) Download em pedaços: baixa_segmentado() com conexões caindo, pedaços remontados na posição certa e limite do host respeitado
+Em todos o conteúdo final e o SHA-256 registrado no Manifesto são conferidos com o arquivo servido
+Os blocos são de TAMANHO_BLOCO_DOWNLOAD (1 MB) e um bloco incompleto quando a conexão cai é perdido,
+então o corte fica em 1,5 MB: cada conexão grava 1 MB e a próxima continua dali
+
+Uso: python "draft/teste_downloads.py"'''
+
+import functools
+import hashlib
+import http.server
+import importlib.util
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Velocidade de cada conexão, em bytes/s
+TAXA = 4 * 1024 * 1024
+MB = 1024 * 1024
+# Bytes enviados por conexão antes de derrubar, nos testes com queda
+CORTE = 3 * MB // 2
+
+
+def carrega_script():
+    '''Importa o consulta_cnpj_v0.5.py da pasta main (o nome do arquivo não permite import direto)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    spec = importlib.util.spec_from_file_location('consulta_cnpj', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+class Lento(http.server.SimpleHTTPRequestHandler):
+    '''Serve arquivos com Range, a TAXA bytes/s por conexão, cortando a conexão depois de 'corte' bytes (0 = nunca)
+    Arquivos em 'range_errado' respondem o primeiro Range com um 206 do começo do arquivo'''
+    protocol_version = 'HTTP/1.1'
+    corte = 0
+    range_errado = set()
+    lock = threading.Lock()
+    ativos = 0
+    maximo = 0
+    pedidos = dict()
+
+    def log_message(self, *args):
+        pass
+
+    def conta(self, delta : int):
+        with Lento.lock:
+            Lento.ativos += delta
+            Lento.maximo = max(Lento.maximo, Lento.ativos)
+
+    def do_HEAD(self):
+        self.conta(1)
+        try:
+            path = self.translate_path(self.path)
+            self.send_response(200)
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+        finally:
+            self.conta(-1)
+
+    def do_GET(self):
+        self.conta(1)
+        contando = True
+        try:
+            path = self.translate_path(self.path)
+            tamanho = os.path.getsize(path)
+            pedido = self.headers.get('Range')
+            with Lento.lock:
+                Lento.pedidos.setdefault(self.path, list()).append(pedido)
+            inicio, fim = 0, tamanho - 1
+            if pedido:
+                m = re.match(r'bytes=(\d+)-(\d*)', pedido)
+                inicio, fim = int(m.group(1)), int(m.group(2)) if m.group(2) else tamanho - 1
+                if self.path in Lento.range_errado:
+                    Lento.range_errado.discard(self.path)
+                    inicio = 0
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {inicio}-{fim}/{tamanho}')
+            else:
+                self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(fim - inicio + 1))
+            self.end_headers()
+            with open(path, mode='rb') as arq:
+                arq.seek(inicio)
+                falta = fim - inicio + 1
+                enviados = 0
+                while falta:
+                    bloco = arq.read(min(64 * 1024, falta))
+                    if Lento.corte and enviados + len(bloco) > Lento.corte:
+                        # Derruba a conexão no meio da resposta
+                        self.wfile.write(bloco[:Lento.corte - enviados])
+                        self.wfile.flush()
+                        self.close_connection = True
+                        self.connection.shutdown(socket.SHUT_RDWR)
+                        return
+                    time.sleep(len(bloco) / TAXA)
+                    falta -= len(bloco)
+                    enviados += len(bloco)
+                    # A conexão deixa de contar antes do último bloco: depois dele o cliente já pode abrir outra
+                    if not falta:
+                        self.conta(-1)
+                        contando = False
+                    self.wfile.write(bloco)
+        except ConnectionError:
+            # Cliente desistiu da resposta (ex: 206 que não continua o .part)
+            pass
+        finally:
+            if contando:
+                self.conta(-1)
+
+
+def prepara(corte : int = 0, range_errado : set = ()):
+    with Lento.lock:
+        Lento.corte = corte
+        Lento.range_errado = set(range_errado)
+        Lento.ativos = 0
+        Lento.maximo = 0
+        Lento.pedidos = dict()
+
+
+def gera_arquivo(pasta : str, nome : str, tamanho : int) -> str:
+    with open(os.path.join(pasta, nome), mode='wb') as arq:
+        arq.write(os.urandom(tamanho))
+    return nome
+
+
+def confere(origem : str, destino : str, manifesto):
+    '''Arquivo baixado igual ao servido, e SHA-256 do manifesto igual ao do arquivo'''
+
+    with open(origem, mode='rb') as arq:
+        esperado = hashlib.sha256(arq.read()).hexdigest()
+    with open(destino, mode='rb') as arq:
+        assert hashlib.sha256(arq.read()).hexdigest() == esperado, f'{destino} diferente do servido'
+    assert manifesto.arquivos[os.path.basename(destino)]['sha256'] == esperado, f'SHA-256 do manifesto errado em {destino}'
+    assert not [nome for nome in os.listdir(os.path.dirname(destino)) if nome.endswith(('.part', '.seg', '.json'))]
+
+
+def testa_limite(modulo, servidos : str, baixados : str, base : str):
+    prepara()
+    nomes = [gera_arquivo(servidos, f'limite_{i}.zip', MB) for i in range(6)]
+    progresso = modulo.ProgressoDownload(len(nomes))
+    limite = threading.BoundedSemaphore(2)
+    manifesto = modulo.Manifesto(None)
+    with ThreadPoolExecutor(len(nomes)) as executor:
+        for resultado in [executor.submit(modulo.baixa_arquivo, base + nome, os.path.join(baixados, nome), progresso, limite, 1, manifesto)
+                          for nome in nomes]:
+            resultado.result()
+    for nome in nomes:
+        confere(os.path.join(servidos, nome), os.path.join(baixados, nome), manifesto)
+    assert Lento.maximo == 2, f'{Lento.maximo} conexões simultâneas com limite de 2'
+    print(f'\n1) {len(nomes)} arquivos em paralelo com conexoes_por_host=2: no máximo {Lento.maximo} conexões: OK')
+
+
+def testa_continuacao(modulo, servidos : str, baixados : str, base : str):
+    prepara(corte=CORTE)
+    nome = gera_arquivo(servidos, 'continua.zip', 3 * MB - 1000)
+    manifesto = modulo.Manifesto(None)
+    destino = os.path.join(baixados, nome)
+    modulo.baixa_arquivo(base + nome, destino, modulo.ProgressoDownload(1), threading.BoundedSemaphore(1), 1, manifesto)
+    confere(os.path.join(servidos, nome), destino, manifesto)
+    pedidos = Lento.pedidos['/' + nome]
+    assert pedidos == [None, f'bytes={MB}-', f'bytes={2 * MB}-'], pedidos
+    print(f'\n2) Conexão caindo a cada {CORTE} bytes, Ranges pedidos {pedidos}: OK')
+
+
+def testa_range_errado(modulo, servidos : str, baixados : str, base : str):
+    nome = gera_arquivo(servidos, 'range_errado.zip', MB)
+    prepara(range_errado={'/' + nome})
+    destino = os.path.join(baixados, nome)
+    # .part de uma execução anterior, com o começo certo do arquivo
+    with open(os.path.join(servidos, nome), mode='rb') as origem, open(destino + '.part', mode='wb') as arq:
+        arq.write(origem.read(5000))
+    manifesto = modulo.Manifesto(None)
+    modulo.baixa_arquivo(base + nome, destino, modulo.ProgressoDownload(1), threading.BoundedSemaphore(1), 1, manifesto)
+    confere(os.path.join(servidos, nome), destino, manifesto)
+    pedidos = Lento.pedidos['/' + nome]
+    assert pedidos == ['bytes=5000-', None], pedidos
+    print(f'\n3) 206 com Content-Range do começo para um .part de 5000 bytes, pedidos {pedidos}: OK')
+
+
+def testa_segmentado(modulo, servidos : str, baixados : str, base : str):
+    # Arquivo pequeno para o teste, o mínimo real é de 64 MB
+    modulo.TAMANHO_MINIMO_SEGMENTADO = MB
+    for limite in (4, 2):
+        prepara(corte=CORTE)
+        nome = gera_arquivo(servidos, f'segmentado_{limite}.zip', 8 * MB + 123)
+        manifesto = modulo.Manifesto(None)
+        destino = os.path.join(baixados, nome)
+        inicio = time.perf_counter()
+        modulo.baixa_arquivo(base + nome, destino, modulo.ProgressoDownload(1), threading.BoundedSemaphore(limite), 4, manifesto)
+        segundos = time.perf_counter() - inicio
+        confere(os.path.join(servidos, nome), destino, manifesto)
+        pedidos = Lento.pedidos['/' + nome]
+        # Cada pedaço cai uma vez e continua com um Range do ponto onde parou
+        assert None not in pedidos and len(pedidos) == 8, pedidos
+        assert Lento.maximo <= limite, f'{Lento.maximo} conexões simultâneas com limite de {limite}'
+        print(f'\n4) 4 pedaços, conexoes_por_host={limite}, conexão caindo a cada {CORTE} bytes: {len(pedidos)} Ranges pedidos, '
+              f'no máximo {Lento.maximo} conexões, arquivo remontado em {segundos:.1f} s: OK')
+
+
+if __name__ == '__main__':
+    modulo = carrega_script()
+    with tempfile.TemporaryDirectory() as servidos, tempfile.TemporaryDirectory() as baixados:
+        servidor = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Lento, directory=servidos))
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{servidor.server_address[1]}/'
+        testa_limite(modulo, servidos, baixados, base)
+        testa_continuacao(modulo, servidos, baixados, base)
+        testa_range_errado(modulo, servidos, baixados, base)
+        testa_segmentado(modulo, servidos, baixados, base)
+        servidor.shutdown()
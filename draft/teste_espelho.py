@@ -0,0 +1,112 @@
+'''Teste do modo espelho do consulta_cnpj_v0.5.py, sem internet
+
+Uma instalação publica as versões, planilhas e o snapshot do database.db em uma pasta (publica_espelho()),
+e outras instalações leem essa pasta direto, ou por um http.server local no papel do servidor interno (verifica_espelho())
+Cada instalação é uma cópia do script em uma pasta temporária, com o seu config.txt e database.db
+
+1) Instalação nova (versões 'nula') usa o snapshot do espelho, por pasta e por http
+2) Instalação com versões mais novas que o espelho não volta para trás: nem snapshot, nem arquivos
+
+Uso: python "draft/teste_espelho.py"'''
+
+import functools
+import http.server
+import importlib.util
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+# Versões publicadas no espelho
+VERSOES_ESPELHO = {'receita' : '12/01/2024',
+                   'depara_abecs' : 'https://www.abecs.org.br/wp-content/uploads/2023/07/Planilha-DE-PARA-com-MCCs-atualizado-julho-2023.xlsx',
+                   'lista_cnpj' : 'https://www.abecs.org.br/wp-content/uploads/2023/09/31-08-2023.xlsx'}
+# Versões de uma instalação que já está na frente do espelho
+VERSOES_NOVAS = {'receita' : '09/02/2024',
+                 'depara_abecs' : VERSOES_ESPELHO['depara_abecs'],
+                 'lista_cnpj' : 'https://www.abecs.org.br/wp-content/uploads/2024/02/05-02-2024.xlsx'}
+VERSOES_NULAS = {fonte : 'nula' for fonte in VERSOES_ESPELHO}
+
+
+class Pasta(http.server.SimpleHTTPRequestHandler):
+    '''Serve a pasta do espelho sem log de cada requisição'''
+    def log_message(self, *args):
+        pass
+
+
+def instalacao(pasta : str, versoes : dict, opcoes : str = ''):
+    '''Cria uma instalação: cópia do script, config.txt com as versões, e o módulo importado a partir da cópia
+    O script usa o config.txt da pasta atual, então a pasta atual passa a ser a da instalação'''
+
+    os.makedirs(pasta)
+    origem = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    shutil.copy(origem, os.path.join(pasta, 'consulta_cnpj.py'))
+    with open(os.path.join(pasta, 'config.txt'), mode='w') as arq:
+        arq.writelines(f'{fonte}={versao}\n' for fonte, versao in versoes.items())
+        arq.write('permite_update=sim\n' + opcoes)
+    os.chdir(pasta)
+    spec = importlib.util.spec_from_file_location(f'consulta_cnpj_{os.path.basename(pasta)}', os.path.join(pasta, 'consulta_cnpj.py'))
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    dados = modulo.Dados()
+    dados.cria_database()
+    modulo.start_update(dados)
+    return modulo, dados
+
+
+def publica(base : str, espelho : str):
+    '''Instalação que publica o espelho, com uma linha marcadora no database para reconhecer o snapshot'''
+
+    modulo, dados = instalacao(os.path.join(base, 'publicador'), VERSOES_ESPELHO, f'publica_espelho={espelho}\n')
+    dados.cursor.execute('''INSERT INTO CONTEUDOS_ABECS VALUES ('marcador', 'publicador', 1)''')
+    dados.connection.commit()
+    for fonte, versao in VERSOES_ESPELHO.items():
+        dados.current_versions[fonte].append(versao)
+        arquivos = list()
+        if fonte != 'receita':
+            arquivos.append(os.path.join(dados.path_script, f'{fonte}.xlsx'))
+            with open(arquivos[0], mode='wb') as arq:
+                arq.write(os.urandom(1024))
+        dados.publica_espelho(fonte, arquivos)
+    dados.connection.close()
+
+
+def cliente(base : str, nome : str, versoes : dict, espelho : str) -> tuple:
+    '''Instalação que lê o espelho, retorna (versões lidas no espelho, snapshot usado, versões gravadas no config.txt)'''
+
+    modulo, dados = instalacao(os.path.join(base, nome), versoes, f'espelho={espelho}\n')
+    fontes = dados.verifica_espelho()
+    assert fontes == list(VERSOES_ESPELHO), fontes
+    lidas = {fonte : dados.current_versions[fonte][1] for fonte in fontes}
+    dados.connection.close()
+    with sqlite3.connect(dados.path_database) as connection:
+        snapshot = connection.execute('''SELECT COUNT(*) FROM CONTEUDOS_ABECS WHERE FONTE = 'marcador' ''').fetchone()[0] == 1
+    with open('config.txt', mode='r') as arq:
+        config = dict(linha.strip().split('=', 1) for linha in arq.readlines()[:3])
+    return lidas, snapshot, config
+
+
+if __name__ == '__main__':
+    inicial = os.getcwd()
+    with tempfile.TemporaryDirectory() as base:
+        espelho = os.path.join(base, 'espelho')
+        publica(base, espelho)
+        print(f'Espelho publicado: {sorted(os.listdir(espelho))}')
+
+        handler = functools.partial(Pasta, directory=espelho)
+        servidor = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{servidor.server_address[1]}/'
+
+        for nome, origem in (('cliente_pasta', espelho), ('cliente_http', url)):
+            lidas, snapshot, config = cliente(base, nome, VERSOES_NULAS, origem)
+            assert snapshot and config == VERSOES_ESPELHO and lidas == VERSOES_ESPELHO, (snapshot, config, lidas)
+            print(f'{nome}: instalação nova usou o snapshot do espelho: OK')
+
+        lidas, snapshot, config = cliente(base, 'cliente_mais_novo', VERSOES_NOVAS, url)
+        assert not snapshot and config == VERSOES_NOVAS and lidas == VERSOES_NOVAS, (snapshot, config, lidas)
+        print('cliente_mais_novo: espelho mais antigo não foi usado, versões mantidas: OK')
+
+        servidor.shutdown()
+        os.chdir(inicial)
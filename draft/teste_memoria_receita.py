@@ -0,0 +1,125 @@
+'''Teste de teto de memória da leitura dos arquivos de estabelecimentos da receita
+
+Gera dois arquivos .ESTABELE sintéticos (um 10x maior que o outro) no layout da receita,
+lê cada um pelo le_lotes_trecho() do consulta_cnpj_v0.5.py e mede o pico de memória do processo (RSS),
+que inclui os buffers em C (zipfile, sqlite) e não só os objetos do Python
+Cada arquivo é lido em um processo separado, e o RSS é amostrado durante a leitura: o pico guardado pelo sistema
+já vem alto do import do script (pandas, selenium...) e esconderia a leitura. O que conta é quanto o RSS subiu depois do import
+A leitura é em lotes de tamanho fixo: o pico tem que ficar abaixo do teto e não pode crescer com o tamanho do arquivo
+
+Uso: python "draft/teste_memoria_receita.py" [linhas do arquivo menor]
+O arquivo menor tem no mínimo 2 lotes (TAMANHO_LOTE_RECEITA), senão ele nem chega a encher um lote e a comparação não vale'''
+
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Teto do aumento do pico de memória na leitura, em MB
+LIMITE_MEMORIA_MB = 64
+# Quanto o pico do arquivo maior pode passar do pico do menor
+FOLGA_CRESCIMENTO = 1.5
+# Intervalo entre as amostras de RSS, em segundos
+INTERVALO_AMOSTRA = 0.005
+
+
+def carrega_script():
+    '''Importa o consulta_cnpj_v0.5.py da pasta main (o nome do arquivo não permite import direto)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    spec = importlib.util.spec_from_file_location('consulta_cnpj', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def rss_atual() -> float:
+    '''Memória (RSS) do processo agora, em MB: /proc no Linux, psutil nos outros sistemas'''
+
+    if os.path.isfile('/proc/self/statm'):
+        with open('/proc/self/statm', mode='r') as arq:
+            return int(arq.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    import psutil
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def gera_estabele(path : str, linhas : int):
+    '''Grava um arquivo sintético com o layout de Estabelecimentos da receita (campos entre aspas, separados por ';')'''
+
+    gerador = random.Random(linhas)
+    with open(path, mode='w', encoding='latin-1') as arq:
+        bloco = list()
+        for i in range(linhas):
+            campos = [f'{i:08d}', '0001', f'{i % 100:02d}', '1', 'FANTASIA; LTDA' if i % 50 == 0 else 'FANTASIA',
+                      gerador.choice(['02', '04', '08']), '20200101', '00', '', '', '20100101', f'{4711302 + i % 1000}',
+                      '4712100,4713001', 'RUA', 'DAS FLORES', '123', 'SALA 1', 'CENTRO', '01001000', 'SP', '7107',
+                      '11', '12345678', '', '', '', '', 'contato@empresa.com', '', '']
+            bloco.append(';'.join(f'"{c}"' for c in campos) + '\n')
+            if len(bloco) == 100000:
+                arq.writelines(bloco)
+                bloco = list()
+        arq.writelines(bloco)
+
+
+def le_arquivo(path : str):
+    '''Processo filho: lê o arquivo inteiro em lotes, como a carga da receita, e mostra linhas, erros e o aumento do pico de RSS'''
+
+    modulo = carrega_script()
+    base = rss_atual()
+    amostras = [base]
+    lendo = True
+
+    def amostra():
+        while lendo:
+            amostras.append(rss_atual())
+            time.sleep(INTERVALO_AMOSTRA)
+
+    amostrador = threading.Thread(target=amostra, daemon=True)
+    amostrador.start()
+    linhas = 0
+    erros = 0
+    for lote, lidas, erros_lote in modulo.le_lotes_trecho((path, 0, None)):
+        linhas += lidas
+        erros += erros_lote
+    amostras.append(rss_atual())
+    lendo = False
+    amostrador.join()
+    print(linhas, erros, max(amostras) - base)
+
+
+def pico_leitura(path : str) -> tuple:
+    '''Lê o arquivo em outro processo e retorna (linhas lidas, erros, aumento do pico de RSS em MB)'''
+
+    saida = subprocess.run([sys.executable, os.path.abspath(__file__), '--ler', path], capture_output=True, text=True, check=True)
+    linhas, erros, pico = saida.stdout.split()[-3:]
+    return int(linhas), int(erros), float(pico)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--ler']:
+        le_arquivo(sys.argv[2])
+        sys.exit()
+
+    lote = carrega_script().TAMANHO_LOTE_RECEITA
+    menor = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    if menor < 2 * lote:
+        print(f'Arquivo menor aumentado de {menor} para {2 * lote} linhas (2 lotes)')
+        menor = 2 * lote
+    picos = list()
+    with tempfile.TemporaryDirectory() as pasta:
+        for linhas in (menor, menor * 10):
+            path = os.path.join(pasta, f'sintetico_{linhas}.ESTABELE')
+            gera_estabele(path, linhas)
+            lidas, erros, pico = pico_leitura(path)
+            print(f'{linhas} linhas ({os.path.getsize(path) / 1024 ** 2:.0f} MB): {lidas} lidas, {erros} erros, pico de RSS +{pico:.1f} MB')
+            assert lidas == linhas and erros == 0, 'Leitura não devolveu todas as linhas'
+            picos.append(pico)
+            os.remove(path)
+
+    assert picos[1] < LIMITE_MEMORIA_MB, f'Pico de {picos[1]:.1f} MB passou do teto de {LIMITE_MEMORIA_MB} MB'
+    assert picos[1] < max(picos[0], 1) * FOLGA_CRESCIMENTO, 'Pico de memória cresceu com o tamanho do arquivo'
+    print('OK: memória da leitura não depende do tamanho do arquivo')
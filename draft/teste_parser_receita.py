@@ -0,0 +1,110 @@
+'''Testes do parse_linha_receita() do consulta_cnpj_v0.5.py, com linhas sintéticas no layout de Estabelecimentos, e benchmark
+
+1) Equivalência com o módulo csv (que entende as aspas) em linhas com os casos difíceis: ';' dentro do nome fantasia
+   e do logradouro, aspas dentro de um campo, CNAEs secundários vazios, fim de linha CRLF e CNPJ alfanumérico
+   Mostra também quantas dessas linhas o split(';') antigo lia errado
+2) Benchmark em linhas sintéticas (com alguns ';' dentro dos campos): split(';') antigo, csv e parse_linha_receita()
+   O parse_linha_receita() já entrega o registro convertido para o layout compacto, o csv é medido com e sem a mesma conversão
+
+Uso: python "draft/teste_parser_receita.py" [linhas do benchmark]'''
+
+import csv
+import importlib.util
+import os
+import random
+import sys
+import time
+
+# Linhas da equivalência
+LINHAS_EQUIVALENCIA = 200000
+# Fração das linhas do benchmark com ';' dentro de algum campo
+FRACAO_SEPARADOR = 0.02
+# Colunas usadas, como no COLUNAS_RECEITA
+BASICO, ORDEM, DV, SITUACAO, CNAE_P, CNAE_S = 0, 1, 2, 5, 11, 12
+
+
+def carrega_script():
+    '''Importa o consulta_cnpj_v0.5.py da pasta main (o nome do arquivo não permite import direto)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    spec = importlib.util.spec_from_file_location('consulta_cnpj', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def gera_linha(gerador : random.Random, i : int, dificil : bool) -> str:
+    '''Uma linha do arquivo de estabelecimentos, com campos entre aspas separados por ';'
+    Linhas difíceis podem ter ';' e aspas dentro dos campos de texto, CNAEs vazios, CRLF e CNPJ alfanumérico'''
+
+    alfanumerico = dificil and gerador.random() < 0.2
+    basico = ''.join(gerador.choice('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(8)) if alfanumerico else f'{i % 10 ** 8:08d}'
+    fantasia = 'PADARIA E CONFEITARIA'
+    logradouro = 'DAS FLORES'
+    cnaes_s = '4712100,4713001'
+    if dificil:
+        fantasia = gerador.choice(['PADARIA; CONFEITARIA', 'BAR ";" DO ZE', 'LOJA "BOA"; VISTA', ';', fantasia])
+        logradouro = gerador.choice(['RUA A; SALA 2', 'AV. B;;C', logradouro])
+        cnaes_s = gerador.choice(['', '4712100', cnaes_s])
+    campos = [basico, f'{gerador.randint(1, 9999):04d}', f'{gerador.randint(0, 99):02d}', '1', fantasia,
+              gerador.choice(['02', '04', '08']), '20200101', '00', '', '', '20100101',
+              gerador.choice(['', f'{gerador.randint(1000000, 9999999)}']) if dificil else '4711302', cnaes_s,
+              'RUA', logradouro, '123', 'SALA 1', 'CENTRO', '01001000', 'SP', '7107',
+              '11', '12345678', '', '', '', '', 'contato@empresa.com', '', '']
+    # Aspas dentro de um campo vêm dobradas, como no csv
+    linha = ';'.join('"' + campo.replace('"', '""') + '"' for campo in campos)
+    return linha + ('\r\n' if dificil and gerador.random() < 0.5 else '\n')
+
+
+def linha_csv(modulo, z : str) -> tuple:
+    '''Referência: campos lidos pelo módulo csv e convertidos como no parse_linha_receita()'''
+
+    x = next(csv.reader([z.rstrip('\r\n')], delimiter=';'))
+    cnpj = x[BASICO] + x[ORDEM] + x[DV]
+    return (modulo.chave_cnpj(cnpj), int(cnpj[12:]), int(x[SITUACAO]), int(x[CNAE_P]) if x[CNAE_P] else None, modulo.empacota_cnaes(x[CNAE_S]))
+
+
+def split_antigo(z : str) -> tuple:
+    '''Leitura usada antes do parse_linha_receita(): split(';') e replace das aspas, sem conversão'''
+
+    x = z.split(";")
+    cnpj = (x[0] + x[1] + x[2]).replace('"','')
+    return (cnpj, x[5].replace('"',''), x[11].replace('"',''), x[12].replace('"',''))
+
+
+def testa_equivalencia(modulo):
+    gerador = random.Random(6)
+    errados_split = 0
+    for i in range(LINHAS_EQUIVALENCIA):
+        z = gera_linha(gerador, i, True)
+        esperado = linha_csv(modulo, z)
+        assert modulo.parse_linha_receita(z) == esperado, z
+        x = next(csv.reader([z.rstrip('\r\n')], delimiter=';'))
+        try:
+            errados_split += split_antigo(z) != (x[BASICO] + x[ORDEM] + x[DV], x[SITUACAO], x[CNAE_P], x[CNAE_S])
+        except IndexError:
+            errados_split += 1
+    print(f'Equivalência com o csv em {LINHAS_EQUIVALENCIA} linhas difíceis: OK '
+          f'(split(\';\') antigo leu errado {errados_split} delas)')
+
+
+def benchmark(modulo, quantidade : int):
+    gerador = random.Random(1)
+    linhas = [gera_linha(gerador, i, gerador.random() < FRACAO_SEPARADOR) for i in range(quantidade)]
+    caminhos = (('split(\';\') antigo (texto)', lambda : [split_antigo(z) for z in linhas]),
+                ('csv (texto)', lambda : [(x[BASICO] + x[ORDEM] + x[DV], x[SITUACAO], x[CNAE_P], x[CNAE_S])
+                                          for x in csv.reader(linhas, delimiter=';')]),
+                ('csv (convertido)', lambda : [linha_csv(modulo, z) for z in linhas]),
+                ('parse_linha_receita (convertido)', lambda : [modulo.parse_linha_receita(z) for z in linhas]))
+    for nome, caminho in caminhos:
+        inicio = time.perf_counter()
+        caminho()
+        segundos = time.perf_counter() - inicio
+        print(f'{quantidade} linhas, {nome}: {segundos:.2f} s ({quantidade / segundos / 1000:.0f} mil linhas/s)')
+
+
+if __name__ == '__main__':
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    modulo = carrega_script()
+    testa_equivalencia(modulo)
+    benchmark(modulo, quantidade)
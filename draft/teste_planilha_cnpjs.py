@@ -0,0 +1,108 @@
+'''Benchmark da leitura da planilha de CNPJs determinados da ABECS (draft/31-08-2023.xlsx) pelo consulta_cnpj_v0.5.py
+
+antes: pd.read_excel com as 4 colunas como texto, dropna e df.values.tolist(), como o update_cnpjs_abecs() fazia
+depois: le_planilha_cnpjs(), openpyxl em modo somente leitura, linha a linha
+Duas etapas: só a leitura (as linhas do le_planilha_cnpjs() são contadas e descartadas, a lista antiga existe inteira)
+e a leitura entregando as linhas para o normaliza_cnpjs_abecs(), como no update_cnpjs_abecs()
+Cada medição roda em um processo separado, que mede o tempo e o aumento do pico de memória (RSS) depois do import,
+amostrando o RSS durante a leitura como o teste_memoria_receita.py
+No fim confere que os dois caminhos entregam as mesmas determinações normalizadas
+
+Uso: python "draft/teste_planilha_cnpjs.py" [planilha]'''
+
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Intervalo entre as amostras de RSS, em segundos
+INTERVALO_AMOSTRA = 0.005
+
+
+def carrega_script():
+    '''Importa o consulta_cnpj_v0.5.py da pasta main (o nome do arquivo não permite import direto)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    spec = importlib.util.spec_from_file_location('consulta_cnpj', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def rss_atual() -> float:
+    '''Memória (RSS) do processo agora, em MB: /proc no Linux, psutil nos outros sistemas'''
+
+    if os.path.isfile('/proc/self/statm'):
+        with open('/proc/self/statm', mode='r') as arq:
+            return int(arq.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    import psutil
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def leitura_antiga(modulo, path : str) -> list:
+    '''Leitura usada antes do le_planilha_cnpjs()'''
+
+    df = modulo.pd.read_excel(path, names=['CNPJ','MCC','TIPO','DATA'],usecols=[0,1,2,3], dtype={'CNPJ' : 'string', 'MCC' : 'string', 'TIPO' : 'string', 'DATA' : 'string'})
+    df.dropna(axis=0, how='any', inplace=True)
+    return df.values.tolist()
+
+
+# (caminho, etapa) -> função que lê a planilha, e na etapa 'normaliza' devolve as determinações normalizadas
+MEDICOES = {('antes', 'leitura') : lambda modulo, path : len(leitura_antiga(modulo, path)),
+            ('depois', 'leitura') : lambda modulo, path : sum(1 for _ in modulo.le_planilha_cnpjs(path)),
+            ('antes', 'normaliza') : lambda modulo, path : modulo.normaliza_cnpjs_abecs(leitura_antiga(modulo, path)),
+            ('depois', 'normaliza') : lambda modulo, path : modulo.normaliza_cnpjs_abecs(modulo.le_planilha_cnpjs(path))}
+
+
+def le(caminho : str, etapa : str, path : str, saida : str):
+    '''Processo filho: roda uma medição, grava o resultado em saida e mostra segundos e aumento do pico de RSS'''
+
+    modulo = carrega_script()
+    base = rss_atual()
+    amostras = [base]
+    lendo = True
+
+    def amostra():
+        while lendo:
+            amostras.append(rss_atual())
+            time.sleep(INTERVALO_AMOSTRA)
+
+    amostrador = threading.Thread(target=amostra, daemon=True)
+    amostrador.start()
+    inicio = time.perf_counter()
+    resultado = MEDICOES[(caminho, etapa)](modulo, path)
+    segundos = time.perf_counter() - inicio
+    amostras.append(rss_atual())
+    lendo = False
+    amostrador.join()
+    with open(saida, mode='w') as arq:
+        json.dump(resultado if etapa == 'leitura' else resultado.astype(str).values.tolist(), arq)
+    print(segundos, max(amostras) - base)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--ler']:
+        le(*sys.argv[2:6])
+        sys.exit()
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), '31-08-2023.xlsx')
+    print(f'{os.path.basename(path)} ({os.path.getsize(path) / 1024 ** 2:.1f} MB)')
+    resultados = dict()
+    for etapa in ('leitura', 'normaliza'):
+        print(f'{etapa}:' if etapa == 'leitura' else 'leitura + normaliza_cnpjs_abecs():')
+        for caminho, nome in (('antes', 'pd.read_excel + dropna + tolist'), ('depois', 'le_planilha_cnpjs()')):
+            saida = os.path.join(os.path.dirname(os.path.abspath(path)), f'.resultado_{caminho}_{etapa}.json')
+            processo = subprocess.run([sys.executable, os.path.abspath(__file__), '--ler', caminho, etapa, path, saida],
+                                      capture_output=True, text=True, check=True)
+            segundos, pico = (float(e) for e in processo.stdout.split()[-2:])
+            with open(saida, mode='r') as arq:
+                resultados[(caminho, etapa)] = json.load(arq)
+            os.remove(saida)
+            quantidade = resultados[(caminho, etapa)] if etapa == 'leitura' else len(resultados[(caminho, etapa)])
+            print(f'  {nome}: {quantidade} linhas, {segundos:.1f} s, pico de RSS +{pico:.0f} MB')
+    assert resultados[('antes', 'leitura')] == resultados[('depois', 'leitura')], 'Quantidade de linhas diferente'
+    assert resultados[('antes', 'normaliza')] == resultados[('depois', 'normaliza')], 'Determinações diferentes'
+    print('Mesmas determinações normalizadas nos dois caminhos: OK')
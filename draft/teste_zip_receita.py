@@ -0,0 +1,133 @@
+'''Benchmark da leitura dos arquivos de estabelecimentos da receita direto do .zip, contra extrair e depois ler
+
+Gera um Estabelecimentos0.zip sintético (um .ESTABELE dentro, com campos variados para não comprimir demais)
+e lê todas as linhas pelos dois caminhos do consulta_cnpj_v0.5.py, sem gravar no database:
+extração: descompacta o .ESTABELE para a pasta temp e apaga o .zip (como o extrai_zip()), depois lê pelos trechos do planeja_trechos()
+streaming: lê direto do .zip pelo abre_estabele(), sem arquivo extraído
+Mede o tempo de relógio e o pico de espaço usado na pasta temp, amostrando o tamanho da pasta durante a leitura
+O arquivo acabou de ser escrito, então está no cache do disco: a extração aqui é mais barata do que em um disco frio
+
+Uso: python "draft/teste_zip_receita.py" [linhas]'''
+
+import importlib.util
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from zipfile import ZipFile, ZIP_DEFLATED
+
+# Intervalo entre as amostras do tamanho da pasta temp, em segundos
+INTERVALO_AMOSTRA = 0.01
+
+
+def carrega_script():
+    '''Importa o consulta_cnpj_v0.5.py da pasta main (o nome do arquivo não permite import direto)'''
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main', 'consulta_cnpj_v0.5.py')
+    spec = importlib.util.spec_from_file_location('consulta_cnpj', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def gera_zip(path : str, linhas : int):
+    '''Grava um .zip com um arquivo no layout de Estabelecimentos da receita'''
+
+    gerador = random.Random(linhas)
+    palavras = ['PADARIA', 'MERCADO', 'AUTO', 'PECAS', 'BAR', 'RESTAURANTE', 'LOJA', 'COMERCIO', 'SERVICOS', 'LTDA']
+    with ZipFile(path, mode='w', compression=ZIP_DEFLATED) as arquivozip:
+        with arquivozip.open('K3241.K03200Y0.D40113.ESTABELE', mode='w') as membro:
+            bloco = list()
+            for i in range(linhas):
+                campos = [f'{gerador.randrange(10 ** 8):08d}', f'{gerador.randint(1, 9999):04d}', f'{gerador.randint(0, 99):02d}', '1',
+                          ' '.join(gerador.choices(palavras, k=3)), gerador.choice(['02', '04', '08']),
+                          f'20{gerador.randint(0, 23):02d}{gerador.randint(1, 12):02d}{gerador.randint(1, 28):02d}', '00', '', '',
+                          f'19{gerador.randint(50, 99)}0101', f'{gerador.randint(1000000, 9999999)}',
+                          ','.join(f'{gerador.randint(1000000, 9999999)}' for _ in range(gerador.randint(0, 3))),
+                          'RUA', ' '.join(gerador.choices(palavras, k=2)), f'{gerador.randint(1, 9999)}', '', 'CENTRO',
+                          f'{gerador.randrange(10 ** 8):08d}', 'SP', f'{gerador.randint(1000, 9999)}', '11',
+                          f'{gerador.randrange(10 ** 8):08d}', '', '', '', '', f'contato{i}@empresa.com', '', '']
+                bloco.append(';'.join(f'"{c}"' for c in campos) + '\n')
+                if len(bloco) == 100000:
+                    membro.write(''.join(bloco).encode('latin-1'))
+                    bloco = list()
+            membro.write(''.join(bloco).encode('latin-1'))
+
+
+def tamanho_pasta(pasta : str) -> int:
+    total = 0
+    for nome in os.listdir(pasta):
+        try:
+            total += os.path.getsize(os.path.join(pasta, nome))
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def le_trechos(modulo, arquivos : list) -> int:
+    linhas = 0
+    for trecho in modulo.planeja_trechos(arquivos):
+        for lote, lidas, erros in modulo.le_lotes_trecho(trecho):
+            linhas += lidas
+    return linhas
+
+
+def extrai_e_le(modulo, path_zip : str) -> int:
+    '''Mesmo caminho do extrai_zip() seguido da leitura do .ESTABELE'''
+
+    pasta = os.path.dirname(path_zip)
+    with ZipFile(path_zip) as arquivozip:
+        zip0 = arquivozip.infolist()[0]
+        zip0.filename = os.path.basename(path_zip)[:-4] + '.ESTABELE'
+        arquivozip.extract(zip0, path=pasta)
+    os.remove(path_zip)
+    return le_trechos(modulo, [os.path.join(pasta, zip0.filename)])
+
+
+def le_zip(modulo, path_zip : str) -> int:
+    return le_trechos(modulo, [path_zip])
+
+
+def mede(modulo, caminho, original : str, base : str) -> tuple:
+    '''Roda o caminho em uma pasta temp com uma cópia do .zip, retorna (linhas, segundos, pico da pasta temp em bytes)'''
+
+    pasta = os.path.join(base, caminho.__name__)
+    os.makedirs(pasta)
+    path_zip = os.path.join(pasta, os.path.basename(original))
+    shutil.copy(original, path_zip)
+    amostras = [tamanho_pasta(pasta)]
+    medindo = True
+
+    def amostra():
+        while medindo:
+            amostras.append(tamanho_pasta(pasta))
+            time.sleep(INTERVALO_AMOSTRA)
+
+    amostrador = threading.Thread(target=amostra, daemon=True)
+    amostrador.start()
+    inicio = time.perf_counter()
+    linhas = caminho(modulo, path_zip)
+    segundos = time.perf_counter() - inicio
+    medindo = False
+    amostrador.join()
+    shutil.rmtree(pasta)
+    return linhas, segundos, max(amostras)
+
+
+if __name__ == '__main__':
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    modulo = carrega_script()
+    with tempfile.TemporaryDirectory() as base:
+        original = os.path.join(base, 'Estabelecimentos0.zip')
+        gera_zip(original, quantidade)
+        with ZipFile(original) as arquivozip:
+            descompactado = arquivozip.infolist()[0].file_size
+        print(f'{quantidade} linhas: .zip de {os.path.getsize(original) / 1024 ** 2:.0f} MB, '
+              f'{descompactado / 1024 ** 2:.0f} MB descompactado')
+        for nome, caminho in (('extração e leitura', extrai_e_le), ('streaming do .zip', le_zip)):
+            linhas, segundos, pico = mede(modulo, caminho, original, base)
+            assert linhas == quantidade, linhas
+            print(f'{nome}: {segundos:.1f} s, pico da pasta temp {pico / 1024 ** 2:.0f} MB')
@@ -1,10 +1,20 @@
 import pandas as pd
+import numpy as np
 import sqlite3
 import PySimpleGUI as sg
 import wget
+import requests
 import os
+import io
+import re
+import html
+import csv
 import shutil
-from zipfile import ZipFile
+import json
+import hashlib
+from contextlib import contextmanager, nullcontext
+from zipfile import ZipFile, BadZipFile
+from openpyxl import load_workbook
 from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException
 from selenium.common.exceptions import NoSuchDriverException
@@ -14,6 +24,11 @@ from selenium.webdriver import ChromeService
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
 import time
+import multiprocessing
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, urljoin
 
 # by Lucas Staub
 # finalizado em 03/10/2023
@@ -25,7 +40,8 @@ import time
 # Utiliza uma GUI como front-end para consultas de SQL do database local
 
 # Limitações:
-# É necessário um webdriver atualizado para fazer o webscraping, ou os dados ficarão estáticos e desatualizados
+# O webscraping usa requests por padrão. O webdriver atualizado só é necessário se o requests não conseguir ler alguma página
+# (ou com 'motor_descoberta=selenium' no config.txt), sem nenhum dos dois os dados ficarão estáticos e desatualizados
 # Dados de CNPJ não são real-time, uma vez que a base é lida uma vez por mês
 # Se o layout dos dados da receita ou abecs mudar, tem que ajeitar o script!
 # XPATHs do webscraping podem quebrar, se isso acontecer, procure por 'XPATH' neste documento e altere eles.
@@ -35,15 +51,1317 @@ import time
 # Dá pra reduzir algumas funções e deixar o script melhor, além da GUI poder ser multithread, mas isso fica para uma v2
 # Se der problema no código em algum momento, mucho sorry, isso aqui é um puxadinho enquanto a API da ABECS não integra nos sistemas da Get
 
+# Quantidade de linhas dos arquivos da receita lidas por vez antes de inserir no database
+# Limita o uso de memória na leitura dos .ESTABELE, que têm vários GB cada
+# Pode ser alterado no config.txt com a linha: tamanho_lote=50000
+TAMANHO_LOTE_RECEITA = 50000
+# Lotes gravados entre cada checkpoint da carga da receita ('checkpoint_lotes=' no config.txt, 0 desliga)
+CHECKPOINT_LOTES_RECEITA = 20
+
+# Cache do SQLite durante a carga em massa, em KiB (valor negativo no PRAGMA cache_size) -> 1 GB
+CACHE_CARGA_KIB = 1048576
+
+# Layout compacto da table da receita:
+# CNPJ_RECEITA = 12 primeiros caracteres do CNPJ (raiz + ordem) como inteiro em base 36, cabe em 64 bits e já aceita o CNPJ alfanumérico
+# DV_RECEITA = 2 dígitos verificadores, situação cadastral e CNAE principal também como inteiros
+# CNAES_SECUNDARIOS_RECEITA = CNAEs secundários empacotados em 3 bytes cada (BLOB), ver empacota_cnaes()
+# WITHOUT ROWID deixa os registros guardados direto na ordem do CNPJ, sem um índice separado da primary key
+# Formatação em texto volta na hora da consulta, ver QUERY_CONSULTA
+DDL_DADOS_RECEITA = '''
+CREATE TABLE IF NOT EXISTS DADOS_RECEITA
+([CNPJ_RECEITA] INTEGER PRIMARY KEY, [DV_RECEITA] INTEGER, [SITUACAO_CADASTRAL_RECEITA] INTEGER, [CNAE_PRINCIPAL_RECEITA] INTEGER, [CNAES_SECUNDARIOS_RECEITA] BLOB)
+WITHOUT ROWID'''
+
+DIGITOS_BASE36 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def chave_cnpj(cnpj : str) -> int:
+    '''Converte os 12 primeiros caracteres do CNPJ na chave inteira da table DADOS_RECEITA
+
+    params
+    ------
+    cnpj : str
+        CNPJ sem formatação, numérico ou alfanumérico
+
+    returns
+    -------
+    int
+        Chave do CNPJ'''
+
+    return int(cnpj[:12], 36)
+
+
+def texto_cnpj(chave : int, dv : int) -> str:
+    '''Volta a chave e o dígito verificador da table DADOS_RECEITA para o CNPJ em texto, com 14 caracteres
+
+    params
+    ------
+    chave : int
+        Chave do CNPJ, gerada pelo chave_cnpj()
+    dv : int
+        Dígitos verificadores
+
+    returns
+    -------
+    str
+        CNPJ sem formatação'''
+
+    if chave is None:
+        return None
+    cnpj = ''
+    for _ in range(12):
+        chave, resto = divmod(chave, 36)
+        cnpj = DIGITOS_BASE36[resto] + cnpj
+    return f'{cnpj}{dv:02d}'
+
+
+def texto_cnae(cnae : int) -> str:
+    '''Volta o CNAE inteiro da table DADOS_RECEITA para o texto de 7 dígitos'''
+
+    if cnae is None:
+        return ''
+    return f'{cnae:07d}'
+
+
+def empacota_cnaes(cnaes : str) -> bytes:
+    '''Empacota a lista de CNAEs secundários da receita ('1234567,7654321') em 3 bytes por CNAE
+    CNAE tem 7 dígitos, então cabe em 24 bits. Lista vazia vira NULL, que não ocupa espaço no database
+
+    params
+    ------
+    cnaes : str
+        CNAEs separados por vírgula
+
+    returns
+    -------
+    bytes
+        CNAEs empacotados, ou None se não houverem CNAEs'''
+
+    pacote = b''.join(int(e).to_bytes(3, 'big') for e in cnaes.split(',') if e)
+    return pacote or None
+
+
+def texto_cnaes(pacote : bytes) -> str:
+    '''Volta os CNAEs empacotados pelo empacota_cnaes() para o texto separado por vírgulas'''
+
+    if not pacote:
+        return ''
+    return ','.join(f'{int.from_bytes(pacote[i:i+3], "big"):07d}' for i in range(0, len(pacote), 3))
+
+
+def faixa_raiz(raiz : str) -> tuple:
+    '''Faixa de chaves da table DADOS_RECEITA que começam com a raiz (ou qualquer início) de CNPJ
+
+    params
+    ------
+    raiz : str
+        Início do CNPJ, até 12 caracteres
+
+    returns
+    -------
+    tuple
+        Menor e maior chave da faixa'''
+
+    raiz = raiz[:12]
+    return (int(raiz.ljust(12, '0'), 36), int(raiz.ljust(12, 'Z'), 36))
+
+
+def registra_funcoes(connection : sqlite3.Connection):
+    '''Registra na conexão as funções usadas para formatar o layout compacto nas queries'''
+
+    connection.create_function('CNPJ_TEXTO', 2, texto_cnpj, deterministic=True)
+    connection.create_function('CNAE_TEXTO', 1, texto_cnae, deterministic=True)
+    connection.create_function('CNAES_TEXTO', 1, texto_cnaes, deterministic=True)
+
+
+def remove_database(path : str):
+    '''Apaga um database do SQLite junto com os arquivos -wal, -shm e -journal dele
+    Um -wal que sobrar de uma carga interrompida seria aplicado pelo SQLite no próximo database criado com o mesmo nome'''
+
+    for arquivo in (path, path + '-wal', path + '-shm', path + '-journal'):
+        if os.path.isfile(arquivo):
+            os.remove(arquivo)
+
+
+# Determinações de MCC das bandeiras (planilha de CNPJs da ABECS), uma linha por CNPJ/MCC/data de determinação
+# ORDEM_ABECS = linha da planilha, guarda a ordem original para montar os textos da view MCCS_DETERMINADOS
+# DATA_ABECS no formato 'AAAA-MM-DD HH:MM:SS', que ordena como texto: filtros por período usam o índice
+# Busca por CNPJ usa a primary key, busca por MCC (e período) usa o índice MCCS_DETERMINACOES_MCC, sem ler a table inteira
+DDL_MCCS_DETERMINACOES = '''
+CREATE TABLE IF NOT EXISTS {tabela}
+([CNPJ_ABECS] TEXT, [MCC_ABECS] TEXT, [TIPO_ABECS] TEXT, [DATA_ABECS] TEXT, [ORDEM_ABECS] INTEGER,
+PRIMARY KEY (CNPJ_ABECS, ORDEM_ABECS))
+WITHOUT ROWID'''
+
+INDICES_MCCS_DETERMINACOES = (
+'''CREATE INDEX IF NOT EXISTS MCCS_DETERMINACOES_MCC ON MCCS_DETERMINACOES (MCC_ABECS, DATA_ABECS)''',
+'''CREATE INDEX IF NOT EXISTS MCCS_DETERMINACOES_DATA ON MCCS_DETERMINACOES (DATA_ABECS)''')
+
+# MCCs e datas de determinação de um CNPJ juntados em texto, sem repetir e na ordem da planilha ('1234,5678' | 'data1 | data2')
+# O group_concat segue a ordem da subquery
+SQL_MCCS_CNPJ = '''(SELECT group_concat(MCC_ABECS, ',') FROM
+    (SELECT MCC_ABECS FROM MCCS_DETERMINACOES WHERE CNPJ_ABECS = {cnpj} GROUP BY MCC_ABECS ORDER BY MIN(ORDEM_ABECS)))'''
+SQL_DATAS_CNPJ = '''(SELECT group_concat(DATA_ABECS, ' | ') FROM
+    (SELECT DATA_ABECS FROM MCCS_DETERMINACOES WHERE CNPJ_ABECS = {cnpj} GROUP BY DATA_ABECS ORDER BY MIN(ORDEM_ABECS)))'''
+
+# Compatibilidade: MCCS_DETERMINADOS era uma table com um CNPJ por linha, os MCCs e datas juntados em texto
+# A view devolve as mesmas colunas, montadas a partir da MCCS_DETERMINACOES (tipo é o da primeira determinação do CNPJ)
+DDL_VIEW_MCCS_DETERMINADOS = f'''
+CREATE VIEW IF NOT EXISTS MCCS_DETERMINADOS AS
+SELECT PRIMEIRA.CNPJ_ABECS AS CNPJ_BANDEIRA_ABECS,
+{SQL_MCCS_CNPJ.format(cnpj='PRIMEIRA.CNPJ_ABECS')} AS MCC_BANDEIRA_ABECS,
+PRIMEIRA.TIPO_ABECS AS TIPO_ABECS,
+{SQL_DATAS_CNPJ.format(cnpj='PRIMEIRA.CNPJ_ABECS')} AS DATA_DETERMINACAO_ABECS
+FROM MCCS_DETERMINACOES AS PRIMEIRA
+WHERE PRIMEIRA.ORDEM_ABECS = (SELECT MIN(ORDEM_ABECS) FROM MCCS_DETERMINACOES WHERE CNPJ_ABECS = PRIMEIRA.CNPJ_ABECS)'''
+
+# De:para CNAE -> MCC da ABECS, uma linha por par CNAE/MCC: o MCC principal do CNAE e quantos MCCs alternativos a planilha tiver
+# CNAE_DEPARA_ABECS como inteiro, igual ao CNAE_PRINCIPAL_RECEITA da DADOS_RECEITA: a junção é direta, sem converter para texto
+# ORDEM_DEPARA_ABECS = 0 no principal, 1, 2... nos alternativos, na ordem da planilha
+# Busca por CNAE usa a primary key, busca por MCC usa o índice DEPARA_MCCS_MCC
+DDL_DEPARA_MCCS = '''
+CREATE TABLE IF NOT EXISTS {tabela}
+([CNAE_DEPARA_ABECS] INTEGER, [MCC_DEPARA_ABECS] TEXT, [PRINCIPAL_DEPARA_ABECS] INTEGER, [ORDEM_DEPARA_ABECS] INTEGER,
+PRIMARY KEY (CNAE_DEPARA_ABECS, MCC_DEPARA_ABECS))
+WITHOUT ROWID'''
+
+INDICES_DEPARA_MCCS = (
+'''CREATE INDEX IF NOT EXISTS DEPARA_MCCS_MCC ON DEPARA_MCCS (MCC_DEPARA_ABECS, PRINCIPAL_DEPARA_ABECS)''',)
+
+# Compatibilidade: DEPARA era uma table com um CNAE por linha e os MCCs alternativos juntados em texto ('1234,5678')
+DDL_VIEW_DEPARA = '''
+CREATE VIEW IF NOT EXISTS DEPARA AS
+SELECT printf('%07d', P.CNAE_DEPARA_ABECS) AS CNAE_PRINCIPAL_ABECS,
+P.MCC_DEPARA_ABECS AS MCC_PRINCIPAL_ABECS,
+COALESCE((SELECT group_concat(MCC_DEPARA_ABECS, ',') FROM
+    (SELECT MCC_DEPARA_ABECS FROM DEPARA_MCCS A
+    WHERE A.CNAE_DEPARA_ABECS = P.CNAE_DEPARA_ABECS AND A.PRINCIPAL_DEPARA_ABECS = 0 ORDER BY A.ORDEM_DEPARA_ABECS)), '') AS MCCS_SECUNDARIOS_ABECS
+FROM DEPARA_MCCS P
+WHERE P.PRINCIPAL_DEPARA_ABECS = 1'''
+
+# SHA-256 e hash das linhas da planilha carregada em cada fonte da ABECS, ver Dados.conteudo_carregado()
+# Gravado na mesma transação que troca a table da fonte: o registro fica sempre junto com os dados que descreve
+DDL_CONTEUDOS_ABECS = '''
+CREATE TABLE IF NOT EXISTS CONTEUDOS_ABECS
+([FONTE] TEXT PRIMARY KEY, [SHA256] TEXT, [LINHAS] TEXT)'''
+
+# Table carregada por cada fonte da ABECS
+TABELAS_ABECS = {'depara_abecs' : 'DEPARA_MCCS', 'lista_cnpj' : 'MCCS_DETERMINACOES'}
+
+# Índice do CNAE principal da receita, para ir do CNAE (ou do MCC, pelo DEPARA_MCCS) até os CNPJs sem ler a table inteira
+INDICES_DADOS_RECEITA = (
+'''CREATE INDEX IF NOT EXISTS DADOS_RECEITA_CNAE ON DADOS_RECEITA (CNAE_PRINCIPAL_RECEITA)''',)
+
+# Query base das consultas da GUI, o WHERE é adicionado por cada tipo de consulta
+QUERY_CONSULTA = f"""
+SELECT CNPJ_TEXTO(DADOS_RECEITA.CNPJ_RECEITA, DADOS_RECEITA.DV_RECEITA) AS CNPJ,
+
+CASE
+    WHEN SITUACAO_CADASTRAL_RECEITA = 1 THEN 'NULO'
+    WHEN SITUACAO_CADASTRAL_RECEITA = 2 THEN 'ATIVO'
+    WHEN SITUACAO_CADASTRAL_RECEITA = 3 THEN 'SUSPENSO'
+    WHEN SITUACAO_CADASTRAL_RECEITA = 4 THEN 'INAPTO'
+    WHEN SITUACAO_CADASTRAL_RECEITA = 8 THEN 'BAIXADO'
+    ELSE 'SITUAÇÃO NÃO ENCONTRADA'
+END AS SITUACAO_NOMINAL,
+
+-- MCCs das bandeiras só do CNPJ da linha, pela primary key da MCCS_DETERMINACOES
+COALESCE({SQL_MCCS_CNPJ.format(cnpj='CNPJ_TEXTO(DADOS_RECEITA.CNPJ_RECEITA, DADOS_RECEITA.DV_RECEITA)')}, '') AS MCC_BANDEIRA,
+
+DEPARA_MCCS.MCC_DEPARA_ABECS AS MCC_PRINCIPAL_ABECS,
+CNAE_TEXTO(CNAE_PRINCIPAL_RECEITA),
+CNAES_TEXTO(CNAES_SECUNDARIOS_RECEITA)
+
+FROM DADOS_RECEITA 
+
+LEFT JOIN DEPARA_MCCS
+ON DEPARA_MCCS.CNAE_DEPARA_ABECS = DADOS_RECEITA.CNAE_PRINCIPAL_RECEITA AND DEPARA_MCCS.PRINCIPAL_DEPARA_ABECS = 1
+"""
+
+# Consulta dos CNPJs cujo CNAE principal tem o MCC (principal ou alternativo) no de:para da ABECS
+# MCC -> CNAEs pelo índice DEPARA_MCCS_MCC, CNAE -> CNPJs pelo índice DADOS_RECEITA_CNAE
+# Um MCC comum pode ter milhões de CNPJs: a GUI mostra só os primeiros LIMITE_CONSULTA_MCC
+QUERY_CONSULTA_MCC = QUERY_CONSULTA + """
+WHERE DADOS_RECEITA.CNAE_PRINCIPAL_RECEITA IN (SELECT CNAE_DEPARA_ABECS FROM DEPARA_MCCS WHERE MCC_DEPARA_ABECS = ?)
+LIMIT ?"""
+LIMITE_CONSULTA_MCC = 10000
+
+# Tamanho de cada trecho dos .ESTABELE extraídos processado por um worker, em bytes
+# Arquivos .zip não podem ser lidos a partir do meio, então cada .zip é um trecho inteiro
+TAMANHO_TRECHO_BYTES = 256 * 1024 * 1024
+
+# Posição (a partir de 0) dos campos usados no arquivo de estabelecimentos, conforme o dicionário de dados da receita
+# ('draft/dicionario de dados receita.pdf'). Se o layout da receita mudar, ajustar aqui,
+# ou no config.txt sem mexer no script: 'colunas_receita=situacao_cadastral:6,cnae_fiscal_principal:12' (campos não citados ficam como aqui)
+COLUNAS_RECEITA = {
+    'cnpj_basico' : 0,
+    'cnpj_ordem' : 1,
+    'cnpj_dv' : 2,
+    'situacao_cadastral' : 5,
+    'cnae_fiscal_principal' : 11,
+    'cnae_fiscal_secundaria' : 12}
+
+# Fila de lotes dos workers para o processo que escreve no database, criada no initializer do Pool
+_fila_lotes = None
+
+
+@contextmanager
+def abre_estabele(arquivo : str):
+    '''Abre um arquivo de estabelecimentos da receita para leitura de texto
+    Se for um .zip, descompacta em streaming o primeiro arquivo de dentro dele, sem extrair para o disco
+
+    params
+    ------
+    arquivo : str
+        Caminho do arquivo .ESTABELE ou .zip
+
+    returns
+    -------
+    io.TextIOBase
+        Arquivo de texto aberto, lido linha a linha'''
+
+    if arquivo.endswith('.zip'):
+        with ZipFile(arquivo) as arquivozip:
+            with arquivozip.open(arquivozip.infolist()[0]) as membro:
+                yield io.TextIOWrapper(membro, encoding='latin-1') # encoding vigente é 'latin-1' -> outubro_2023
+    else:
+        with open(arquivo, mode='r', encoding='latin-1') as arq:
+            yield arq
+
+
+def indices_colunas(colunas : dict) -> tuple:
+    '''Converte o mapa de colunas em uma tupla de posições, na ordem usada pelo parse_linha_receita()
+    A última posição da tupla é a maior coluna usada, até onde a linha precisa ser separada
+
+    params
+    ------
+    colunas : dict
+        Posição de cada campo usado na linha, ver COLUNAS_RECEITA
+
+    returns
+    -------
+    tuple
+        (cnpj_basico, cnpj_ordem, cnpj_dv, situacao_cadastral, cnae_fiscal_principal, cnae_fiscal_secundaria, maior coluna)'''
+
+    campos = ('cnpj_basico', 'cnpj_ordem', 'cnpj_dv', 'situacao_cadastral', 'cnae_fiscal_principal', 'cnae_fiscal_secundaria')
+    return tuple(colunas[e] for e in campos) + (max(colunas[e] for e in campos),)
+
+
+INDICES_RECEITA = indices_colunas(COLUNAS_RECEITA)
+
+
+def le_colunas_receita(texto : str) -> dict:
+    '''Lê o mapa de colunas da configuração 'colunas_receita=' do config.txt, por cima do COLUNAS_RECEITA
+
+    params
+    ------
+    texto : str
+        Pares 'campo:posição' separados por vírgula, ex.: 'situacao_cadastral:6,cnae_fiscal_principal:12'
+
+    returns
+    -------
+    dict
+        Posição de cada campo usado na linha, no formato do COLUNAS_RECEITA'''
+
+    colunas = dict(COLUNAS_RECEITA)
+    for par in texto.split(','):
+        if not par.strip():
+            continue
+        campo, _, posicao = par.partition(':')
+        campo = campo.strip()
+        if campo not in COLUNAS_RECEITA:
+            raise ValueError(f"Campo desconhecido em 'colunas_receita=' no config.txt: {campo}")
+        if not posicao.strip().isdigit():
+            raise ValueError(f"Posição inválida para {campo} em 'colunas_receita=' no config.txt: {posicao}")
+        colunas[campo] = int(posicao)
+    return colunas
+
+
+def parse_linha_receita(z : str, indices : tuple = INDICES_RECEITA) -> tuple:
+    '''Separa os campos usados de uma linha do arquivo de estabelecimentos
+
+    No layout da receita todos os campos vêm entre aspas, separados por ';'. O separador real é então '";"',
+    e um ';' dentro do nome fantasia ou logradouro não quebra a linha. Se houver aspas dentro dos campos usados, vale o csv.
+    O split para logo depois da última coluna usada, o resto da linha não vira string.
+    Linhas fora desse padrão vão para o módulo csv, que é mais lento mas entende as aspas.
+
+    params
+    ------
+    z : str
+        Linha do arquivo
+    indices : tuple
+        Posições dos campos, gerada pelo indices_colunas()
+
+    returns
+    -------
+    tuple
+        (chave do cnpj, dv, situacao, cnae_p, cnae_s), no layout da table DADOS_RECEITA'''
+
+    basico, ordem, dv, situacao, cnae_p, cnae_s, ultima = indices
+    x = z.split('";"', ultima + 1)
+    # Até a última coluna usada, cada campo tem que ter só as 2 aspas de fora. Aspas dentro de um campo vêm dobradas
+    # e podem formar um '";"' que não é separador (ex.: "BAR "";"" DO ZE"), então essas linhas vão para o csv
+    fim = len(z) - len(x[ultima + 1]) - 2 if len(x) > ultima + 1 else len(z)
+    if len(x) > ultima and z[:1] == '"' and z.count('"', 0, fim) == 2 * ultima + 2:
+        # Tira a aspa de abertura do primeiro campo
+        x[0] = x[0][1:]
+        # Se a última coluna usada é o último campo da linha, tira a aspa de fechamento e a quebra de linha
+        if len(x) == ultima + 1:
+            x[ultima] = x[ultima].rstrip('\r\n')[:-1]
+    else:
+        x = next(csv.reader([z.rstrip('\r\n')], delimiter=';'))
+    cnpj = x[basico] + x[ordem] + x[dv]
+    if len(cnpj) != 14:
+        raise ValueError(f'CNPJ inválido: {cnpj}')
+    # Já converte para o layout compacto da table DADOS_RECEITA
+    return (chave_cnpj(cnpj), int(cnpj[12:]), int(x[situacao]), int(x[cnae_p]) if x[cnae_p] else None, empacota_cnaes(x[cnae_s]))
+
+
+# Checkpoints da carga da receita no database novo: quantas linhas de cada trecho já foram gravadas
+DDL_CARGA_RECEITA = '''CREATE TABLE IF NOT EXISTS CARGA_RECEITA ([ARQUIVO] TEXT, [INICIO] INTEGER, [LINHAS] INTEGER,
+                    [ERROS] INTEGER, [CONCLUIDO] INTEGER, PRIMARY KEY ([ARQUIVO], [INICIO])) WITHOUT ROWID'''
+# Versão da receita que está sendo carregada, checkpoints de outra versão não servem
+DDL_CARGA_RECEITA_INFO = '''CREATE TABLE IF NOT EXISTS CARGA_RECEITA_INFO ([ID] INTEGER PRIMARY KEY, [VERSAO] TEXT)'''
+
+
+def chave_trecho(trecho : tuple) -> tuple:
+    '''Identifica um trecho nos checkpoints pelo nome do arquivo e byte inicial, sem a pasta'''
+
+    return (os.path.basename(trecho[0]), trecho[1])
+
+
+def planeja_trechos(arquivos : list, tamanho_trecho : int = TAMANHO_TRECHO_BYTES) -> list:
+    '''Divide os arquivos da receita em trechos independentes, que podem ser processados em paralelo
+    Os cortes dos .ESTABELE caem sempre no fim de uma linha
+
+    params
+    ------
+    arquivos : list
+        Caminhos dos arquivos .ESTABELE ou .zip
+    tamanho_trecho : int
+        Tamanho aproximado de cada trecho, em bytes
+
+    returns
+    -------
+    list
+        Lista de tuplas (arquivo, byte inicial, byte final), byte final é None para ler até o fim do arquivo'''
+
+    trechos = list()
+    for arquivo in arquivos:
+        if arquivo.endswith('.zip'):
+            trechos.append((arquivo, 0, None))
+            continue
+        tamanho = os.path.getsize(arquivo)
+        inicio = 0
+        with open(arquivo, mode='rb') as arq:
+            while inicio < tamanho:
+                # Anda até o próximo fim de linha depois do corte
+                arq.seek(min(inicio + tamanho_trecho, tamanho))
+                arq.readline()
+                fim = min(arq.tell(), tamanho)
+                trechos.append((arquivo, inicio, fim))
+                inicio = fim
+    return trechos
+
+
+def le_lotes_trecho(trecho : tuple, tamanho_lote : int = TAMANHO_LOTE_RECEITA, pular : int = 0, indices : tuple = INDICES_RECEITA):
+    '''Lê um trecho de um arquivo da receita linha a linha, sem carregar o arquivo inteiro na memória,
+    e entrega os registros em lotes de no máximo tamanho_lote linhas
+
+    params
+    ------
+    trecho : tuple
+        (arquivo, byte inicial, byte final), como gerado pelo planeja_trechos()
+    tamanho_lote : int
+        Quantidade máxima de linhas por lote
+    pular : int
+        Linhas do começo do trecho que já foram gravadas em uma carga anterior, são puladas sem processar
+    indices : tuple
+        Posições dos campos, gerada pelo indices_colunas()
+
+    returns
+    -------
+    generator
+        Tuplas (lote, linhas lidas, linhas com erro), onde lote é uma lista de registros da table DADOS_RECEITA'''
+
+    arquivo, inicio, fim = trecho
+    lote = list()
+    linhas = 0
+    erros = 0
+    if fim is None:
+        contexto = abre_estabele(arquivo)
+    else:
+        contexto = open(arquivo, mode='rb')
+    with contexto as arq:
+        if fim is not None:
+            arq.seek(inicio)
+        posicao = inicio
+        # Iterar direto no arquivo lê uma linha por vez, readlines() colocaria o arquivo inteiro (vários GB) na memória
+        for z in arq:
+            if fim is not None:
+                if posicao >= fim:
+                    break
+                posicao += len(z)
+            if pular:
+                pular -= 1
+                continue
+            if fim is not None:
+                z = z.decode('latin-1') # encoding vigente é 'latin-1' -> outubro_2023
+            linhas += 1
+            try:
+                lote.append(parse_linha_receita(z, indices))
+            except:
+                erros += 1
+            # Lote cheio, entrega para o insert e começa outro
+            if linhas == tamanho_lote:
+                yield (lote, linhas, erros)
+                lote = list()
+                linhas = 0
+                erros = 0
+    # Sobra do último lote
+    if linhas:
+        yield (lote, linhas, erros)
+
+
+def _inicia_worker(fila):
+    '''Initializer do Pool: guarda a fila de lotes no processo do worker'''
+
+    global _fila_lotes
+    _fila_lotes = fila
+
+
+def _processa_trecho(trecho : tuple, tamanho_lote : int, pular : int = 0, indices : tuple = INDICES_RECEITA):
+    '''Worker: processa um trecho e manda os lotes para a fila do processo que escreve no database
+    Fila tem tamanho limitado, se o database não der conta o worker espera, e a memória não cresce
+
+    Mensagens na fila:
+    ('lote', lote, linhas, erros, trecho) para cada lote
+    ('fim', segundos processando, concluído, 0, trecho) ao terminar o trecho, mesmo se der erro'''
+
+    inicio = time.perf_counter()
+    espera = 0
+    concluido = False
+    try:
+        for lote, linhas, erros in le_lotes_trecho(trecho, tamanho_lote, pular, indices):
+            # Tempo esperando a fila liberar não conta como tempo de parsing
+            inicio_espera = time.perf_counter()
+            _fila_lotes.put(('lote', lote, linhas, erros, trecho))
+            espera += time.perf_counter() - inicio_espera
+        concluido = True
+    finally:
+        _fila_lotes.put(('fim', time.perf_counter() - inicio - espera, concluido, 0, trecho))
+
+
+def itera_fila(fila : queue.Queue):
+    '''Itera pelos itens de uma fila entre etapas do update, até receber None (fim da etapa anterior)'''
+
+    while True:
+        item = fila.get()
+        if item is None:
+            return
+        yield item
+
+
+# Downloads da receita: arquivos baixados em paralelo, com limite de conexões por servidor
+URL_RECEITA = 'https://dadosabertos.rfb.gov.br/CNPJ/'
+# API do dados.gov.br com a descrição do conjunto de dados de CNPJ, onde fica a data da última versão
+URL_API_RECEITA = 'https://dados.gov.br/api/publico/conjuntos-dados/cadastro-nacional-da-pessoa-juridica---cnpj'
+# Página do mesmo conjunto de dados, lida pelo navegador (Browser) quando o selenium é usado
+URL_PAGINA_RECEITA = 'https://dados.gov.br/dados/conjuntos-dados/cadastro-nacional-da-pessoa-juridica---cnpj'
+# Página da ABECS com os links das planilhas, usada para saber se elas mudaram
+URL_ABECS = 'https://www.abecs.org.br/consulta-mcc-individual'
+# Resultado de uma página de versões (receita ou ABECS) já buscada vale por esse tempo, em segundos, sem buscar de novo
+TTL_DESCOBERTA = 15 * 60
+
+# Update em segundo plano: verifica as fontes a cada 'intervalo_update=' horas do config.txt (0 verifica só ao abrir o programa)
+# Ciclo que falhar é repetido depois de ESPERA_ERRO_UPDATE segundos, e a espera dobra a cada nova falha,
+# até o intervalo normal ou ESPERA_MAXIMA_ERRO_UPDATE, o que for menor
+INTERVALO_UPDATE_HORAS = 24
+ESPERA_ERRO_UPDATE = 5 * 60
+ESPERA_MAXIMA_ERRO_UPDATE = 6 * 3600
+DOWNLOADS_PARALELOS = 4
+CONEXOES_POR_HOST = 4
+TAMANHO_BLOCO_DOWNLOAD = 1024 * 1024
+TIMEOUT_DOWNLOAD = 60
+# Tentativas de continuar um download que caiu, com espera crescente entre elas
+TENTATIVAS_DOWNLOAD = 8
+# Arquivos a partir desse tamanho podem ser baixados em pedaços ('segmentos_download=' no config.txt)
+SEGMENTOS_DOWNLOAD = 1
+TAMANHO_MINIMO_SEGMENTADO = 64 * 1024 * 1024
+
+
+class DownloadInterrompido(Exception):
+    '''Download parado de propósito (ex: pipeline_receita() parou por erro na inserção), o .part fica para continuar depois'''
+
+
+class ProgressoDownload():
+    '''Progresso compartilhado entre os downloads em paralelo, mostrado em uma linha só no console
+    Se o evento parar for acionado, o próximo bloco de cada download levanta DownloadInterrompido'''
+    def __init__(self, total_arquivos : int, parar : threading.Event = None):
+        self.lock = threading.Lock()
+        self.parar = parar or threading.Event()
+        self.total_arquivos = total_arquivos
+        self.concluidos = 0
+        self.tamanhos = dict()
+        self.baixados = dict()
+        # Bytes que já estavam no .part quando o programa abriu, não entram na velocidade
+        self.retomados = dict()
+        self.inicio = time.perf_counter()
+        self.ultima_atualizacao = 0
+
+    def inicia(self, arquivo : str, tamanho : int, baixado : int = 0):
+        with self.lock:
+            self.tamanhos[arquivo] = tamanho
+            self.baixados[arquivo] = baixado
+            self.retomados.setdefault(arquivo, baixado)
+
+    def avanca(self, arquivo : str, n : int):
+        if self.parar.is_set():
+            raise DownloadInterrompido(arquivo)
+        with self.lock:
+            self.baixados[arquivo] += n
+            # Atualiza a linha no máximo uma vez por segundo
+            if time.perf_counter() - self.ultima_atualizacao >= 1:
+                self.mostra()
+
+    def termina(self, arquivo : str):
+        with self.lock:
+            self.concluidos += 1
+            self.mostra()
+
+    def mostra(self):
+        '''Mostra arquivos concluídos, MB baixados e velocidade somada de todos os downloads, chamar com o lock'''
+
+        self.ultima_atualizacao = time.perf_counter()
+        baixado = sum(self.baixados.values()) / 1024 ** 2
+        total = sum(self.tamanhos.values()) / 1024 ** 2
+        velocidade = (baixado - sum(self.retomados.values()) / 1024 ** 2) / max(self.ultima_atualizacao - self.inicio, 0.001)
+        print(f'\rArquivos: {self.concluidos}/{self.total_arquivos} | {baixado:.0f}/{total:.0f} MB | {velocidade:.1f} MB/s   ', end='', flush=True)
+
+
+def hash_arquivo(path : str):
+    '''SHA-256 de um arquivo já em disco, lido em blocos
+
+    returns
+    -------
+    hashlib._Hash
+        Hash ainda aberto, pode continuar recebendo blocos com update()'''
+
+    sha256 = hashlib.sha256()
+    with open(path, mode='rb') as arq:
+        for bloco in iter(lambda : arq.read(TAMANHO_BLOCO_DOWNLOAD), b''):
+            sha256.update(bloco)
+    return sha256
+
+
+def hash_linhas(linhas) -> str:
+    '''SHA-256 das linhas lidas de uma planilha, na ordem
+    A mesma planilha salva de novo (outra data interna do .xlsx, outra formatação) muda o SHA-256 do arquivo, mas não o das linhas
+
+    params
+    ------
+    linhas : iterable
+        Linhas como tuplas ou listas
+
+    returns
+    -------
+    str
+        SHA-256 em hexadecimal'''
+
+    sha256 = hashlib.sha256()
+    for linha in linhas:
+        sha256.update(('\x1f'.join(map(str, linha)) + '\n').encode())
+    return sha256.hexdigest()
+
+
+def zip_integro(path : str) -> bool:
+    '''Confere se o .zip abre e tem arquivos dentro
+    Só lê o diretório no fim do arquivo, pega downloads cortados e páginas de erro salvas como .zip'''
+
+    try:
+        with ZipFile(path) as arquivozip:
+            return bool(arquivozip.infolist())
+    except (BadZipFile, OSError):
+        return False
+
+
+class Manifesto():
+    '''Tamanho e SHA-256 dos arquivos baixados, guardados em um .json na mesma pasta
+    Arquivo com o mesmo tamanho e data de modificação do manifesto já foi conferido, e não é lido de novo'''
+    def __init__(self, path : str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.arquivos = dict()
+        # Sem path, o manifesto fica só na memória
+        if path and os.path.isfile(path):
+            with open(path, mode='r') as arq:
+                self.arquivos = json.load(arq)
+
+    def salva(self):
+        '''Grava o manifesto, chamar com o lock'''
+
+        if not self.path:
+            return
+        with open(self.path + '.tmp', mode='w') as arq:
+            json.dump(self.arquivos, arq, indent=4)
+        os.replace(self.path + '.tmp', self.path)
+
+    def registra(self, arquivo : str, sha256 : str):
+        info = os.stat(arquivo)
+        with self.lock:
+            self.arquivos[os.path.basename(arquivo)] = {'tamanho' : info.st_size, 'sha256' : sha256, 'modificado' : info.st_mtime_ns}
+            self.salva()
+
+    def remove(self, arquivo : str):
+        with self.lock:
+            if self.arquivos.pop(os.path.basename(arquivo), None) is not None:
+                self.salva()
+
+    def confere(self, arquivo : str) -> bool:
+        '''Confere um arquivo que já estava baixado
+
+        Mesmo tamanho e data do manifesto: já conferido, não lê o arquivo
+        Data diferente: recalcula o SHA-256 e compara com o do manifesto
+        Fora do manifesto (baixado por uma versão anterior do programa): confere o .zip e registra
+
+        returns
+        -------
+        bool
+            False se o arquivo estiver corrompido e precisar ser baixado de novo'''
+
+        info = os.stat(arquivo)
+        registro = self.arquivos.get(os.path.basename(arquivo))
+        if registro and registro['tamanho'] == info.st_size and registro['modificado'] == info.st_mtime_ns:
+            return True
+        if registro and registro['tamanho'] != info.st_size:
+            return False
+        sha256 = hash_arquivo(arquivo).hexdigest()
+        if registro:
+            integro = registro['sha256'] == sha256
+        else:
+            integro = zip_integro(arquivo)
+        if integro:
+            self.registra(arquivo, sha256)
+        return integro
+
+
+# Descrição das versões publicadas, lida do texto das páginas com padrões compilados uma vez só
+# Datas no formato dd/mm/aaaa (descrição da base da receita)
+# Pelo lookahead as datas podem se sobrepor ('01/02/200301/02/2004'), como na busca caractere a caractere que o padrão substituiu
+PADRAO_DATA = re.compile(r'(?=([0-9]{2}/[0-9]{2}/[0-9]{4}))')
+# Links dos arquivos: .zip da receita na listagem da pasta, .xlsx na página da ABECS
+PADRAO_ARQUIVO_RECEITA = re.compile(r'href="([^"]*Estabelecimentos(\d+)\.zip)"')
+PADRAO_PLANILHA = re.compile(r'href="([^"]+\.xlsx(?:\?[^"]*)?)"', re.IGNORECASE)
+# Tamanho na listagem de pasta do servidor, depois da data de modificação: '2024-01-12 10:35  503M'
+PADRAO_TAMANHO = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}\s+(\d+(?:\.\d+)?)([KMGT]?)(?![\w.])')
+PADRAO_TAG = re.compile(r'<[^>]*>')
+# Pasta do upload nos links das planilhas da ABECS: '/wp-content/uploads/2023/09/31-08-2023.xlsx'
+PADRAO_PASTA_UPLOAD = re.compile(r'/uploads/(\d{4})/(\d{2})/')
+UNIDADES_TAMANHO = {'' : 1, 'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3, 'T' : 1024 ** 4}
+
+
+def descreve_versao(texto : str, url_base : str = '', padrao_arquivo : re.Pattern = PADRAO_ARQUIVO_RECEITA) -> dict:
+    '''Lê de uma página a data da versão publicada, os links dos arquivos e o tamanho de cada um
+
+    params
+    ------
+    texto : str
+        Conteúdo da página (html, ou texto da descrição da base)
+    url_base : str
+        Url da página, para os links relativos virarem absolutos
+    padrao_arquivo : re.Pattern
+        Padrão dos links dos arquivos, o grupo 1 é o link
+
+    returns
+    -------
+    dict
+        'data' : última data dd/mm/aaaa do texto, None se não houver
+        'arquivos' : urls dos arquivos, na ordem da página e sem repetir
+        'tamanhos' : {url : bytes} pela listagem da pasta (arredondado pelo servidor), None se a página não mostrar'''
+
+    datas = PADRAO_DATA.findall(texto)
+    links = list(padrao_arquivo.finditer(texto))
+    arquivos = list()
+    tamanhos = dict()
+    for i, link in enumerate(links):
+        url = urljoin(url_base, html.unescape(link.group(1)))
+        if url in tamanhos:
+            continue
+        # O tamanho fica entre este link e o próximo
+        trecho = PADRAO_TAG.sub(' ', texto[link.end() : links[i+1].start() if i + 1 < len(links) else len(texto)])
+        tamanho = PADRAO_TAMANHO.search(trecho)
+        arquivos.append(url)
+        tamanhos[url] = int(float(tamanho.group(1)) * UNIDADES_TAMANHO[tamanho.group(2)]) if tamanho else None
+    return {'data' : datas[-1] if datas else None, 'arquivos' : arquivos, 'tamanhos' : tamanhos}
+
+
+def ultima_data(texto : str) -> str:
+    '''Última data no formato 'dd/mm/aaaa' do texto, configuração atual da descrição da base da receita está disposta assim (outubro_2023)'''
+
+    data = descreve_versao(texto)['data']
+    if data is None:
+        raise ValueError('Nenhuma data encontrada na descrição da base da receita')
+    return data
+
+
+def data_versao(versao : str) -> tuple:
+    '''Data de uma versão do config.txt, para comparar versões: (ano, mês, dia)
+    Receita vem como 'dd/mm/aaaa'. As planilhas da ABECS são links, a data é a pasta do upload ('/uploads/aaaa/mm/'), sem o dia
+
+    params
+    ------
+    versao : str
+        Versão de uma fonte, como no config.txt
+
+    returns
+    -------
+    tuple
+        (ano, mês, dia), dia 0 se não houver. None se a versão não tiver data (ex: 'nula')'''
+
+    data = descreve_versao(versao)['data']
+    if data is not None:
+        dia, mes, ano = data.split('/')
+        return (int(ano), int(mes), int(dia))
+    pasta = PADRAO_PASTA_UPLOAD.search(versao)
+    if pasta is not None:
+        return (int(pasta.group(1)), int(pasta.group(2)), 0)
+    return None
+
+
+def versao_anterior(versao : str, vigente : str) -> bool:
+    '''True se a versão é mais antiga que a vigente, pelo data_versao(). Sem data na versão não dá para saber, e conta como mais antiga
+    Vigente sem data (ex: 'nula') aceita qualquer versão'''
+
+    data_vigente = data_versao(vigente)
+    if data_vigente is None:
+        return False
+    data = data_versao(versao)
+    return data is None or data < data_vigente
+
+
+def lista_arquivos_receita(url_base : str = URL_RECEITA) -> list:
+    '''Busca a lista de arquivos Estabelecimentos(n).zip na página da receita, antes de começar os downloads
+    Se a página não listar os arquivos, testa Estabelecimentos0.zip, Estabelecimentos1.zip... por HEAD até um não existir
+
+    params
+    ------
+    url_base : str
+        Pasta da receita com os arquivos de CNPJ
+
+    returns
+    -------
+    list
+        Lista de tuplas (número do arquivo, url), em ordem'''
+
+    try:
+        r = requests.get(url_base, timeout=TIMEOUT_DOWNLOAD)
+        r.raise_for_status()
+        arquivos = descreve_versao(r.text, r.url)['arquivos']
+    except requests.RequestException:
+        arquivos = list()
+    if arquivos:
+        return sorted((int(re.search(r'(\d+)\.zip$', url).group(1)), url) for url in arquivos)
+
+    arquivos = list()
+    while True:
+        url = f'{url_base}Estabelecimentos{len(arquivos)}.zip'
+        try:
+            if requests.head(url, timeout=TIMEOUT_DOWNLOAD, allow_redirects=True).status_code != 200:
+                break
+        except requests.RequestException:
+            break
+        arquivos.append((len(arquivos), url))
+    return arquivos
+
+
+def baixa_segmentado(url : str, destino : str, tamanho : int, progresso : ProgressoDownload,
+                     limite_host : threading.BoundedSemaphore, segmentos : int, manifesto : Manifesto = None) -> str:
+    '''Baixa um arquivo grande em vários pedaços ao mesmo tempo, cada um por uma conexão com Range
+    O servidor da receita limita a velocidade por conexão, então N conexões no mesmo arquivo baixam até N vezes mais rápido
+
+    O arquivo é criado com o tamanho final (.seg) e cada pedaço escreve na sua posição.
+    Quanto cada pedaço já baixou fica em um .seg.json: se o programa fechar, cada pedaço continua de onde parou.
+    Um pedaço que falha é tentado de novo sozinho, sem perder os outros
+    O SHA-256 anda junto com o começo contínuo do arquivo: os blocos que chegam nessa posição entram direto no hash,
+    e os pedaços que chegaram antes da vez deles são lidos de volta do cache do disco logo depois de escritos
+
+    params
+    ------
+    url : str
+        Url do arquivo
+    destino : str
+        Caminho final do arquivo
+    tamanho : int
+        Tamanho do arquivo no servidor
+    progresso : ProgressoDownload
+        Progresso compartilhado entre os downloads
+    limite_host : threading.BoundedSemaphore
+        Limite de conexões ao mesmo servidor, vale para cada pedaço
+    segmentos : int
+        Quantidade de pedaços
+    manifesto : Manifesto
+        Onde registrar o tamanho e SHA-256 do arquivo baixado
+
+    returns
+    -------
+    str
+        Caminho final do arquivo'''
+
+    parcial = destino + '.seg'
+    path_estado = parcial + '.json'
+    estado = None
+    if os.path.isfile(parcial) and os.path.isfile(path_estado):
+        with open(path_estado, mode='r') as arq:
+            estado = json.load(arq)
+        # Pedaços de outra versão do arquivo não servem
+        if estado['tamanho'] != tamanho or os.path.getsize(parcial) != tamanho:
+            estado = None
+    if estado is None:
+        # Pedaços [inicio, fim, bytes baixados], fim incluso como no header Range
+        passo = -(-tamanho // segmentos)
+        estado = {'tamanho' : tamanho,
+                  'pedacos' : [[inicio, min(inicio + passo, tamanho) - 1, 0] for inicio in range(0, tamanho, passo)]}
+        # Reserva o espaço do arquivo inteiro de uma vez
+        with open(parcial, mode='wb') as arq:
+            arq.truncate(tamanho)
+    lock = threading.Lock()
+    sha256 = hashlib.sha256()
+    # Bytes do começo do arquivo que já entraram no hash
+    cursor = [0]
+    leitor = open(parcial, mode='rb')
+
+    def avanca_hash(posicao : int, bloco : bytes):
+        '''Coloca no hash tudo que já é contínuo a partir do cursor, chamar com o lock'''
+        if posicao == cursor[0]:
+            sha256.update(bloco)
+            cursor[0] += len(bloco)
+        for inicio, fim, baixado in estado['pedacos']:
+            if cursor[0] > fim:
+                continue
+            while cursor[0] < inicio + baixado:
+                leitor.seek(cursor[0])
+                lido = leitor.read(min(TAMANHO_BLOCO_DOWNLOAD, inicio + baixado - cursor[0]))
+                sha256.update(lido)
+                cursor[0] += len(lido)
+            if cursor[0] <= fim:
+                break
+
+    def salva_estado():
+        with open(path_estado + '.tmp', mode='w') as arq:
+            json.dump(estado, arq)
+        os.replace(path_estado + '.tmp', path_estado)
+
+    def baixa_pedaco(pedaco : list):
+        for tentativa in range(TENTATIVAS_DOWNLOAD):
+            inicio, fim, baixado = pedaco
+            if inicio + baixado > fim:
+                return
+            try:
+                with limite_host:
+                    with requests.get(url, stream=True, timeout=TIMEOUT_DOWNLOAD,
+                                      headers={'Range' : f'bytes={inicio + baixado}-{fim}'}) as r:
+                        r.raise_for_status()
+                        if r.status_code != 206:
+                            raise IOError(f'servidor não aceitou o Range do pedaço {inicio}-{fim}')
+                        with open(parcial, mode='r+b') as arq:
+                            arq.seek(inicio + baixado)
+                            nao_salvo = 0
+                            for bloco in r.iter_content(TAMANHO_BLOCO_DOWNLOAD):
+                                # Pedaço nunca escreve além do fim, mesmo se o servidor mandar mais
+                                bloco = bloco[:fim + 1 - inicio - pedaco[2]]
+                                arq.write(bloco)
+                                # Estado e hash só avançam depois que os bytes foram escritos no arquivo
+                                arq.flush()
+                                progresso.avanca(destino, len(bloco))
+                                nao_salvo += len(bloco)
+                                with lock:
+                                    avanca_hash(inicio + pedaco[2], bloco)
+                                    pedaco[2] += len(bloco)
+                                    if nao_salvo >= 8 * TAMANHO_BLOCO_DOWNLOAD:
+                                        salva_estado()
+                                        nao_salvo = 0
+                            arq.flush()
+                with lock:
+                    salva_estado()
+                if inicio + pedaco[2] > fim:
+                    return
+            except (requests.RequestException, OSError) as e:
+                if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500:
+                    raise
+                print(f'''
+Pedaço {inicio}-{fim} de {url} interrompido ({e}), tentando continuar''')
+            time.sleep(min(2 ** tentativa, 60))
+        raise IOError(f'pedaço {pedaco[0]}-{pedaco[1]} de {url} incompleto')
+
+    progresso.inicia(destino, tamanho, sum(pedaco[2] for pedaco in estado['pedacos']))
+    try:
+        # Pedaços de uma execução anterior já estão no arquivo
+        with lock:
+            avanca_hash(-1, b'')
+        with ThreadPoolExecutor(len(estado['pedacos'])) as executor:
+            for resultado in [executor.submit(baixa_pedaco, pedaco) for pedaco in estado['pedacos']]:
+                resultado.result()
+        avanca_hash(-1, b'')
+    finally:
+        leitor.close()
+
+    os.remove(path_estado)
+    os.replace(parcial, destino)
+    if manifesto is not None:
+        manifesto.registra(destino, sha256.hexdigest())
+    progresso.termina(destino)
+    return destino
+
+
+def baixa_arquivo(url : str, destino : str, progresso : ProgressoDownload, limite_host : threading.BoundedSemaphore,
+                  segmentos : int = SEGMENTOS_DOWNLOAD, manifesto : Manifesto = None) -> str:
+    '''Baixa um arquivo em blocos para um .part, e renomeia para o destino só quando o download termina
+    Se a conexão cair, ou se o programa for fechado, o .part é mantido e o download continua de onde parou,
+    pedindo só os bytes que faltam (header Range). Se o servidor ignorar o Range, baixa do começo
+    Com mais de um segmento, arquivos grandes são baixados em pedaços por baixa_segmentado()
+    O SHA-256 é calculado enquanto os blocos chegam, o .part só é lido de novo se o download continuar de outra execução
+
+    params
+    ------
+    url : str
+        Url do arquivo
+    destino : str
+        Caminho final do arquivo
+    progresso : ProgressoDownload
+        Progresso compartilhado entre os downloads
+    limite_host : threading.BoundedSemaphore
+        Limite de conexões ao mesmo servidor
+    segmentos : int
+        Quantidade de conexões para um mesmo arquivo
+    manifesto : Manifesto
+        Onde registrar o tamanho e SHA-256 do arquivo baixado
+
+    returns
+    -------
+    str
+        Caminho final do arquivo'''
+
+    parcial = destino + '.part'
+    # Download em pedaços só se o servidor aceitar Range, e se não houver um .part de um download simples para continuar
+    if segmentos > 1 and not os.path.isfile(parcial):
+        try:
+            with limite_host:
+                r = requests.head(url, timeout=TIMEOUT_DOWNLOAD, allow_redirects=True)
+            tamanho = int(r.headers.get('Content-Length', 0)) if r.ok else 0
+            if r.headers.get('Accept-Ranges') == 'bytes' and tamanho >= TAMANHO_MINIMO_SEGMENTADO:
+                return baixa_segmentado(url, destino, tamanho, progresso, limite_host, segmentos, manifesto)
+        except requests.RequestException:
+            pass
+    tamanho = None
+    sha256 = None
+    # Bytes do .part que já entraram no hash
+    hasheado = 0
+    for tentativa in range(TENTATIVAS_DOWNLOAD):
+        baixado = os.path.getsize(parcial) if os.path.isfile(parcial) else 0
+        # .part de outra execução (ou escrita que falhou no meio): hash do que já está no arquivo
+        if baixado and (sha256 is None or hasheado != baixado):
+            sha256, hasheado = hash_arquivo(parcial), baixado
+        try:
+            with limite_host:
+                with requests.get(url, stream=True, timeout=TIMEOUT_DOWNLOAD,
+                                  headers={'Range' : f'bytes={baixado}-'} if baixado else None) as r:
+                    # Range além do fim: o tamanho do arquivo vem no Content-Range 'bytes */tamanho'
+                    if r.status_code == 416 and r.headers.get('Content-Range', '').startswith('bytes */'):
+                        tamanho = int(r.headers['Content-Range'].split('/')[1])
+                        # .part já tinha o arquivo inteiro (programa fechou antes de renomear)
+                        if baixado == tamanho:
+                            break
+                        # .part maior que o arquivo no servidor, não serve
+                        os.remove(parcial)
+                        continue
+                    r.raise_for_status()
+                    if r.status_code == 206:
+                        # Pedaço que não começa no fim do .part (ou sem Content-Range) não continua o arquivo:
+                        # descarta o .part e pede o arquivo inteiro, sem Range
+                        if not baixado or not r.headers.get('Content-Range', '').startswith(f'bytes {baixado}-'):
+                            print(f'''
+{url} respondeu um Range diferente do pedido ({r.headers.get('Content-Range')}), baixando do começo''')
+                            if os.path.isfile(parcial):
+                                os.remove(parcial)
+                            sha256, hasheado = None, 0
+                            continue
+                        # Servidor continua do byte pedido, o tamanho total vem no Content-Range 'bytes inicio-fim/tamanho'
+                        modo = 'ab'
+                        tamanho = int(r.headers['Content-Range'].split('/')[1])
+                    elif r.status_code != 200:
+                        raise IOError(f'resposta {r.status_code} inesperada do servidor')
+                    else:
+                        # Servidor ignorou o Range e mandou o arquivo inteiro: começa do zero
+                        modo = 'wb'
+                        baixado = 0
+                        sha256, hasheado = hashlib.sha256(), 0
+                        tamanho = int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+                    progresso.inicia(destino, tamanho or 0, baixado)
+                    with open(parcial, mode=modo) as arq:
+                        for bloco in r.iter_content(TAMANHO_BLOCO_DOWNLOAD):
+                            arq.write(bloco)
+                            sha256.update(bloco)
+                            hasheado += len(bloco)
+                            progresso.avanca(destino, len(bloco))
+            # Sem Content-Length não tem como saber se faltou algo, aceita o que veio
+            if tamanho is None or os.path.getsize(parcial) == tamanho:
+                break
+        except (requests.RequestException, OSError) as e:
+            # Arquivo não existe ou acesso negado: tentar de novo não resolve
+            if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500:
+                raise
+            print(f'''
+Download de {url} interrompido ({e}), tentando continuar''')
+        time.sleep(min(2 ** tentativa, 60))
+
+    # Confere o tamanho final com o informado pelo servidor
+    if tamanho is None and not os.path.isfile(parcial):
+        raise IOError(f'{url} não foi baixado')
+    if tamanho is not None and os.path.getsize(parcial) != tamanho:
+        raise IOError(f'{url} incompleto: {os.path.getsize(parcial)} de {tamanho} bytes')
+    os.replace(parcial, destino)
+    if manifesto is not None:
+        if hasheado != os.path.getsize(destino):
+            sha256 = hash_arquivo(destino)
+        manifesto.registra(destino, sha256.hexdigest())
+    progresso.termina(destino)
+    return destino
+
+
+def sonda_url(url : str, anterior : dict = None) -> dict:
+    '''Pergunta ao servidor só os headers de uma url (HEAD), sem baixar nada
+    Com os valores do último update, o pedido é condicional: se nada mudou, o servidor responde 304 sem conteúdo
+
+    params
+    ------
+    url : str
+        Url do arquivo ou página
+    anterior : dict
+        Headers guardados no último update, ver sonda_url()
+
+    returns
+    -------
+    dict
+        {'etag', 'last_modified', 'tamanho'} da url, valores None se o servidor não informar'''
+
+    headers = dict()
+    if anterior and anterior.get('etag'):
+        headers['If-None-Match'] = anterior['etag']
+    if anterior and anterior.get('last_modified'):
+        headers['If-Modified-Since'] = anterior['last_modified']
+    r = requests.head(url, timeout=TIMEOUT_DOWNLOAD, allow_redirects=True, headers=headers)
+    if r.status_code == 304:
+        return anterior
+    # Alguns servidores não aceitam HEAD, pede o conteúdo mas fecha sem ler
+    if r.status_code == 405:
+        r = requests.get(url, timeout=TIMEOUT_DOWNLOAD, stream=True, headers=headers)
+        r.close()
+        if r.status_code == 304:
+            return anterior
+    r.raise_for_status()
+    return {'etag' : r.headers.get('ETag'),
+            'last_modified' : r.headers.get('Last-Modified'),
+            'tamanho' : r.headers.get('Content-Length')}
+
+
+def sonda_urls(urls : list, anteriores : dict = None) -> dict:
+    '''Faz o sonda_url() de várias urls ao mesmo tempo
+
+    returns
+    -------
+    dict
+        {url : headers}'''
+
+    anteriores = anteriores or dict()
+    with ThreadPoolExecutor(max(1, min(len(urls), DOWNLOADS_PARALELOS))) as executor:
+        return dict(zip(urls, executor.map(lambda url : sonda_url(url, anteriores.get(url)), urls)))
+
+
+def sondas_iguais(anteriores : dict, atuais : dict) -> bool:
+    '''Compara os headers guardados no último update com os atuais
+    Só considera igual se as urls forem as mesmas e cada uma tiver ETag ou Last-Modified para comparar'''
+
+    if not anteriores or anteriores.keys() != atuais.keys():
+        return False
+    for url, atual in atuais.items():
+        if not (atual.get('etag') or atual.get('last_modified')) or anteriores[url] != atual:
+            return False
+    return True
+
+
+def caminho_espelho(espelho : str, nome : str) -> str:
+    '''Url ou caminho de um arquivo no espelho, que pode ser uma pasta (local ou de rede) ou um servidor http interno'''
+
+    if espelho.startswith(('http://', 'https://')):
+        return espelho.rstrip('/') + '/' + nome
+    return os.path.join(espelho, nome)
+
+
+def le_espelho(espelho : str) -> dict:
+    '''Lê o espelho.json, com as versões e arquivos publicados no espelho, ver Dados.publica_espelho()'''
+
+    if espelho.startswith(('http://', 'https://')):
+        r = requests.get(caminho_espelho(espelho, 'espelho.json'), timeout=TIMEOUT_DOWNLOAD)
+        r.raise_for_status()
+        return r.json()
+    with open(caminho_espelho(espelho, 'espelho.json'), mode='r') as arq:
+        return json.load(arq)
+
+
+def obtem_do_espelho(espelho : str, nome : str, destino : str, esperado : dict, manifesto : Manifesto,
+                     progresso : ProgressoDownload = None, limite_host : threading.BoundedSemaphore = None) -> str:
+    '''Copia (pasta) ou baixa (http) um arquivo do espelho, e confere com o tamanho e SHA-256 publicados no espelho.json
+
+    params
+    ------
+    espelho : str
+        Pasta ou url do espelho
+    nome : str
+        Nome do arquivo no espelho
+    destino : str
+        Caminho final do arquivo
+    esperado : dict
+        {'tamanho', 'sha256'} do espelho.json, None para não conferir (publicação do espelho)
+    manifesto : Manifesto
+        Onde registrar o arquivo obtido
+
+    returns
+    -------
+    str
+        Caminho final do arquivo'''
+
+    progresso = progresso or ProgressoDownload(1)
+    origem = caminho_espelho(espelho, nome)
+    if origem.startswith(('http://', 'https://')):
+        baixa_arquivo(origem, destino, progresso, limite_host or threading.BoundedSemaphore(CONEXOES_POR_HOST), 1, manifesto)
+    else:
+        # Cópia em blocos, com o SHA-256 calculado junto
+        sha256 = hashlib.sha256()
+        progresso.inicia(destino, os.path.getsize(origem))
+        with open(origem, mode='rb') as entrada, open(destino + '.part', mode='wb') as saida:
+            for bloco in iter(lambda : entrada.read(TAMANHO_BLOCO_DOWNLOAD), b''):
+                saida.write(bloco)
+                sha256.update(bloco)
+                progresso.avanca(destino, len(bloco))
+        os.replace(destino + '.part', destino)
+        manifesto.registra(destino, sha256.hexdigest())
+        progresso.termina(destino)
+
+    registro = manifesto.arquivos[os.path.basename(destino)]
+    if esperado is not None and (registro['tamanho'] != esperado['tamanho'] or registro['sha256'] != esperado['sha256']):
+        os.remove(destino)
+        manifesto.remove(destino)
+        raise IOError(f'{nome} do espelho não confere com o espelho.json')
+    return destino
+
+
+def le_planilha_depara(path : str) -> tuple:
+    '''Lê a planilha de de:para CNAE/MCC da ABECS linha a linha, pelo openpyxl em modo somente leitura, como o le_planilha_cnpjs()
+    Colunas: CNAE na 4ª, MCC principal (decisão final) na 6ª, e os MCCs alternativos da 8ª em diante, cada um seguido do nome do MCC
+    Não há limite de MCCs alternativos, a planilha pode ganhar colunas sem mudar o código
+    Linhas com CNAE inválido não param a leitura, são contadas como erro, como no le_lotes_trecho()
+
+    params
+    ------
+    path : str
+        Caminho do .xlsx baixado da ABECS
+
+    returns
+    -------
+    tuple
+        (lista de (CNAE, MCC, PRINCIPAL, ORDEM) de cada par CNAE/MCC na ordem da table DEPARA_MCCS, linhas com erro)'''
+
+    def texto_mcc(valor) -> str:
+        # Células numéricas podem vir como float (763.0)
+        if isinstance(valor, float) and valor.is_integer():
+            valor = int(valor)
+        return str(valor).strip()
+
+    pares = list()
+    erros = 0
+    planilha = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for linha in planilha.worksheets[0].iter_rows(min_row=3, values_only=True):
+            if len(linha) < 6 or linha[3] is None or linha[5] is None:
+                continue
+            try:
+                cnae = int(str(linha[3]).replace('/','').replace('-','')) # Tira os '-' '/' do cnae
+            except ValueError:
+                erros += 1
+                continue
+            pares.append((cnae, texto_mcc(linha[5]), 1, 0))
+            alternativos = [texto_mcc(e) for e in linha[7::2] if e not in (None, '')]
+            for ordem, mcc in enumerate(alternativos, start=1):
+                pares.append((cnae, mcc, 0, ordem))
+    finally:
+        planilha.close()
+    return pares, erros
+
+
+def le_planilha_cnpjs(path : str):
+    '''Lê a planilha de CNPJs determinados da ABECS linha a linha, pelo openpyxl em modo somente leitura
+    Só as 4 primeiras colunas são lidas, sem montar um DataFrame: a memória usada não depende do tamanho da planilha
+    Linhas com alguma célula vazia são ignoradas, e os valores vêm como texto, os mesmos do pd.read_excel com dtype string
+
+    params
+    ------
+    path : str
+        Caminho do .xlsx baixado da ABECS
+
+    yields
+    ------
+    list
+        [CNPJ, MCC, TIPO, DATA] de cada linha, sem o cabeçalho'''
+
+    planilha = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for linha in planilha.worksheets[0].iter_rows(min_row=2, max_col=4, values_only=True):
+            if len(linha) < 4 or None in linha:
+                continue
+            yield [str(celula) for celula in linha]
+    finally:
+        planilha.close()
+
+
+def normaliza_cnpjs_abecs(linhas) -> pd.DataFrame:
+    '''Prepara as determinações da planilha da ABECS para a table MCCS_DETERMINACOES, uma linha por CNPJ/MCC/data
+
+    CNPJ: completado com zeros à esquerda até 14 dígitos (uma vez por CNPJ, pelo factorize)
+    Linhas repetidas (mesmo CNPJ, MCC e data) entram uma vez só
+    ORDEM: linha da planilha, os textos da view MCCS_DETERMINADOS seguem essa ordem
+
+    params
+    ------
+    linhas : iterable
+        [CNPJ, MCC, TIPO, DATA] como texto, ver le_planilha_cnpjs()
+
+    returns
+    -------
+    pd.DataFrame
+        Colunas CNPJ, MCC, TIPO, DATA, ORDEM, na ordem da table MCCS_DETERMINACOES'''
+
+    df = pd.DataFrame(linhas, columns=['CNPJ','MCC','TIPO','DATA'], dtype=object)
+    # CNPJs que só diferem nos zeros à esquerda ficam iguais
+    codigos, cnpjs = pd.factorize(df['CNPJ'])
+    df['CNPJ'] = pd.Series(cnpjs, dtype=object).str.pad(14, side='left', fillchar='0').to_numpy()[codigos]
+    df['ORDEM'] = np.arange(len(df), dtype=np.int64)
+    return df[~df.duplicated(['CNPJ','MCC','DATA'])]
+
+
 class Dados():
     '''Classe para buscar, atualizar e tratar dados das diferentes fontes'''
-    def __init__(self):
+    def __init__(self, consultas = None):
         '''Cria variáveis de versionamentos dos dados
 
         Versões vigentes dos arquivos são armazenados em um dict, lidos do 'config.txt'
         Valores deste dict são uma tupla, com versão lida do file inicial, e versão atual lida pelo webscraping
         Se valores da tupla forem diferentes, atualiza o database e sobrescreve a nova versão no .txt ao finalizar o update
-        Keys são sempre: {'receita', 'depara_abecs', 'lista_cnpj'}'''
+        Keys são sempre: {'receita', 'depara_abecs', 'lista_cnpj'}
+
+        params
+        ------
+        consultas : Consultas
+            Conexão de consulta da GUI, fechada durante a troca do database vigente, ver promove_database()'''
         
         self.current_versions = dict()
         self.current_versions['receita'] = []
@@ -52,9 +1370,44 @@ class Dados():
         self.update = True
         self.path_script = os.path.abspath(os.path.dirname(__file__))
         self.path_temp = self.path_script + '\\temp'
-        self.connection = sqlite3.Connection(os.path.join(self.path_script,'database.db'))
+        # Database vigente, usado nas consultas
+        self.path_database = os.path.join(self.path_script,'database.db')
+        # Database da receita em construção, as consultas continuam no database vigente enquanto ele é criado
+        self.path_database_novo = os.path.join(self.path_script,'database_novo.db')
+        # Database da receita já validado, esperando para substituir o vigente
+        self.path_database_pronto = os.path.join(self.path_script,'database_pronto.db')
+        # Arquivos com as alterações entre cada versão da receita
+        self.path_deltas = os.path.join(self.path_script,'deltas')
+        # Segundos gastos em cada etapa do update da receita, ver pipeline_receita()
+        self.tempos_etapas = {'download' : 0.0, 'extracao' : 0.0, 'parsing' : 0.0, 'insercao' : 0.0}
+        # Acionado pelo pipeline_receita() para as etapas pararem, ver ProgressoDownload
+        self.parar_receita = threading.Event()
+        # Arquivos da receita que não foram baixados, a carga não é promovida sem eles
+        self.erros_download = list()
+        # Headers (ETag, Last-Modified, tamanho) das urls de cada fonte no último update, ver verifica_sondas()
+        self.path_sondas = os.path.join(self.path_script,'sondas.json')
+        self.sondas = dict()
+        self.sondas_novas = dict()
+        # espelho.json lido do espelho interno, ver verifica_espelho()
+        self.espelho = None
+        # Link e headers (ETag, Last-Modified) da planilha vigente de cada fonte da ABECS, ver abecs_alterada()
+        # O SHA-256 do conteúdo carregado fica no database, ver conteudo_carregado()
+        self.path_headers_abecs = os.path.join(self.path_script,'headers_abecs.json')
+        self.headers_guardados = dict()
+        if os.path.isfile(self.path_headers_abecs):
+            with open(self.path_headers_abecs, mode='r') as arq:
+                self.headers_guardados = json.load(arq)
+        # Fontes da ABECS com a planilha trocada sem mudar de nome, e os headers novos delas, ver abecs_alterada()
+        self.abecs_alteradas = set()
+        self.headers_abecs = dict()
+        self.consultas = consultas
+        # Etapa do update em andamento, mostrada na GUI pelo Agendador
+        self.etapa = ''
+        # Se um update anterior não conseguiu trocar o arquivo (ex: outro programa com o database aberto), troca agora
+        self.promove_database()
+        self.connection = sqlite3.Connection(self.path_database)
         self.cursor = self.connection.cursor()
-    
+
 
     def read_version(self):
         '''Lê no arquivo config.txt quais são as versões/data dos dados da Receita e ABECS
@@ -79,29 +1432,342 @@ class Dados():
                 file.close()
 
 
+    def verifica_sondas(self) -> list:
+        '''Verifica se as fontes mudaram desde o último update só pelos headers das urls (ETag, Last-Modified e tamanho),
+        sem abrir o navegador. Leva milissegundos, enquanto o selenium leva segundos e depende dos XPATHs
+        Receita: arquivos Estabelecimentos(n).zip | ABECS: página com os links das planilhas
+
+        Fontes sem mudança ficam com a versão atual igual à vigente, e não precisam do webscraping
+        Se não houver headers guardados, ou não der para comparar, a fonte fica para o webscraping
+
+        returns
+        -------
+        list
+            Fontes que não mudaram, com as mesmas keys do current_versions'''
+
+        if os.path.isfile(self.path_sondas):
+            with open(self.path_sondas, mode='r') as arq:
+                self.sondas = json.load(arq)
+        # As duas planilhas da ABECS estão na mesma página, sondada uma vez só
+        paginas = {'receita' : ['receita'], 'abecs' : ['depara_abecs', 'lista_cnpj']}
+
+        def sonda(pagina : str) -> dict:
+            if pagina == 'receita':
+                urls = [url for _, url in lista_arquivos_receita(self.le_config('url_receita', URL_RECEITA))]
+            else:
+                urls = [self.le_config('url_abecs', URL_ABECS)]
+            return sonda_urls(urls, self.sondas.get(paginas[pagina][0]))
+
+        # Receita e ABECS sondadas ao mesmo tempo
+        with ThreadPoolExecutor(len(paginas)) as executor:
+            sondas = {pagina : executor.submit(sonda, pagina) for pagina in paginas}
+        inalterados = list()
+        for pagina, fontes in paginas.items():
+            try:
+                novas = sondas[pagina].result()
+            except requests.RequestException as e:
+                print(f'Não foi possível verificar {pagina} pelos headers ({e}), verificando pelo navegador')
+                continue
+            for fonte in fontes:
+                self.sondas_novas[fonte] = novas
+                # Versão vigente 'nula' nunca foi carregada, mesmo se os headers baterem
+                if novas and self.current_versions[fonte][0] != 'nula' and sondas_iguais(self.sondas.get(fonte), novas):
+                    self.current_versions[fonte].append(self.current_versions[fonte][0])
+                    inalterados.append(fonte)
+                    print(f'Busca // {fonte}: sem alterações desde o último update')
+        return inalterados
+
+
+    def salva_sonda(self, fonte : str):
+        '''Guarda os headers lidos no verifica_sondas() para a fonte, depois de ela ser atualizada com sucesso
+
+        params
+        ------
+        fonte : str
+            Keys do current_versions'''
+
+        if fonte not in self.sondas_novas:
+            return
+        self.sondas[fonte] = self.sondas_novas[fonte]
+        with open(self.path_sondas + '.tmp', mode='w') as arq:
+            json.dump(self.sondas, arq, indent=4)
+        os.replace(self.path_sondas + '.tmp', self.path_sondas)
+
+
+    def verifica_espelho(self) -> list:
+        '''Com 'espelho=' no config.txt, as versões e arquivos vêm do espelho publicado por outra instalação,
+        em vez da internet (receita, ABECS e navegador não são usados). Funciona sem internet.
+
+        Se o espelho tiver um snapshot do database.db de versões diferentes das vigentes, e 'espelho_snapshot=nao' não estiver no config.txt,
+        o snapshot substitui o database vigente de uma vez, sem processar nenhum arquivo
+        Espelho mais antigo que o database vigente (ver versao_anterior()) não é usado: nem o snapshot, nem os arquivos da fonte mais antiga
+
+        returns
+        -------
+        list
+            Fontes com versão lida no espelho, como o web_scrape()'''
+
+        espelho = self.le_config('espelho', '')
+        try:
+            publicado = le_espelho(espelho)
+        except (requests.RequestException, OSError, ValueError) as e:
+            print(f'Não foi possível ler o espelho {espelho}: {e}')
+            return list()
+        self.espelho = publicado
+
+        snapshot = publicado.get('snapshot')
+        vigentes = {fonte : versoes[0] for fonte, versoes in self.current_versions.items()}
+        # Snapshot vem pronto, não precisa processar os arquivos da receita nem as planilhas da ABECS
+        anteriores = [fonte for fonte in vigentes if snapshot and versao_anterior(snapshot['versoes'].get(fonte, 'nula'), vigentes[fonte])]
+        if anteriores:
+            print(f'Snapshot do espelho é anterior ao database vigente ({", ".join(anteriores)}), não será usado')
+        if (snapshot and snapshot['versoes'] != vigentes and not anteriores
+                and self.le_config('espelho_snapshot', 'sim') in ('Sim','sim','SIM','S','s') and self.update):
+            try:
+                if self.aplica_snapshot(espelho, snapshot):
+                    for fonte in self.current_versions:
+                        self.current_versions[fonte][0] = snapshot['versoes'][fonte]
+            except (requests.RequestException, OSError) as e:
+                print(f'Não foi possível usar o snapshot do espelho ({e}), atualizando pelos arquivos')
+
+        fontes = list()
+        for fonte in self.current_versions:
+            if fonte in publicado['versoes']:
+                # Versão do espelho mais antiga que a vigente fica como se não tivesse mudado, o database não volta para trás
+                if versao_anterior(publicado['versoes'][fonte], self.current_versions[fonte][0]):
+                    print(f'Espelho // {fonte}: {publicado["versoes"][fonte]} é anterior à vigente, mantida {self.current_versions[fonte][0]}')
+                    self.current_versions[fonte].append(self.current_versions[fonte][0])
+                else:
+                    self.current_versions[fonte].append(publicado['versoes'][fonte])
+                    print(f'Espelho // {fonte}: {publicado["versoes"][fonte]}')
+                fontes.append(fonte)
+        return fontes
+
+
+    def aplica_snapshot(self, espelho : str, snapshot : dict) -> bool:
+        '''Obtém o database.db publicado no espelho, confere o SHA-256 e troca o database vigente por ele
+        As versões do snapshot são gravadas no config.txt
+
+        params
+        ------
+        espelho : str
+            Pasta ou url do espelho
+        snapshot : dict
+            Entrada 'snapshot' do espelho.json
+
+        returns
+        -------
+        bool
+            True se o database vigente foi trocado pelo snapshot'''
+
+        print('''--------------------------------------------------------------------------------
+Atualizando o database pelo snapshot do espelho
+--------------------------------------------------------------------------------''')
+        manifesto = Manifesto(None)
+        obtem_do_espelho(espelho, 'database.db', self.path_database_pronto, snapshot, manifesto)
+        print()
+        if not self.promove_database():
+            return False
+        with open('config.txt', mode='r') as read:
+            atual = read.readlines()
+            read.close()
+        for i, fonte in enumerate(('receita', 'depara_abecs', 'lista_cnpj')):
+            atual[i] = f'{fonte}={snapshot["versoes"][fonte]}\n'
+        with open('config.txt', mode='w') as write:
+            write.writelines(atual)
+        print('Database atualizado pelo snapshot do espelho!')
+        return True
+
+
+    def obtem_abecs(self, fonte : str, link : str):
+        '''Baixa a planilha da ABECS para a pasta do programa, do espelho se ele estiver configurado, ou do link da ABECS
+
+        params
+        ------
+        fonte : str
+            'depara_abecs' ou 'lista_cnpj'
+        link : str
+            Link da planilha no site da ABECS'''
+
+        nome_excel = link.split('/')[-1]
+        if self.espelho:
+            obtem_do_espelho(self.le_config('espelho', ''), nome_excel, os.path.join(self.path_script, nome_excel),
+                             self.espelho['arquivos'][fonte][nome_excel], Manifesto(None))
+            print()
+        else:
+            wget.download(link)
+
+
+    def publica_espelho(self, fonte : str, arquivos : list):
+        '''Com 'publica_espelho=' no config.txt (pasta local ou de rede), copia os arquivos de uma fonte atualizada para o espelho,
+        e um snapshot do database.db. As outras instalações usam o espelho com 'espelho=' apontando para a pasta,
+        ou para um servidor http interno que sirva a pasta
+
+        Arquivos são copiados antes e o espelho.json é gravado por último: quem lê o espelho nunca vê um arquivo pela metade
+
+        params
+        ------
+        fonte : str
+            Keys do current_versions
+        arquivos : list
+            Arquivos da nova versão da fonte'''
+
+        pasta = self.le_config('publica_espelho', '')
+        if not pasta:
+            return
+        os.makedirs(pasta, exist_ok=True)
+        try:
+            publicado = le_espelho(pasta)
+        except (OSError, ValueError):
+            publicado = {'versoes' : dict(), 'arquivos' : dict()}
+        manifesto = Manifesto(None)
+
+        # Arquivos da versão anterior da fonte saem do espelho
+        for nome in publicado['arquivos'].get(fonte, dict()):
+            if nome not in {os.path.basename(arquivo) for arquivo in arquivos} and os.path.isfile(os.path.join(pasta, nome)):
+                os.remove(os.path.join(pasta, nome))
+        publicado['arquivos'][fonte] = dict()
+        for arquivo in arquivos:
+            nome = os.path.basename(arquivo)
+            obtem_do_espelho(os.path.dirname(arquivo), nome, os.path.join(pasta, nome), None, manifesto)
+            publicado['arquivos'][fonte][nome] = {chave : manifesto.arquivos[nome][chave] for chave in ('tamanho', 'sha256')}
+        publicado['versoes'][fonte] = self.current_versions[fonte][1]
+
+        # Snapshot consistente do database vigente, pela API de backup do SQLite
+        self.connection.commit()
+        snapshot = sqlite3.Connection(os.path.join(pasta, 'database.db.tmp'))
+        self.connection.backup(snapshot)
+        snapshot.close()
+        os.replace(os.path.join(pasta, 'database.db.tmp'), os.path.join(pasta, 'database.db'))
+        versoes = dict()
+        with open('config.txt', mode='r') as read:
+            for linha in read.readlines()[:3]:
+                chave, valor = linha.strip().split('=', 1)
+                versoes[chave] = valor
+        publicado['snapshot'] = {'tamanho' : os.path.getsize(os.path.join(pasta, 'database.db')),
+                                 'sha256' : hash_arquivo(os.path.join(pasta, 'database.db')).hexdigest(),
+                                 'versoes' : versoes}
+
+        with open(os.path.join(pasta, 'espelho.json.tmp'), mode='w') as arq:
+            json.dump(publicado, arq, indent=4)
+        os.replace(os.path.join(pasta, 'espelho.json.tmp'), os.path.join(pasta, 'espelho.json'))
+        print(f'{fonte} publicado no espelho {pasta}')
+
+
     def cria_database(self):
         '''Inicializa database e table se elas ainda não existirem'''
         
         # Receita Federal
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS DADOS_RECEITA
-        ([CNPJ_RECEITA] TEXT PRIMARY KEY, [SITUACAO_CADASTRAL_RECEITA] TEXT, [CNAE_PRINCIPAL_RECEITA] TEXT, [CNAES_SECUNDARIOS_RECEITA] TEXT)
-        ''')
+        self.cursor.execute(DDL_DADOS_RECEITA)
+        # Databases criados antes do layout compacto são convertidos
+        colunas = [e[1] for e in self.cursor.execute('''PRAGMA table_info(DADOS_RECEITA)''').fetchall()]
+        if 'DV_RECEITA' not in colunas:
+            self.migra_dados_receita()
+        if not self.cursor.execute('''SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'DADOS_RECEITA_CNAE' ''').fetchone():
+            print('Criando o índice de CNAEs da base da receita, pode demorar alguns minutos')
+            for indice in INDICES_DADOS_RECEITA:
+                self.cursor.execute(indice)
         
         # Lista de MCCs determinados pelas bandeiras
-        self.cursor.execute( '''
-        CREATE TABLE IF NOT EXISTS MCCS_DETERMINADOS
-        ([CNPJ_BANDEIRA_ABECS] TEXT PRIMARY KEY, [MCC_BANDEIRA_ABECS] TEXT, [TIPO_ABECS] TEXT, [DATA_DETERMINACAO_ABECS] TEXT)''')
+        self.cursor.execute(DDL_MCCS_DETERMINACOES.format(tabela='MCCS_DETERMINACOES'))
+        for indice in INDICES_MCCS_DETERMINACOES:
+            self.cursor.execute(indice)
+        # Databases antigos têm a MCCS_DETERMINADOS como table, com os MCCs e datas já juntados em texto
+        if self.cursor.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'MCCS_DETERMINADOS' ''').fetchone():
+            self.migra_mccs_determinados()
+        self.cursor.execute(DDL_VIEW_MCCS_DETERMINADOS)
         
         # Relação de CNAE/MCC da ABECS
-        self.cursor.execute( '''
-        CREATE TABLE IF NOT EXISTS DEPARA
-        ([CNAE_PRINCIPAL_ABECS] TEXT PRIMARY KEY, [MCC_PRINCIPAL_ABECS] TEXT, [MCCS_SECUNDARIOS_ABECS] TEXT)
-        ''')
+        self.cursor.execute(DDL_DEPARA_MCCS.format(tabela='DEPARA_MCCS'))
+        for indice in INDICES_DEPARA_MCCS:
+            self.cursor.execute(indice)
+        # Databases antigos têm o DEPARA como table, com os MCCs alternativos juntados em texto
+        if self.cursor.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'DEPARA' ''').fetchone():
+            self.migra_depara()
+        self.cursor.execute(DDL_VIEW_DEPARA)
+
+        # Conteúdo das planilhas da ABECS carregadas nas tables acima
+        self.cursor.execute(DDL_CONTEUDOS_ABECS)
         
         self.connection.commit()
 
 
+    def migra_dados_receita(self):
+        '''Converte a table DADOS_RECEITA do layout antigo (tudo em TEXT) para o layout compacto
+        A conversão é feita em um database novo, que depois substitui o vigente, como num update da receita'''
+
+        print('Convertendo a base da receita para o layout compacto, pode demorar alguns minutos')
+        remove_database(self.path_database_novo)
+        def seguro(funcao):
+            # Valores inválidos no layout antigo viram NULL, em vez de parar a conversão inteira
+            def f(valor):
+                try:
+                    return funcao(valor)
+                except (ValueError, TypeError):
+                    return None
+            return f
+
+        novo = sqlite3.Connection(self.path_database_novo)
+        novo.create_function('CNPJ_CHAVE', 1, seguro(chave_cnpj), deterministic=True)
+        novo.create_function('CNAES_PACOTE', 1, seguro(empacota_cnaes), deterministic=True)
+        novo.execute(DDL_DADOS_RECEITA)
+        novo.execute('''ATTACH DATABASE ? AS vigente''', (self.path_database,))
+        self.modo_carga(novo, True)
+        try:
+            novo.execute('''
+            INSERT OR REPLACE INTO main.DADOS_RECEITA
+            SELECT CNPJ_CHAVE(CNPJ_RECEITA), CAST(substr(CNPJ_RECEITA, 13, 2) AS INTEGER), CAST(SITUACAO_CADASTRAL_RECEITA AS INTEGER),
+            CAST(NULLIF(CNAE_PRINCIPAL_RECEITA, '') AS INTEGER), CNAES_PACOTE(CNAES_SECUNDARIOS_RECEITA)
+            FROM vigente.DADOS_RECEITA
+            WHERE length(CNPJ_RECEITA) = 14 AND CNPJ_CHAVE(CNPJ_RECEITA) IS NOT NULL''')
+            novo.commit()
+        finally:
+            self.modo_carga(novo, False)
+        novo.execute('''DETACH DATABASE vigente''')
+        novo.close()
+        os.replace(self.path_database_novo, self.path_database_pronto)
+        self.promove_database()
+
+
+    def migra_mccs_determinados(self):
+        '''Converte a table MCCS_DETERMINADOS antiga (um CNPJ por linha, MCCs e datas juntados em texto) para a MCCS_DETERMINACOES
+        A planilha original não diz qual data é de qual MCC: o n-ésimo MCC fica com a n-ésima data, e a lista mais curta repete o último item.
+        Assim a view MCCS_DETERMINADOS devolve os mesmos textos da table antiga, sem as repetições'''
+
+        print('Convertendo a table de MCCs determinados para uma linha por determinação')
+        determinacoes = list()
+        for cnpj, mccs, tipo, datas in self.cursor.execute('''SELECT * FROM MCCS_DETERMINADOS''').fetchall():
+            mccs = (mccs or '').split(',')
+            datas = (datas or '').split(' | ')
+            for i in range(max(len(mccs), len(datas))):
+                determinacoes.append((cnpj, mccs[min(i, len(mccs) - 1)], tipo, datas[min(i, len(datas) - 1)], len(determinacoes)))
+        self.cursor.execute('''DELETE FROM MCCS_DETERMINACOES''')
+        self.cursor.executemany('''INSERT INTO MCCS_DETERMINACOES VALUES (?,?,?,?,?)''', determinacoes)
+        self.cursor.execute('''DROP TABLE MCCS_DETERMINADOS''')
+        self.connection.commit()
+
+
+    def migra_depara(self):
+        '''Converte a table DEPARA antiga (um CNAE por linha, MCCs alternativos juntados em texto) para a DEPARA_MCCS'''
+
+        print('Convertendo a table de de:para da ABECS para uma linha por CNAE/MCC')
+        pares = list()
+        for cnae, mcc, alternativos in self.cursor.execute('''SELECT * FROM DEPARA''').fetchall():
+            try:
+                cnae = int(cnae)
+            except (ValueError, TypeError):
+                continue
+            pares.append((cnae, str(mcc), 1, 0))
+            for ordem, alternativo in enumerate((alternativos or '').split(','), start=1):
+                if alternativo:
+                    pares.append((cnae, alternativo, 0, ordem))
+        self.cursor.execute('''DELETE FROM DEPARA_MCCS''')
+        # MCC repetido no mesmo CNAE fica só na primeira posição
+        self.cursor.executemany('''INSERT OR IGNORE INTO DEPARA_MCCS VALUES (?,?,?,?)''', pares)
+        self.cursor.execute('''DROP TABLE DEPARA''')
+        self.connection.commit()
+
+
     def permite_update(self):
         '''Configuração vinculada ao self.update, que determina se a database pode ser atualizada ou não.
         Variável nasce como True, e se estiver como 'Sim' no arquivo de configurações, vai fazer updates.
@@ -111,7 +1777,8 @@ class Dados():
         try: 
             with open('config.txt', mode='r+') as file:
                 # Arquivo config.txt já existe, lê preferência do user
-                update = file.readlines()[3].split('=')[1]
+                # strip() pois a linha pode terminar com '\n' se houverem configurações opcionais abaixo dela
+                update = file.readlines()[3].split('=')[1].strip()
                 # Várias opções de sim caso o user digite errado
                 if update in ('Sim','sim','SIM','S','s'):
                     self.update = True
@@ -128,26 +1795,189 @@ class Dados():
                 file.close()
 
         
-    def update_download_receita(self):
+    def le_config(self, chave : str, padrao : str) -> str:
+        '''Lê uma configuração opcional do config.txt, escrita como 'chave=valor' depois das 4 linhas fixas
+        Se a chave não existir no arquivo, ou se o arquivo não existir, retorna o valor padrão
+
+        params
+        ------
+        chave : str
+            Nome da configuração
+        padrao : str
+            Valor usado quando a configuração não está no arquivo
+
+        returns
+        -------
+        str
+            Valor da configuração'''
+
+        try:
+            with open('config.txt', mode='r') as file:
+                for linha in file.readlines():
+                    x = linha.replace('\n','').split('=', 1)
+                    if len(x) == 2 and x[0].strip() == chave:
+                        return x[1].strip()
+        except FileNotFoundError:
+            pass
+        return padrao
+
+
+    def modo_carga(self, connection : sqlite3.Connection, ativo : bool, retomavel : bool = False):
+        '''Liga ou desliga os PRAGMAs de carga em massa do SQLite
+
+        Durante a carga: sem journal, sem fsync, cache grande e lock exclusivo no arquivo. Acelera muito os inserts,
+        mas se o programa cair no meio da carga a table fica inconsistente, por isso só é usado no database novo, nunca no vigente.
+        Ao desligar, volta para as configurações seguras de consulta.
+
+        params
+        ------
+        connection : sqlite3.Connection
+            Conexão do database que está sendo carregado
+        ativo : bool
+            True para entrar no modo de carga, False para voltar ao modo de consulta
+        retomavel : bool
+            Usa WAL em vez de desligar o journal: cada commit é um checkpoint que sobrevive se o programa cair,
+            e a carga pode continuar de onde parou. Continua sem fsync, então só protege contra queda do programa, não do Windows'''
+
+        # PRAGMA de journal não pode ser alterado no meio de uma transação
+        connection.commit()
+        if ativo:
+            connection.execute(f'''PRAGMA journal_mode={'WAL' if retomavel else 'OFF'}''')
+            connection.execute('''PRAGMA synchronous=OFF''')
+            connection.execute(f'''PRAGMA cache_size=-{CACHE_CARGA_KIB}''')
+            connection.execute('''PRAGMA locking_mode=EXCLUSIVE''')
+        else:
+            connection.execute('''PRAGMA journal_mode=DELETE''')
+            connection.execute('''PRAGMA synchronous=FULL''')
+            connection.execute('''PRAGMA cache_size=-2000''')
+            connection.execute('''PRAGMA locking_mode=NORMAL''')
+            # O lock exclusivo só é liberado no próximo acesso ao arquivo
+            connection.execute('''SELECT COUNT(*) FROM sqlite_master''').fetchone()
+
+
+    def promove_tabela(self, staging : str, tabela : str, indices : tuple = (), conteudo : tuple = None):
+        '''Troca a table vigente pela table de staging em uma única transação
+        Quem está consultando vê a table antiga inteira ou a nova inteira, nunca uma table vazia ou pela metade
+
+        params
+        ------
+        staging : str
+            Nome da table já carregada e validada
+        tabela : str
+            Nome da table vigente, que será substituída
+        indices : tuple
+            CREATE INDEX da table vigente, os índices antigos saem junto com ela e são recriados na nova, na mesma transação
+        conteudo : tuple
+            (fonte, SHA-256, hash das linhas) da planilha carregada, gravado na CONTEUDOS_ABECS na mesma transação'''
+
+        self.connection.commit()
+        # Sem o modo legado o RENAME valida as views, e as views da table vigente ficam sem table entre o DROP e o RENAME
+        self.cursor.execute('''PRAGMA legacy_alter_table=ON''')
+        try:
+            self.cursor.execute('''BEGIN''')
+            self.cursor.execute(f'''DROP TABLE IF EXISTS {tabela}''')
+            self.cursor.execute(f'''ALTER TABLE {staging} RENAME TO {tabela}''')
+            for indice in indices:
+                self.cursor.execute(indice)
+            if conteudo:
+                self.cursor.execute('''INSERT OR REPLACE INTO CONTEUDOS_ABECS VALUES (?,?,?)''', conteudo)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.cursor.execute('''PRAGMA legacy_alter_table=OFF''')
+
+
+    def promove_database(self) -> bool:
+        '''Se existir um database_pronto.db (database da receita já carregado e validado), ele substitui o database.db
+        As tables das outras fontes (ABECS) são copiadas do database vigente antes da troca, para não voltarem para uma versão antiga
+        A troca é um único rename do arquivo: ou fica o database antigo inteiro ou o novo inteiro
+
+        No Windows o rename falha se outro processo estiver com o database.db aberto,
+        nesse caso o arquivo pronto fica guardado e a troca é feita na próxima abertura do programa
+
+        returns
+        -------
+        bool
+            True se o database foi trocado'''
+
+        if not os.path.isfile(self.path_database_pronto):
+            return False
+
+        # Fecha a conexão com o database vigente, se já foi aberta
+        reabrir = getattr(self, 'connection', None) is not None
+        if reabrir:
+            self.connection.close()
+
+        # Índices da receita criados antes da troca, com as consultas ainda no database vigente
+        pronto = sqlite3.Connection(self.path_database_pronto)
+        for indice in INDICES_DADOS_RECEITA:
+            pronto.execute(indice)
+        pronto.commit()
+        pronto.close()
+
+        try:
+            # A conexão de consulta da GUI também é fechada durante a troca, e reabre sozinha no database novo
+            with self.consultas.pausa() if self.consultas else nullcontext():
+                pronto = sqlite3.Connection(self.path_database_pronto)
+                if os.path.isfile(self.path_database):
+                    pronto.execute('''ATTACH DATABASE ? AS vigente''', (self.path_database,))
+                    existentes = {e[0] for e in pronto.execute('''SELECT tbl_name FROM main.sqlite_master''').fetchall()}
+                    # Copia tables, depois índices e views, do vigente que não existem no novo
+                    objetos = pronto.execute('''
+                    SELECT type, name, tbl_name, sql FROM vigente.sqlite_master
+                    WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+                    ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END''').fetchall()
+                    for tipo, nome, tabela, sql in objetos:
+                        if tabela in existentes:
+                            continue
+                        pronto.execute(sql)
+                        if tipo == 'table':
+                            pronto.execute(f'''INSERT INTO main.{nome} SELECT * FROM vigente.{nome}''')
+                    pronto.commit()
+                    pronto.execute('''DETACH DATABASE vigente''')
+                pronto.close()
+                os.replace(self.path_database_pronto, self.path_database)
+            print('Novo database promovido para consultas')
+            trocou = True
+        except PermissionError:
+            print('Database vigente está aberto em outro programa, a troca será feita na próxima abertura')
+            trocou = False
+
+        if reabrir:
+            self.connection = sqlite3.Connection(self.path_database)
+            self.cursor = self.connection.cursor()
+        return trocou
+
+
+    def update_download_receita(self, fila : queue.Queue = None):
         '''Se a configuração permitir updates, e a versão vigente dos dados for diferente da encontrada no webscraping,
         cria uma pasta temporária para os downloads dos novos arquivos
         
         Verifica se todos os arquivos .zip já foram baixados da receita.
-        Enquanto houverem arquivos Estabelecimentos(n).zip para baixar, continua tentando pelo wget.
-        Depois de todos os files baixados, descompacta todos eles''' 
+        A lista de arquivos Estabelecimentos(n).zip é buscada antes, e os que faltam são baixados em paralelo
+        ('downloads_paralelos=' e 'conexoes_por_host=' no config.txt)
+        Por padrão os .zip ficam compactados e são lidos direto do zip na inserção no database.
+        Com 'extrair_zip=sim' no config.txt, depois de todos os files baixados, descompacta todos eles
+
+        params
+        ------
+        fila : queue.Queue
+            Se informada, cada arquivo é colocado na fila assim que estiver baixado, para a próxima etapa do pipeline_receita()
+            Nesse caso a extração fica com a etapa de extração do pipeline''' 
         
         if self.update and (self.current_versions['receita'][0] != self.current_versions['receita'][1]):
             '''Cria pasta de arquivos temporários se ela não existir'''
             if not os.path.isdir(self.path_temp):
                 os.mkdir(self.path_temp)
 
-            '''Deleta arquivos .tmp de jobs de download que possam ter falhado anteriormente'''
+            '''Deleta arquivos .tmp de jobs de download do wget que possam ter falhado anteriormente
+            Downloads interrompidos da receita ficam em .part (ou .seg, se baixados em pedaços), e continuam de onde pararam'''
             for file in os.listdir(os.path.join(self.path_script,'temp\\')):
                 if file.endswith(".tmp"):
                     os.remove(os.path.join(self.path_script,f'temp\\{file}'))
             
-            files = 'https://dadosabertos.rfb.gov.br/CNPJ/Estabelecimentos'
-
             print(f'''--------------------------------------------------------------------------------
 Arquivos da receita devem ser atualizados!
 A versão atual da base é {self.current_versions["receita"][0]},
@@ -183,109 +2013,461 @@ Se esse for o caso, recomendo esperar alguns dias e travar os updates, como deta
             '''Verifica se todos os .zip já foram baixados, se não, baixa eles'''
             # Usa replace pq não pode '/' em nome de arquivos! info do scraping vem como dd/mm/aaaa
             data_arquivos_receita = self.current_versions["receita"][1].replace("/","_")
-            faltam_arquivos = True
-            i = 0
-            while faltam_arquivos == True:
-                # Se o arquivo Estabelecimento(n)_data_arquivo em .zip ou .ESTABELE existe, itera para o próximo download
-                if os.path.isfile(os.path.join(self.path_script,f'temp\\Estabelecimentos{i}_{data_arquivos_receita}.zip')) \
-                or os.path.isfile(os.path.join(self.path_script,f'temp\\Estabelecimentos{i}_{data_arquivos_receita}.ESTABELE')):
-                    i += 1
-                    print(f'O {i}º arquivo da receita já foi baixado')
+            espelho = self.le_config('espelho', '')
+            if self.espelho:
+                # Arquivos publicados no espelho interno, com o mesmo nome usado na pasta \temp
+                arquivos_receita = [(int(re.search(r'Estabelecimentos(\d+)_', nome).group(1)), caminho_espelho(espelho, nome))
+                                    for nome in self.espelho['arquivos'].get('receita', dict())]
+            else:
+                arquivos_receita = lista_arquivos_receita(self.le_config('url_receita', URL_RECEITA))
+            print(f'{len(arquivos_receita)} arquivos da receita encontrados')
+            if not arquivos_receita:
+                self.erros_download.append(espelho or self.le_config('url_receita', URL_RECEITA))
+            # Tamanho e SHA-256 dos .zip baixados, para não baixar de novo o que está íntegro
+            manifesto = Manifesto(os.path.join(self.path_script,'temp\\manifesto.json'))
+            pendentes = list()
+            for i, url in arquivos_receita:
+                # Se o arquivo Estabelecimento(n)_data_arquivo em .zip ou .ESTABELE existe, não baixa de novo
+                extraido = os.path.join(self.path_script,f'temp\\Estabelecimentos{i}_{data_arquivos_receita}.ESTABELE')
+                destino = os.path.join(self.path_script,f'temp\\Estabelecimentos{i}_{data_arquivos_receita}.zip')
+                # .zip corrompido é baixado de novo, só ele
+                if os.path.isfile(destino) and not os.path.isfile(extraido) and not manifesto.confere(destino):
+                    print(f'O {i+1}º arquivo da receita está corrompido e será baixado de novo')
+                    os.remove(destino)
+                    manifesto.remove(destino)
+                if os.path.isfile(destino) or os.path.isfile(extraido):
+                    if fila is not None:
+                        # Arquivo já extraído tem preferência sobre o .zip
+                        fila.put(extraido if os.path.isfile(extraido) else destino)
+                    print(f'O {i+1}º arquivo da receita já foi baixado')
                 else:
-                    # Se ele não existe, tenta baixar até acabar o total de arquivos disponíveis na receita federal
+                    pendentes.append((url, destino))
+
+            # Cada download avisa a próxima etapa assim que termina, sem esperar os outros
+            # O limite por servidor evita que a receita derrube as conexões quando há muitos downloads em paralelo
+            paralelos = int(self.le_config('downloads_paralelos', DOWNLOADS_PARALELOS))
+            por_host = int(self.le_config('conexoes_por_host', CONEXOES_POR_HOST))
+            segmentos = int(self.le_config('segmentos_download', SEGMENTOS_DOWNLOAD))
+            limites = {urlsplit(url).netloc : threading.BoundedSemaphore(por_host) for url, _ in pendentes}
+            progresso = ProgressoDownload(len(pendentes), self.parar_receita)
+
+            def baixa(url : str, destino : str) -> str:
+                if self.parar_receita.is_set():
+                    raise DownloadInterrompido(destino)
+                if self.espelho:
+                    nome = os.path.basename(destino)
+                    return obtem_do_espelho(espelho, nome, destino, self.espelho['arquivos']['receita'][nome], manifesto,
+                                            progresso, limites[urlsplit(url).netloc])
+                return baixa_arquivo(url, destino, progresso, limites[urlsplit(url).netloc], segmentos, manifesto)
+
+            # Tempo da etapa vai até o último download terminar: a espera para colocar o arquivo na fila
+            # (etapa seguinte mais lenta) não conta como tempo de download
+            inicio = time.perf_counter()
+            fins = [inicio]
+            with ThreadPoolExecutor(max(1, paralelos)) as executor:
+                downloads = {executor.submit(baixa, url, destino) : url for url, destino in pendentes}
+                for download in downloads:
+                    download.add_done_callback(lambda download : fins.append(time.perf_counter()))
+                for download in as_completed(downloads):
                     try:
-                        print(f'''
-Baixando o {(i+1)}º arquivo da receita''')
-                        wget.download(url=f'{files}{i}.zip', out=os.path.join(self.path_script,f'temp\\Estabelecimentos{i}_{data_arquivos_receita}.zip'))
-                        i += 1
+                        destino = download.result()
+                        # Tamanho bate com o do servidor, mas o conteúdo pode não ser um .zip (ex: página de erro)
+                        if not zip_integro(destino):
+                            os.remove(destino)
+                            manifesto.remove(destino)
+                            raise IOError('arquivo baixado não é um .zip válido')
+                        if fila is not None:
+                            fila.put(destino)
+                    except DownloadInterrompido:
+                        # O .part fica na pasta, e o download continua no próximo update
+                        pass
                     except Exception as e:
-                    # Se não conseguir baixar ou não houver arquivos para baixar, ou outros erros, fecha o loop
-                        print(f'Arquivo {i+1} = {e} | Ou arquivo não existe')
-                        faltam_arquivos = False
+                        # O .part fica na pasta, e o arquivo é baixado de novo na próxima abertura do programa
+                        print(f'''
+Erro ao baixar {downloads[download]} = {e}''')
+                        self.erros_download.append(downloads[download])
+            self.tempos_etapas['download'] += max(fins) - inicio
+            print()
             
-            ''' Checka os arquivos .zip
+            ''' Checka os arquivos .zip, se a extração estiver habilitada
             Se o arquivo já tiver sido descompactado, deleta o arquivo zipado
             Se não, extrai e deleta o file zipado equivalente'''
             
+            # Sem extração os .zip são lidos direto no atualizar_receita, sem ocupar o disco com os .ESTABELE de vários GB
+            # No pipeline a extração é feita pela etapa de extração, arquivo por arquivo
+            if self.le_config('extrair_zip', 'nao') not in ('Sim','sim','SIM','S','s') or fila is not None:
+                return
+
             # Olha todos os arquivos na pasta temporária
             for file in os.listdir(os.path.join(self.path_script,'temp')):
                 full_path_file = os.path.join(self.path_script,f'temp\\{file}')
                 # Se o arquivo for zip, vê se existe um arquivo equivalente .ESTABELE já extraído, se sim, exclui o .zip
+                # (publicando no espelho o .zip fica, ver extrai_zip())
                 if file.endswith(".zip"):
                     if file[:-4] + '.ESTABELE' in os.listdir(os.path.join(self.path_script,'temp')):
-                        os.remove(os.path.join(self.path_script,f'temp\\{file}'))
+                        if not self.le_config('publica_espelho', ''):
+                            os.remove(os.path.join(self.path_script,f'temp\\{file}'))
                     # Se não tiver sido extraído ainda, extrai, renomeia para o mesmo nome mas com a extensão .ESTABELE e deleta o arquivo .zip
                     else:
-                        with ZipFile(full_path_file) as arquivozip:
-                            zip0 = arquivozip.infolist()[0]
-                            zip0.filename = file[:-4] + '.ESTABELE'
-                            arquivozip.extract(zip0, path=os.path.join(self.path_script,f'temp\\'))
-                            print(f'Extraindo o arquivo {zip0.filename}')
-                        os.remove(os.path.join(self.path_script,f'temp\\{file}'))
+                        self.extrai_zip(full_path_file)
+
+
+    def extrai_zip(self, full_path_file : str) -> str:
+        '''Extrai o arquivo de dentro do .zip da receita com o mesmo nome, mas com a extensão .ESTABELE, e deleta o .zip
+        Com 'publica_espelho=' no config.txt o .zip fica na pasta \\temp até o fim do update: o espelho publica os .zip,
+        e as instalações que usam o espelho sem o snapshot precisam deles
+
+        params
+        ------
+        full_path_file : str
+            Caminho do arquivo .zip
+
+        returns
+        -------
+        str
+            Caminho do arquivo .ESTABELE'''
+
+        file = os.path.basename(full_path_file)
+        with ZipFile(full_path_file) as arquivozip:
+            zip0 = arquivozip.infolist()[0]
+            zip0.filename = file[:-4] + '.ESTABELE'
+            arquivozip.extract(zip0, path=os.path.join(self.path_script,f'temp\\'))
+            print(f'Extraindo o arquivo {zip0.filename}')
+        if not self.le_config('publica_espelho', ''):
+            os.remove(os.path.join(self.path_script,f'temp\\{file}'))
+        return os.path.join(self.path_script,f'temp\\{zip0.filename}')
+
+
+    def etapa_download(self, fila : queue.Queue):
+        '''Etapa de download do pipeline_receita(): baixa os arquivos e avisa a próxima etapa com None ao terminar'''
+
+        try:
+            self.etapa = 'Receita: baixando arquivos'
+            self.update_download_receita(fila)
+        finally:
+            fila.put(None)
+
+
+    def etapa_extracao(self, entrada : queue.Queue, saida : queue.Queue):
+        '''Etapa de extração do pipeline_receita(), só usada com 'extrair_zip=sim' no config.txt
+        Extrai cada .zip assim que ele é baixado, enquanto o próximo ainda está baixando'''
+
+        try:
+            for arquivo in itera_fila(entrada):
+                # Pipeline parando: só esvazia a fila
+                if self.parar_receita.is_set():
+                    continue
+                if arquivo.endswith('.zip'):
+                    inicio = time.perf_counter()
+                    arquivo = self.extrai_zip(arquivo)
+                    self.tempos_etapas['extracao'] += time.perf_counter() - inicio
+                saida.put(arquivo)
+        finally:
+            saida.put(None)
+
+
+    def pipeline_receita(self):
+        '''Update da receita em etapas que rodam ao mesmo tempo, ligadas por filas de tamanho limitado:
+        download -> extração (opcional) -> parsing (workers) -> inserção no database
+        Enquanto o arquivo N+1 baixa, o arquivo N é lido e inserido no database.
+        O tempo total fica perto do tempo da etapa mais lenta, e não da soma de todas.
+        No final mostra quanto tempo cada etapa ficou trabalhando, para achar o gargalo
+        Se a inserção der erro, as outras etapas são paradas antes de sair: nenhum download fica rodando em segundo plano'''
+
+        for etapa in self.tempos_etapas:
+            self.tempos_etapas[etapa] = 0.0
+        self.erros_download = list()
+        self.parar_receita.clear()
+        inicio = time.perf_counter()
+
+        # Filas pequenas: uma etapa não corre muito na frente da outra
+        fila_download = queue.Queue(maxsize=2)
+        etapas = [threading.Thread(target=self.etapa_download, args=(fila_download,), daemon=True)]
+        if self.le_config('extrair_zip', 'nao') in ('Sim','sim','SIM','S','s'):
+            fila_arquivos = queue.Queue(maxsize=2)
+            etapas.append(threading.Thread(target=self.etapa_extracao, args=(fila_download, fila_arquivos), daemon=True))
+        else:
+            fila_arquivos = fila_download
+        for etapa in etapas:
+            etapa.start()
+
+        try:
+            self.atualizar_receita(itera_fila(fila_arquivos))
+        finally:
+            # Normalmente as etapas já terminaram. Se a inserção parou no meio, avisa as etapas para pararem,
+            # e esvazia a fila para nenhuma ficar travada esperando espaço nela
+            if any(etapa.is_alive() for etapa in etapas):
+                self.parar_receita.set()
+            while any(etapa.is_alive() for etapa in etapas):
+                try:
+                    fila_arquivos.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            for etapa in etapas:
+                etapa.join()
+
+        duracao = time.perf_counter() - inicio
+        print('''--------------------------------------------------------------------------------
+Tempo de cada etapa do update da receita (tempo de relógio, parsing em paralelo é o tempo médio de cada worker):''')
+        for etapa, segundos in self.tempos_etapas.items():
+            print(f'{etapa}: {segundos:.0f}s')
+        print(f'''Tempo total: {duracao:.0f}s
+Etapa mais lenta: {max(self.tempos_etapas, key=self.tempos_etapas.get)}
+--------------------------------------------------------------------------------''')
+
+
+    def le_progresso_receita(self) -> dict:
+        '''Lê os checkpoints de uma carga da receita que foi interrompida, no database novo
+
+        returns
+        -------
+        dict
+            {(arquivo, byte inicial do trecho) : (linhas gravadas, trecho concluído)}
+            Vazio se não existir database novo, ou se ele for de outra versão da receita'''
+
+        if not os.path.isfile(self.path_database_novo):
+            return dict()
+        novo = sqlite3.Connection(self.path_database_novo)
+        try:
+            versao = novo.execute('''SELECT VERSAO FROM CARGA_RECEITA_INFO''').fetchone()
+            if not versao or versao[0] != self.current_versions['receita'][1]:
+                return dict()
+            return {(arquivo, inicio) : (linhas, bool(concluido))
+                    for arquivo, inicio, linhas, _, concluido in novo.execute('''SELECT * FROM CARGA_RECEITA''')}
+        # Sem as tables de checkpoint (carga antiga ou database corrompido), não dá para continuar
+        except sqlite3.DatabaseError:
+            return dict()
+        finally:
+            novo.close()
+
+
+    def le_lotes_receita(self, arquivos, tamanho_lote : int, progresso : dict = None):
+        '''Lê os arquivos da receita e entrega os lotes de registros para quem escreve no database
+
+        Com mais de um worker (configuração 'workers=' no config.txt), os arquivos são divididos em trechos
+        e processados em paralelo por um Pool de processos. Os lotes voltam por uma fila de tamanho limitado,
+        e só o processo principal escreve no SQLite.
+        Os arquivos podem ir chegando durante a leitura (pipeline_receita()): cada um é dividido em trechos
+        e mandado para os workers assim que chega, enquanto os próximos ainda estão baixando.
+
+        params
+        ------
+        arquivos : list ou iterável
+            Caminhos dos arquivos .ESTABELE ou .zip
+        tamanho_lote : int
+            Quantidade máxima de linhas por lote
+        progresso : dict
+            Checkpoints de uma carga interrompida, ver le_progresso_receita()
+            Trechos concluídos não são lidos de novo, e os outros pulam as linhas que já foram gravadas
+
+        returns
+        -------
+        generator
+            Tuplas (lote, linhas lidas, linhas com erro, trecho)
+            Quando um trecho termina, entrega (None, 0, 0, trecho)'''
+
+        progresso = progresso or dict()
+        # Mapa de colunas do config.txt, lido uma vez e passado para os workers
+        indices = indices_colunas(le_colunas_receita(self.le_config('colunas_receita', '')))
+
+        def trechos_pendentes():
+            for arquivo in arquivos:
+                for trecho in planeja_trechos([arquivo]):
+                    linhas_gravadas, concluido = progresso.get(chave_trecho(trecho), (0, False))
+                    if not concluido:
+                        yield trecho, linhas_gravadas
+
+        # Por padrão deixa um núcleo livre para o processo que escreve no database
+        workers = int(self.le_config('workers', max(1, (os.cpu_count() or 2) - 1)))
+        print(f'Arquivos da receita processados por {workers} worker(s)')
+
+        if workers <= 1:
+            for trecho, pular in trechos_pendentes():
+                lotes = le_lotes_trecho(trecho, tamanho_lote, pular, indices)
+                while True:
+                    inicio = time.perf_counter()
+                    lote = next(lotes, None)
+                    self.tempos_etapas['parsing'] += time.perf_counter() - inicio
+                    if lote is None:
+                        break
+                    yield lote + (trecho,)
+                yield (None, 0, 0, trecho)
+            return
+
+        fila = multiprocessing.Queue(maxsize=workers * 2)
+        with multiprocessing.Pool(workers, initializer=_inicia_worker, initargs=(fila,)) as pool:
+            resultados = list()
+
+            def alimenta_workers():
+                '''Manda os trechos para os workers conforme os arquivos chegam, e no final avisa quantos foram'''
+                total = 0
+                try:
+                    for trecho, pular in trechos_pendentes():
+                        resultados.append(pool.apply_async(_processa_trecho, (trecho, tamanho_lote, pular, indices)))
+                        total += 1
+                finally:
+                    fila.put(('total', total, 0, 0, None))
+
+            alimentador = threading.Thread(target=alimenta_workers, daemon=True)
+            alimentador.start()
+            total = None
+            terminados = 0
+            while total is None or terminados < total:
+                tipo, valor, linhas, erros, trecho = fila.get()
+                if tipo == 'lote':
+                    yield (valor, linhas, erros, trecho)
+                elif tipo == 'fim':
+                    terminados += 1
+                    # Tempo de todos os workers dividido entre eles, para comparar com as outras etapas (tempo de relógio)
+                    self.tempos_etapas['parsing'] += valor / workers
+                    # Trecho que deu erro não é marcado como concluído
+                    if linhas:
+                        yield (None, 0, 0, trecho)
+                else:
+                    total = valor
+            alimentador.join()
+            print(f'{total} trechos de arquivos da receita processados')
+            # Levanta erros que tenham acontecido nos workers
+            for resultado in resultados:
+                resultado.get()
 
 
-    def atualizar_receita(self):
-        '''Para cada um dos arquivos .ESTABELE na pasta \temp, separa os campos relevantes:
+    def atualizar_receita(self, arquivos = None):
+        '''Para cada um dos arquivos .ESTABELE (ou .zip ainda não extraído) na pasta \temp, separa os campos relevantes:
         CNPJ, CNAE_PRIMÁRIO, CNAE SECUNDÁRIO E SITUAÇÃO NA RECEITA
-        Insere no database, dando drop na table anterior'''
+        Insere em um database novo (database_novo.db), enquanto as consultas continuam no database vigente
+        Depois de validado, só as diferenças para o database vigente são aplicadas nele (modo delta),
+        ou o database novo substitui o vigente de uma vez só (modo completo)
+
+        params
+        ------
+        arquivos : iterável
+            Arquivos a inserir, que podem ir chegando durante a carga (ver pipeline_receita())
+            Se não for informado, usa os arquivos que já estão na pasta \temp'''
         
         print('''--------------------------------------------------------------------------------
 Os arquivos serão inseridos no banco de dados, por favor, não feche o programa
 --------------------------------------------------------------------------------''')
 
-        # Dropa a table anterior de dados da receita e recria ela
-        self.cursor.execute('''DROP TABLE DADOS_RECEITA''')
-        
-        self.connection.commit()
-        
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS DADOS_RECEITA
-        ([CNPJ_RECEITA] TEXT PRIMARY KEY, [SITUACAO_CADASTRAL_RECEITA] TEXT, [CNAE_PRINCIPAL_RECEITA] TEXT, [CNAES_SECUNDARIOS_RECEITA] TEXT)
-        ''')
-
-        # Lê lista de arquivos .ESTABELE 
-        estabele = list()
-        for file in os.listdir(os.path.join(self.path_script,'temp\\')):
-            if file.endswith('.ESTABELE'):
-                estabele.append(os.path.join(self.path_script,f'temp\\{file}'))
-                
+        # Um database novo que tenha sobrado de uma carga interrompida da mesma versão continua de onde parou
+        # Se for de outra versão, ou de uma carga sem checkpoints, começa do zero
+        checkpoint_lotes = int(self.le_config('checkpoint_lotes', CHECKPOINT_LOTES_RECEITA))
+        progresso = self.le_progresso_receita() if checkpoint_lotes > 0 else dict()
+        if not progresso:
+            remove_database(self.path_database_novo)
+
+        novo = sqlite3.Connection(self.path_database_novo)
+        cursor_novo = novo.cursor()
+        cursor_novo.execute(DDL_DADOS_RECEITA)
+        cursor_novo.execute(DDL_CARGA_RECEITA)
+        cursor_novo.execute(DDL_CARGA_RECEITA_INFO)
+        cursor_novo.execute('''INSERT OR REPLACE INTO CARGA_RECEITA_INFO VALUES (1, ?)''', (self.current_versions['receita'][1],))
+        if progresso:
+            print(f'Continuando a carga interrompida: {sum(linhas for linhas, _ in progresso.values())} linhas já gravadas')
+
+        # Lê lista de arquivos .ESTABELE, e de .zip que não foram extraídos (são lidos direto do zip)
+        if arquivos is None:
+            arquivos = list()
+            arquivos_temp = os.listdir(os.path.join(self.path_script,'temp\\'))
+            for file in arquivos_temp:
+                if file.endswith('.ESTABELE') or (file.endswith('.zip') and file[:-4] + '.ESTABELE' not in arquivos_temp):
+                    arquivos.append(os.path.join(self.path_script,f'temp\\{file}'))
+
+        def estabele():
+            for e in arquivos:
+                print(f'Inserindo o arquivo {e} na base de dados')
+                yield e
+
         # Retira os dados desnecessários dos arquivos e insere na table
         # Conta quantos registros foram inseridos, e se houveram erros
         count_lines = 0
         erros = 0 # seria melhor um dict com o nome do arquivo e quantidade de erros como value, mas habemus preguiça
-        for e in estabele:
-            print(f'Inserindo o arquivo {e} na base de dados')
-            with open(e, mode='r', encoding='latin-1') as arq: # encoding vigente é 'latin-1' -> outubro_2023
-                for z in arq.readlines():
-                    count_lines += 1
-                    try:
-                        x = z.split(";")
-                        cnpj = (x[0] + x[1] + x[2]).replace('"','')
-                        situacao_cadastral = x[5].replace('"','')
-                        cnae_p = x[11].replace('"','')
-                        cnae_s = x[12].replace('"','')
-                        dados = (cnpj, situacao_cadastral, cnae_p, cnae_s)
-                        self.cursor.execute('''INSERT OR REPLACE INTO DADOS_RECEITA VALUES (?,?,?,?)''', dados)
-                    except:
-                        erros += 1
-
-        '''Dá commit() no SQL e testa se há o mesmo número de registro no database que linhas nos arquivos
-        Se estiver funcionando, apaga todos os arquivos baixados anteriormente
-        Atualiza config '''
-        
+        tamanho_lote = int(self.le_config('tamanho_lote', TAMANHO_LOTE_RECEITA))
+        inicio = time.perf_counter()
+        # Modo de carga só no database novo: o vigente continua disponível para consultas
+        self.modo_carga(novo, True, retomavel=checkpoint_lotes > 0)
+        try:
+            # Arquivos são lidos em lotes de tamanho fixo, a memória usada não depende do tamanho do .ESTABELE
+            # Leitura e separação dos campos rodam em paralelo, apenas este processo escreve no database
+            # Cada lote e o avanço do seu trecho na CARGA_RECEITA vão na mesma transação: depois de um commit,
+            # a carga continua exatamente dali. Se um lote for gravado de novo, o INSERT OR REPLACE pelo CNPJ não duplica nada
+            lotes_pendentes = 0
+            for lote, linhas, erros_lote, trecho in self.le_lotes_receita(estabele(), tamanho_lote, progresso):
+                inicio_insercao = time.perf_counter()
+                if lote is None:
+                    cursor_novo.execute('''UPDATE CARGA_RECEITA SET CONCLUIDO = 1 WHERE ARQUIVO = ? AND INICIO = ?''',
+                                        chave_trecho(trecho))
+                    cursor_novo.execute('''INSERT OR IGNORE INTO CARGA_RECEITA VALUES (?,?,0,0,1)''', chave_trecho(trecho))
+                else:
+                    cursor_novo.executemany('''INSERT OR REPLACE INTO DADOS_RECEITA VALUES (?,?,?,?,?)''', lote)
+                    cursor_novo.execute('''INSERT INTO CARGA_RECEITA VALUES (?,?,?,?,0)
+                                        ON CONFLICT (ARQUIVO, INICIO) DO UPDATE SET LINHAS = LINHAS + excluded.LINHAS, ERROS = ERROS + excluded.ERROS''',
+                                        chave_trecho(trecho) + (linhas, erros_lote))
+                    count_lines += linhas
+                    erros += erros_lote
+                    lotes_pendentes += 1
+                    self.etapa = f'Receita: {count_lines} linhas carregadas'
+                if checkpoint_lotes > 0 and lotes_pendentes >= checkpoint_lotes:
+                    novo.commit()
+                    lotes_pendentes = 0
+                self.tempos_etapas['insercao'] += time.perf_counter() - inicio_insercao
+
+            inicio_insercao = time.perf_counter()
+            novo.commit()
+            self.tempos_etapas['insercao'] += time.perf_counter() - inicio_insercao
+        finally:
+            # Volta para as configurações de consulta mesmo se a carga der erro
+            # Sem o commit, o que estiver pendente desde o último checkpoint é descartado
+            novo.rollback()
+            self.modo_carga(novo, False)
+        duracao = time.perf_counter() - inicio
+        velocidade = count_lines / max(duracao, 0.001)
+
+        # Sem todos os arquivos a base ficaria incompleta: a carga fica guardada no database novo,
+        # e continua na próxima abertura do programa, depois de baixar o que faltou
+        if self.erros_download:
+            novo.close()
+            print(f'''--------------------------------------------------------------------------------
+{len(self.erros_download)} arquivo(s) da receita não foram baixados, a base não foi atualizada
+O que já foi carregado continua na próxima abertura do programa
+--------------------------------------------------------------------------------''')
+            return
+
+        # Totais incluem o que foi gravado antes de uma interrupção
+        count_lines, erros = cursor_novo.execute('''SELECT COALESCE(SUM(LINHAS), 0), COALESCE(SUM(ERROS), 0) FROM CARGA_RECEITA''').fetchone()
+        # Carga completa, os checkpoints não vão para o database vigente
+        cursor_novo.execute('''DROP TABLE CARGA_RECEITA''')
+        cursor_novo.execute('''DROP TABLE CARGA_RECEITA_INFO''')
+        novo.commit()
+
         print(f'''--------------------------------------------------------------------------------
 Linhas com erros que não foram inseridas: {erros}
 Quantidade de linhas nos arquivos da receita: {count_lines}
+Tempo de carga: {duracao:.0f}s ({velocidade:.0f} linhas/s)
 --------------------------------------------------------------------------------''')
 
-        self.connection.commit()
-        
-        z = self.cursor.execute('''SELECT COUNT(*) FROM DADOS_RECEITA''').fetchone()  
-        if z:
+        '''Valida o database novo: tem que ter registros e passar no quick_check do SQLite, já que foi escrito sem journal
+        Se estiver funcionando, troca o database vigente pelo novo e apaga todos os arquivos baixados anteriormente
+        Atualiza config '''
+
+        z = cursor_novo.execute('''SELECT COUNT(*) FROM DADOS_RECEITA''').fetchone()
+        integridade = cursor_novo.execute('''PRAGMA quick_check''').fetchone()
+        novo.close()
+        if z[0] > 0 and integridade[0] == 'ok':
             print(f'Quantidade de linhas no database: {z}')
             print(f'Diferença de linhas dos arquivos e registros no database: {count_lines - z[0]}')
-            # Deleta pasta \temp
-            shutil.rmtree(os.path.join(self.path_script,'temp\\'))
+            # Modo delta (padrão): só as diferenças entre a versão vigente e a nova são escritas no database vigente
+            # Modo completo ('modo_receita=completo' no config.txt) ou database vigente vazio: o database novo substitui o vigente
+            vigente = self.cursor.execute('''SELECT 1 FROM DADOS_RECEITA LIMIT 1''').fetchone()
+            if self.le_config('modo_receita', 'delta') == 'delta' and vigente:
+                path_delta = self.gera_delta_receita()
+                self.aplica_delta_receita(path_delta)
+                remove_database(self.path_database_novo)
+                print(f'Alterações da receita guardadas em {path_delta}')
+            else:
+                # Database novo validado, fica como pronto e substitui o vigente
+                os.replace(self.path_database_novo, self.path_database_pronto)
+                self.promove_database()
             with open('config.txt', mode='r') as read:
                 atual = read.readlines()
                 nova_data_update = f'receita={self.current_versions["receita"][1]}\n'
@@ -293,117 +2475,315 @@ Quantidade de linhas nos arquivos da receita: {count_lines}
                 read.close()
                 with open('config.txt', mode='w') as write:
                     write.writelines(atual)
+            self.salva_sonda('receita')
+            # Publica os .zip (os .ESTABELE extraídos não vão para o espelho) antes de apagar a pasta \temp
+            self.publica_espelho('receita', [os.path.join(self.path_script,f'temp\\{file}')
+                                             for file in os.listdir(os.path.join(self.path_script,'temp\\'))
+                                             if file.startswith('Estabelecimentos') and file.endswith('.zip')])
+            # Deleta pasta \temp
+            shutil.rmtree(os.path.join(self.path_script,'temp\\'))
             print('''Base da Receita Federal atualizada!
 --------------------------------------------------------------------------------''')
-        # Se o COUNT(*) falhar, não excluí os arquivos da pasta \temp, para não precisar baixar tudo outra vez        
+        # Se a validação falhar, o database vigente não é alterado e não excluí os arquivos da pasta \temp, para não precisar baixar tudo outra vez
         else:
+            remove_database(self.path_database_novo)
             print('Erro ao subir os arquivos do database, tente novamente')
 
 
+    def gera_delta_receita(self) -> str:
+        '''Compara o database novo da receita com o vigente e grava só as diferenças em um arquivo de delta
+        O delta fica guardado na pasta \\deltas, como registro do que mudou entre uma versão e outra da receita
+
+        Table DELTA_RECEITA: mesmas colunas da DADOS_RECEITA, mais OPERACAO:
+        'I' = CNPJ novo, 'U' = CNPJ que mudou de situação/CNAE, 'D' = CNPJ que saiu da base
+        Table DELTA_INFO: versões comparadas e quantidade de cada operação
+
+        returns
+        -------
+        str
+            Caminho do arquivo de delta'''
+
+        if not os.path.isdir(self.path_deltas):
+            os.mkdir(self.path_deltas)
+        versao_anterior = self.current_versions['receita'][0]
+        versao_nova = self.current_versions['receita'][1]
+        path_delta = os.path.join(self.path_deltas, f'delta_receita_{versao_nova.replace("/","_")}.db')
+        if os.path.isfile(path_delta):
+            os.remove(path_delta)
+
+        delta = sqlite3.Connection(path_delta)
+        delta.execute('''
+        CREATE TABLE DELTA_RECEITA
+        ([CNPJ_RECEITA] INTEGER PRIMARY KEY, [OPERACAO] TEXT, [DV_RECEITA] INTEGER, [SITUACAO_CADASTRAL_RECEITA] INTEGER, [CNAE_PRINCIPAL_RECEITA] INTEGER, [CNAES_SECUNDARIOS_RECEITA] BLOB)
+        WITHOUT ROWID''')
+        delta.execute('''
+        CREATE TABLE DELTA_INFO
+        ([VERSAO_ANTERIOR] TEXT, [VERSAO_NOVA] TEXT, [INSERTS] INTEGER, [UPDATES] INTEGER, [DELETES] INTEGER, [GERADO_EM] TEXT)''')
+        delta.execute('''ATTACH DATABASE ? AS vigente''', (self.path_database,))
+        delta.execute('''ATTACH DATABASE ? AS nova''', (self.path_database_novo,))
+
+        # As duas tables estão ordenadas pelo CNPJ (WITHOUT ROWID), cada comparação é uma busca pela primary key
+        delta.execute('''
+        INSERT INTO DELTA_RECEITA
+        SELECT n.CNPJ_RECEITA, CASE WHEN v.CNPJ_RECEITA IS NULL THEN 'I' ELSE 'U' END,
+        n.DV_RECEITA, n.SITUACAO_CADASTRAL_RECEITA, n.CNAE_PRINCIPAL_RECEITA, n.CNAES_SECUNDARIOS_RECEITA
+        FROM nova.DADOS_RECEITA n
+        LEFT JOIN vigente.DADOS_RECEITA v ON v.CNPJ_RECEITA = n.CNPJ_RECEITA
+        WHERE v.CNPJ_RECEITA IS NULL
+        OR v.DV_RECEITA IS NOT n.DV_RECEITA
+        OR v.SITUACAO_CADASTRAL_RECEITA IS NOT n.SITUACAO_CADASTRAL_RECEITA
+        OR v.CNAE_PRINCIPAL_RECEITA IS NOT n.CNAE_PRINCIPAL_RECEITA
+        OR v.CNAES_SECUNDARIOS_RECEITA IS NOT n.CNAES_SECUNDARIOS_RECEITA''')
+        delta.execute('''
+        INSERT INTO DELTA_RECEITA (CNPJ_RECEITA, OPERACAO)
+        SELECT v.CNPJ_RECEITA, 'D'
+        FROM vigente.DADOS_RECEITA v
+        WHERE NOT EXISTS (SELECT 1 FROM nova.DADOS_RECEITA n WHERE n.CNPJ_RECEITA = v.CNPJ_RECEITA)''')
+        delta.execute('''
+        INSERT INTO DELTA_INFO
+        SELECT ?, ?,
+        SUM(OPERACAO = 'I'), SUM(OPERACAO = 'U'), SUM(OPERACAO = 'D'), datetime('now', 'localtime')
+        FROM DELTA_RECEITA''', (versao_anterior, versao_nova))
+        delta.commit()
+        delta.execute('''DETACH DATABASE vigente''')
+        delta.execute('''DETACH DATABASE nova''')
+        delta.close()
+        return path_delta
+
+
+    def aplica_delta_receita(self, path_delta : str):
+        '''Aplica um arquivo de delta da receita no database vigente, em uma única transação
+        Só os CNPJs que mudaram são escritos, quem está consultando vê a versão antiga inteira até o commit
+
+        params
+        ------
+        path_delta : str
+            Caminho do arquivo gerado pelo gera_delta_receita()'''
+
+        self.connection.commit()
+        self.cursor.execute('''ATTACH DATABASE ? AS delta''', (path_delta,))
+        try:
+            self.cursor.execute('''BEGIN''')
+            self.cursor.execute('''
+            INSERT OR REPLACE INTO DADOS_RECEITA
+            SELECT CNPJ_RECEITA, DV_RECEITA, SITUACAO_CADASTRAL_RECEITA, CNAE_PRINCIPAL_RECEITA, CNAES_SECUNDARIOS_RECEITA
+            FROM delta.DELTA_RECEITA
+            WHERE OPERACAO IN ('I', 'U')''')
+            self.cursor.execute('''
+            DELETE FROM DADOS_RECEITA
+            WHERE CNPJ_RECEITA IN (SELECT CNPJ_RECEITA FROM delta.DELTA_RECEITA WHERE OPERACAO = 'D')''')
+            self.connection.commit()
+            inserts, updates, deletes = self.cursor.execute('''SELECT INSERTS, UPDATES, DELETES FROM delta.DELTA_INFO''').fetchone()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.cursor.execute('''DETACH DATABASE delta''')
+        print(f'Delta aplicado: {inserts} CNPJs novos, {updates} alterados, {deletes} removidos')
+
+
+    def conteudo_carregado(self, fonte : str, sha256 : str = None, linhas : str = None) -> bool:
+        '''Confere se a planilha (pelo SHA-256 do arquivo) ou as linhas lidas dela (pelo hash_linhas()) são as mesmas já carregadas da fonte
+        A ABECS republica a mesma planilha com outro nome: o link muda, mas o conteúdo não, e não precisa carregar de novo
+
+        O registro do conteúdo fica na table CONTEUDOS_ABECS do próprio database, gravado na troca da table (ver promove_tabela()):
+        database apagado ou trocado (snapshot do espelho) leva o registro junto. Versão vigente 'nula' ou table vazia sempre carregam
+
+        params
+        ------
+        fonte : str
+            'depara_abecs' ou 'lista_cnpj'
+        sha256 : str
+            SHA-256 da planilha
+        linhas : str
+            Hash das linhas lidas da planilha
+
+        returns
+        -------
+        bool
+            True se o conteúdo é o mesmo do último carregado'''
+
+        if self.current_versions[fonte][0] == 'nula':
+            return False
+        if not self.cursor.execute(f'''SELECT 1 FROM {TABELAS_ABECS[fonte]} LIMIT 1''').fetchone():
+            return False
+        registro = self.cursor.execute('''SELECT SHA256, LINHAS FROM CONTEUDOS_ABECS WHERE FONTE = ?''', (fonte,)).fetchone()
+        if not registro:
+            return False
+        return bool((sha256 and registro[0] == sha256) or (linhas and registro[1] == linhas))
+
+
+    def registra_headers(self, fonte : str, link : str, headers : dict):
+        '''Guarda no headers_abecs.json os headers da planilha vigente da fonte, para a próxima verificação, ver abecs_alterada()'''
+
+        self.headers_guardados[fonte] = {'versao' : link, 'headers' : headers}
+        with open(self.path_headers_abecs + '.tmp', mode='w') as arq:
+            json.dump(self.headers_guardados, arq, indent=4)
+        os.replace(self.path_headers_abecs + '.tmp', self.path_headers_abecs)
+
+
+    def abecs_alterada(self, fonte : str) -> bool:
+        '''A ABECS também troca o conteúdo de uma planilha sem mudar o nome, e o link igual ao vigente não dispara o update
+        Com o link igual, confere se a planilha mudou pelos headers dela (ETag, Last-Modified), ou pelo SHA-256 publicado no espelho
+        Só baixa a planilha se mudou, e o SHA-256 dela decide se precisa carregar, ver planilha_abecs()
+        A primeira verificação de um link só guarda os headers, para comparar nas próximas
+
+        params
+        ------
+        fonte : str
+            'depara_abecs' ou 'lista_cnpj'
+
+        returns
+        -------
+        bool
+            True se a planilha do link vigente precisa ser baixada de novo'''
+
+        link = self.current_versions[fonte][1]
+        if self.espelho:
+            publicado = self.espelho['arquivos'].get(fonte, dict()).get(link.split('/')[-1], dict())
+            alterada = bool(publicado.get('sha256')) and not self.conteudo_carregado(fonte, sha256=publicado['sha256'])
+        else:
+            registro = self.headers_guardados.get(fonte, dict())
+            anterior = registro.get('headers') if registro.get('versao') == link else None
+            try:
+                headers = sonda_url(link, anterior)
+            except requests.RequestException as e:
+                print(f'Não foi possível verificar a planilha {fonte} pelos headers ({e})')
+                return False
+            if anterior is None:
+                self.registra_headers(fonte, link, headers)
+                return False
+            # Servidor sem ETag nem Last-Modified: a planilha é baixada em toda verificação, mas só carregada se o SHA-256 mudar
+            alterada = not sondas_iguais({link : anterior}, {link : headers})
+            # Headers novos só são guardados depois da planilha carregada, ver conclui_abecs()
+            self.headers_abecs[fonte] = headers
+        if alterada:
+            print(f'Busca // {fonte}: planilha alterada sem mudar de nome')
+            self.abecs_alteradas.add(fonte)
+        return alterada
+
+
+    def planilha_abecs(self, fonte : str) -> tuple:
+        '''Obtém a planilha da nova versão de uma fonte da ABECS, e o SHA-256 dela
+        Com o espelho o SHA-256 vem do espelho.json, e a planilha nem é baixada se o conteúdo já foi carregado
+
+        params
+        ------
+        fonte : str
+            'depara_abecs' ou 'lista_cnpj'
+
+        returns
+        -------
+        tuple
+            (caminho do .xlsx, None se não foi baixado; SHA-256 da planilha)'''
+
+        link = self.current_versions[fonte][1]
+        nome_excel = link.split('/')[-1]
+        file = os.path.join(self.path_script, nome_excel)
+        if self.espelho:
+            sha256 = self.espelho['arquivos'][fonte][nome_excel]['sha256']
+            if self.conteudo_carregado(fonte, sha256=sha256):
+                return None, sha256
+        # Planilha trocada sem mudar de nome: arquivo que tenha sobrado na pasta é da versão anterior
+        if fonte in self.abecs_alteradas and os.path.isfile(file):
+            os.remove(file)
+        # Se o arquivo ainda não foi baixado, faz download dele
+        if not os.path.isfile(file):
+            self.obtem_abecs(fonte, link)
+        return file, hash_arquivo(file).hexdigest()
+
+
+    def conclui_abecs(self, fonte : str, file : str, sha256 : str, linhas : str):
+        '''Terminada a fonte da ABECS (carregada ou com o mesmo conteúdo da vigente), atualiza o file .config,
+        guarda o conteúdo e os headers da planilha, publica no espelho e exclui o excel
+
+        params
+        ------
+        fonte : str
+            'depara_abecs' ou 'lista_cnpj'
+        file : str
+            Caminho do .xlsx, None se não foi baixado
+        sha256 : str
+            SHA-256 da planilha
+        linhas : str
+            Hash das linhas da planilha, None se ela não foi lida'''
+
+        # Mesmo conteúdo com outro arquivo (ou só as linhas iguais): o registro passa a ser o da planilha nova
+        # Planilha carregada já teve o registro gravado na troca da table, ver promove_tabela()
+        self.cursor.execute('''INSERT OR REPLACE INTO CONTEUDOS_ABECS VALUES (?, ?, COALESCE(?, (SELECT LINHAS FROM CONTEUDOS_ABECS WHERE FONTE = ?)))''',
+                            (fonte, sha256, linhas, fonte))
+        self.connection.commit()
+        # Headers lidos no abecs_alterada() valem para a planilha concluída. Link novo tem os headers guardados na primeira verificação dele
+        if fonte in self.headers_abecs:
+            self.registra_headers(fonte, self.current_versions[fonte][1], self.headers_abecs[fonte])
+        with open('config.txt', mode='r') as read:
+            atual = read.readlines()
+            read.close()
+        atual[{'depara_abecs' : 1, 'lista_cnpj' : 2}[fonte]] = f'{fonte}={self.current_versions[fonte][1]}\n'
+        with open('config.txt', mode='w') as write:
+            write.writelines(atual)
+        self.abecs_alteradas.discard(fonte)
+        self.salva_sonda(fonte)
+        if file:
+            self.publica_espelho(fonte, [file])
+            os.remove(file)
+
+
     def update_cnpjs_abecs(self):
         '''Se a configuração permitir updates, atualiza a relação de CNPJs determinados por bandeira da ABECS
         Verifica se o arquivo .xlsx já existe, se não baixa por wget e sobe no banco de dados
+        Planilha com o mesmo conteúdo (SHA-256 do arquivo ou das linhas) da versão vigente não sobe de novo, só a versão é atualizada
         Ao fim do processo exclui o excel e atualiza o .config'''
         
-        if self.update and (self.current_versions['lista_cnpj'][0] != self.current_versions['lista_cnpj'][1]):
-            # Link é obtido pelo selenium, pelo href
-            # Nome do excel é a última parte do link
-            nome_excel = self.current_versions['lista_cnpj'][1].split('/')[-1]
-            link = self.current_versions['lista_cnpj'][1]
-            
+        if self.update and (self.current_versions['lista_cnpj'][0] != self.current_versions['lista_cnpj'][1] or 'lista_cnpj' in self.abecs_alteradas):
             print(f'''--------------------------------------------------------------------------------
 Arquivos de CNPJ Determinados da ABECS receita deve ser atualizado!
 A versão atual da base é {self.current_versions["lista_cnpj"][0]},
 Há uma nova versão: {self.current_versions["lista_cnpj"][1]}
 --------------------------------------------------------------------------------''')
             
-            # Se o arquivo ainda não foi baixado, faz download dele
-            if not os.path.isfile(os.path.join(self.path_script, nome_excel)):
-                wget.download(link)
-
-            file = os.path.join(self.path_script, nome_excel)
+            # Link é obtido pelo webscraping, pelo href. Mesmo conteúdo com outro nome não é carregado de novo
+            file, sha256 = self.planilha_abecs('lista_cnpj')
+            if self.conteudo_carregado('lista_cnpj', sha256=sha256):
+                print('Planilha com o mesmo conteúdo da versão vigente, só a versão é atualizada')
+                self.conclui_abecs('lista_cnpj', file, sha256, None)
+                return
             
-            # Cria dataframe do excel e formata dados
-            df = pd.read_excel(file, names=['CNPJ','MCC','TIPO','DATA'],usecols=[0,1,2,3], dtype={'CNPJ' : 'string', 'MCC' : 'string', 'TIPO' : 'string', 'DATA' : 'string'})
-            df.dropna(axis=0, how='any', inplace=True)
-            lista = df.values.tolist()
-
-            # Cria dicionário, para usar os CNPJs como key, e assim criar uma lista de MCCs por CNPJ nos values, evitando duplicados
-            d = dict()
-
-            # Formata o CNPJ
-            for e in lista:
-                if len(e[0]) < 14:
-                    e[0] = ((14 - len(e[0])) * '0' ) + e[0]
-            # Faz uma verificação : se o CNPJ não está no dicionário, adiciona o MCC determinado a uma lista, o status a uma string, e datas de determinação à outra lista
-                if e[0] not in d.keys():
-                    d[e[0]] = (list(), e[2], list())
-                    d[e[0]][0].append(e[1])
-                    d[e[0]][2].append(e[3])
-            # Caso este cnpj já esteja na lista, apenas complementa a lista de MCCs determinados e datas de determinação
-                else:
-                    d[e[0]][0].append(e[1])
-                    d[e[0]][2].append(e[3])
-
-            # Insere dados do dicionário na table MCCS_DETERMINADOS, dropando os dados anteriores
-            # Cnpj é a key do dicionário, e outros dados estão em uma tupla nos values deste dict, desempacota todas as infos necessária e sobe elas para o .db por meio de uma tupla
+            # Linhas do excel são lidas uma a uma, uma linha por determinação, ver le_planilha_cnpjs() e normaliza_cnpjs_abecs()
+            determinacoes = normaliza_cnpjs_abecs(le_planilha_cnpjs(file))
+            linhas = hash_linhas(determinacoes.itertuples(index=False, name=None))
+            if self.conteudo_carregado('lista_cnpj', linhas=linhas):
+                print('Planilha com as mesmas linhas da versão vigente, só a versão é atualizada')
+                self.conclui_abecs('lista_cnpj', file, sha256, linhas)
+                return
 
-            self.cursor.execute('''DROP TABLE MCCS_DETERMINADOS''')
+            # Insere na table de staging MCCS_DETERMINACOES_NOVA, a table vigente continua disponível para consultas
+            # Staging que tenha sobrado de um update interrompido é descartada
+            self.cursor.execute('''DROP TABLE IF EXISTS MCCS_DETERMINACOES_NOVA''')
             
             self.connection.commit()
         
-            self.cursor.execute( '''
-            CREATE TABLE IF NOT EXISTS MCCS_DETERMINADOS
-            ([CNPJ_BANDEIRA_ABECS] TEXT PRIMARY KEY, [MCC_BANDEIRA_ABECS] TEXT, [TIPO_ABECS] TEXT, [DATA_DETERMINACAO_ABECS] TEXT)
-            ''')
+            self.cursor.execute(DDL_MCCS_DETERMINACOES.format(tabela='MCCS_DETERMINACOES_NOVA'))
          
-            for e in d.keys():
-                cnpj = e
-                i = 1
-                if len(d[e][0]) == 1: # Se só houver um MCC principal, adiciona ele
-                    mccs_principais = "".join(d[e][0])
-                else: # Caso haja mais de um MCC principal, itera pelos dict.values destes MCCs e adiciona o MCC ao database em uma string como : '1234,5678,....'
-                    mccs_principais = str(d[e][0][0]) 
-                    while i < len(d[e][0]):
-                        mccs_principais += ',' + str(d[e][0][i])
-                        i += 1 
-                tipo = str(d[e][1])
-                i = 1
-                if len(d[e][2]) == 1: # Se só houver uma data de determinação, adiciona ela
-                    data = "".join(d[e][2])
-                else: # Caso haja mais de uma data de determinação, itera pelos dict.values, compara se as datas são iguais, e depois adiciona ao database como string no formato : 'dd/mm/aaaa 00:00 | dd/mm/aaaa 01:01'
-                   data = "".join(d[e][2][0])
-                   while i < len(d[e][2]):
-                        if data == str(d[e][2][i]): # compara se data da determinação 1 == data da determinação 2
-                            i += 1
-                        else:
-                            data += ' | ' + str(d[e][2][i])
-                            i += 1 
-    
-                dados = (cnpj, mccs_principais, tipo, data)
-
-                self.cursor.execute('''INSERT OR REPLACE INTO MCCS_DETERMINADOS VALUES (?,?,?,?)''', dados)
+            # Todas as determinações inseridas de uma vez, os índices são criados depois, na troca
+            self.cursor.executemany('''INSERT INTO MCCS_DETERMINACOES_NOVA VALUES (?,?,?,?,?)''',
+                                    determinacoes.itertuples(index=False, name=None))
 
             self.connection.commit()
 
-            # Verifica se funcionou o update
-            z = self.cursor.execute('''SELECT COUNT(*) FROM MCCS_DETERMINADOS''').fetchone()  
-            if z:
+            # Verifica se funcionou o update, se sim troca a table vigente pela nova
+            z = self.cursor.execute('''SELECT COUNT(*) FROM MCCS_DETERMINACOES_NOVA''').fetchone()  
+            if z[0] > 0:
+                self.promove_tabela('MCCS_DETERMINACOES_NOVA', 'MCCS_DETERMINACOES', INDICES_MCCS_DETERMINACOES, ('lista_cnpj', sha256, linhas))
                 print(f'''
 Quantidade de MCCs determinados atualizados: {z}''')
             else:
                 print('''Verificar código: Não foi possível fazer update dos CNPJs determidos
 Avise o responsável pela automação''')
+                return
 
-            # Terminado a inserção, exclui o excel e atualiza o file .config
-            os.remove(file)
-            with open('config.txt', mode='r') as read:
-                atual = read.readlines()
-                novo_link_update = f'lista_cnpj={self.current_versions["lista_cnpj"][1]}\n'
-                atual[2] = novo_link_update
-                read.close()
-                with open('config.txt', mode='w') as write:
-                    write.writelines(atual)
+            # Terminado a inserção, atualiza o file .config, publica no espelho e exclui o excel
+            self.conclui_abecs('lista_cnpj', file, sha256, linhas)
             print('''CNPJs Determinados atualizados!
 --------------------------------------------------------------------------------''')
 
@@ -412,97 +2792,106 @@ Avise o responsável pela automação''')
     def update_depara_abecs(self):
         '''Se a configuração permitir updates, atualiza a relação de:para da ABECS
         Verifica se o arquivo .xlsx já existe, se não baixa por wget e sobe no banco de dados
+        Planilha com o mesmo conteúdo (SHA-256 do arquivo ou das linhas) da versão vigente não sobe de novo, só a versão é atualizada
         Ao fim do processo exclui o excel e atualiza o .config'''
 
-        if self.update and (self.current_versions['depara_abecs'][0] != self.current_versions['depara_abecs'][1]):
-            # Link é obtido pelo selenium, pelo href
-            # Nome do excel é a última parte do link
-            nome_excel = self.current_versions['depara_abecs'][1].split('/')[-1]
-            link = self.current_versions['depara_abecs'][1]
-            
+        if self.update and (self.current_versions['depara_abecs'][0] != self.current_versions['depara_abecs'][1] or 'depara_abecs' in self.abecs_alteradas):
             print(f'''--------------------------------------------------------------------------------
 Arquivos de DE:PARA CNAE da ABECS receita deve ser atualizado!
 A versão atual da base é {self.current_versions["depara_abecs"][0]},
 Há uma nova versão: {self.current_versions["depara_abecs"][1]}
 --------------------------------------------------------------------------------''')
             
-            # Se o arquivo ainda não foi baixado, faz download dele
-            if not os.path.isfile(os.path.join(self.path_script, nome_excel)):
-                wget.download(link)
-
-            file = os.path.join(self.path_script, nome_excel)
+            # Link é obtido pelo webscraping, pelo href. Mesmo conteúdo com outro nome não é carregado de novo
+            file, sha256 = self.planilha_abecs('depara_abecs')
+            if self.conteudo_carregado('depara_abecs', sha256=sha256):
+                print('Planilha com o mesmo conteúdo da versão vigente, só a versão é atualizada')
+                self.conclui_abecs('depara_abecs', file, sha256, None)
+                return
 
-            # Cria o dataframe do excel de de_para da ABECS
-            # É possível o CNAE ter até 7 MCCs alternativos // se tiver mais no futuro, alterar o código
-            df = pd.read_excel(file, header=1, usecols=[3,5,7,9,11,13,15,17,19],\
-                               names=['CNAE','MCCP','MCC1','MCC2','MCC3','MCC4','MCC5','MCC6','MCC7'])
-            df = df.fillna(0)
-            lista = df.values.tolist()
-            
-            # Itera pela lista, e insere os dados em uma table do database, dropando os valores anteriores
+            # Um par CNAE/MCC por linha, com quantos MCCs alternativos a planilha tiver, ver le_planilha_depara()
+            pares, erros = le_planilha_depara(file)
+            if erros:
+                print(f'Linhas do de:para com CNAE inválido que não foram inseridas: {erros}')
+            linhas = hash_linhas(pares)
+            if self.conteudo_carregado('depara_abecs', linhas=linhas):
+                print('Planilha com as mesmas linhas da versão vigente, só a versão é atualizada')
+                self.conclui_abecs('depara_abecs', file, sha256, linhas)
+                return
 
-            self.cursor.execute('''DROP TABLE DEPARA''')
+            # Insere na table de staging DEPARA_MCCS_NOVA, a table vigente continua disponível para consultas
+            # Staging que tenha sobrado de um update interrompido é descartada
+            self.cursor.execute('''DROP TABLE IF EXISTS DEPARA_MCCS_NOVA''')
             
             self.connection.commit()
 
-            self.cursor.execute( '''
-            CREATE TABLE IF NOT EXISTS DEPARA
-            ([CNAE_PRINCIPAL_ABECS] TEXT PRIMARY KEY, [MCC_PRINCIPAL_ABECS] TEXT, [MCCS_SECUNDARIOS_ABECS] TEXT)
-            ''')
+            self.cursor.execute(DDL_DEPARA_MCCS.format(tabela='DEPARA_MCCS_NOVA'))
 
-            for e in lista:
-                # Separa o CNAE e MCC Primário
-                cnae = e[0].replace("/","").replace("-","") # Tira os '-' '/' do cnae
-                mcc = e[1]
-                mccs_alternativos = str()
-                i = 2 # Item e[2] da lista são os MCCs alternativos, que serão iterados abaixo
-                # Varre os MCCs Alternativos e adiciona eles na string casos exista algum
-                for x in range(7):
-                    if e[i] != 0: # Se houver mcc_alternativo
-                        if len(mccs_alternativos) == 0:
-                            mccs_alternativos = mccs_alternativos + f'{str(e[i]).replace(".0","")}' # Caso seja o primero MCC alternativo, adiciona na string
-                        else:
-                            mccs_alternativos = mccs_alternativos + ',' f'{str(e[i]).replace(".0","")}' # Se já houver um MCC alternativo, adiciona uma vírgula e o MCC na string
-                self.cursor.execute('''INSERT OR REPLACE INTO DEPARA VALUES (?,?,?)''', (cnae,mcc,mccs_alternativos))
-                i += 1
+            # MCC repetido no mesmo CNAE fica só na primeira posição (o principal, se for ele)
+            self.cursor.executemany('''INSERT OR IGNORE INTO DEPARA_MCCS_NOVA VALUES (?,?,?,?)''', pares)
                 
             self.connection.commit()
 
-            # Verifica se funcionou o update
-            z = self.cursor.execute('''SELECT COUNT(*) FROM DEPARA''').fetchone()  
-            if z:
+            # Verifica se funcionou o update, se sim troca a table vigente pela nova
+            z = self.cursor.execute('''SELECT COUNT(DISTINCT CNAE_DEPARA_ABECS) FROM DEPARA_MCCS_NOVA''').fetchone()  
+            if z[0] > 0:
+                self.promove_tabela('DEPARA_MCCS_NOVA', 'DEPARA_MCCS', INDICES_DEPARA_MCCS, ('depara_abecs', sha256, linhas))
                 print(f'''
 Quantidade de CNAEs atualizados: {z}''')
             else:
                 print('''Verificar código: Não foi possível fazer update do DE:PARA ABECS
 Avise o responsável pela automação''')
+                return
 
-            # Terminado a inserção, exclui o excel e atualiza o file .config
-            os.remove(file)
-            
-            with open('config.txt', mode='r') as read:
-                atual = read.readlines()
-                novo_link_update = f'depara_abecs={self.current_versions["depara_abecs"][1]}\n'
-                atual[1] = novo_link_update
-                read.close()
-                with open('config.txt', mode='w') as write:
-                    write.writelines(atual)
+            # Terminado a inserção, atualiza o file .config, publica no espelho e exclui o excel
+            self.conclui_abecs('depara_abecs', file, sha256, linhas)
             print('De para atualizado!')        
 
+class Consultas():
+    '''Conexão de consulta ao database vigente, usada pela GUI enquanto o Agendador atualiza os dados em outra thread
+    Durante a troca do arquivo do database o Agendador fecha a conexão (ver pausa()), e a próxima consulta reabre no database novo'''
+    def __init__(self, path_database : str):
+        self.path_database = path_database
+        self.trava = threading.RLock()
+        self.connection = None
+
+    def executa(self, sql : str, parametros : tuple = ()) -> list:
+        '''Roda uma query no database vigente e retorna todas as linhas do resultado'''
+
+        with self.trava:
+            if self.connection is None:
+                # A conexão é aberta na thread da GUI e fechada pelo Agendador, sempre com a trava
+                # timeout maior: o database fica bloqueado enquanto um update grava nele
+                self.connection = sqlite3.Connection(self.path_database, timeout=60, check_same_thread=False)
+                registra_funcoes(self.connection)
+            return self.connection.execute(sql, parametros).fetchall()
+
+    @contextmanager
+    def pausa(self):
+        '''Fecha a conexão e segura as consultas enquanto o arquivo do database é trocado'''
+
+        with self.trava:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            yield
+
+
 class GUI():
     '''Interface gráfica do buscador de CNPJs'''
 
-    def __init__(self):
+    def __init__(self, consultas : Consultas = None, agendador = None):
         # Cabeçalho da tabela de resultados da GUI
         self.table_headers = ['CNPJ','STATUS CNPJ','MCC BANDEIRAS','MCC CNAE PRIMÁRIO','CNAE PRIMÁRIO', 'CNAE SECUNDÁRIO']
         # Lista de resultados da GUI, é iniciada assim para a interface ficar com a largura certa
         self.lista_resultados = [['              ','      ','    ','    ','       ','         ']]
         # Layout principal da GUI
         self.layout_main_gui = [
-[sg.Text('Digite um CNPJ ou Raíz de CNPJ para a busca:', key = '-MENSAGEM-')],
+[sg.Text('Digite um CNPJ, Raíz de CNPJ ou MCC para a busca:', key = '-MENSAGEM-')],
 [sg.Input('', key = '-INPUT_CNPJ-')],
 [sg.Text('', key='-STATUS-')],
-[sg.Button('CNPJ', key = '-BUTTON_CNPJ-'), sg.Button('Raíz', key = '-BUTTON_RAIZ-')],
+[sg.Text('', key='-UPDATE-')],
+[sg.Button('CNPJ', key = '-BUTTON_CNPJ-'), sg.Button('Raíz', key = '-BUTTON_RAIZ-'), sg.Button('MCC', key = '-BUTTON_MCC-')],
 [sg.Table(self.lista_resultados, self.table_headers, justification = 'center', key='-TABELA_RESULTADOS-')],
 [sg.Button('LOTE CNPJ', key='-IMPORTAR_LOTE-'), sg.Button('EXPORTAR', key='-EXPORTAR_LOTE-'), sg.Button('LIMPAR TABELA', key='-LIMPAR-')]]
         # Janela
@@ -510,15 +2899,20 @@ class GUI():
         # Status e avisos da GUI
         self.status = ''
         self.path_script = os.path.abspath(os.path.dirname(__file__))
-        self.connection = sqlite3.Connection(os.path.join(self.path_script,'database.db'))
-        self.cursor = self.connection.cursor()
+        # Consultas sempre no database vigente, mesmo depois de um update trocar o arquivo
+        self.consultas = consultas or Consultas(os.path.join(self.path_script,'database.db'))
+        # Update em segundo plano, a situação dele aparece na janela
+        self.agendador = agendador
         self.lista_cnpjs = []
                
     def main_loop(self):
         '''Loop da janela do PySimpleGUI'''
         
         while True:
-            event, values = self.window.read()
+            # Com o update rodando em segundo plano, a janela acorda a cada segundo para mostrar a situação dele
+            event, values = self.window.read(timeout = 1000 if self.agendador else None)
+            if self.agendador:
+                self.window['-UPDATE-'].update(self.agendador.mensagem())
             self.window.refresh()
             if event == sg.WIN_CLOSED or event == 'Exit':
                 break
@@ -530,6 +2924,10 @@ class GUI():
                 self.formata_lista_padrao()
                 self.query_raiz(values['-INPUT_CNPJ-'])
                 self.force_update()
+            if event == '-BUTTON_MCC-':
+                self.formata_lista_padrao()
+                self.query_mcc(values['-INPUT_CNPJ-'])
+                self.force_update()
             if event == '-IMPORTAR_LOTE-':
                 self.formata_lista_padrao()
                 self.importar_dados_excel()
@@ -650,39 +3048,11 @@ class GUI():
         
         cnpj = self.valida_cnpj(cnpj)
         if cnpj:
-            x = self.cursor.execute(f"""
-SELECT CNPJ_RECEITA,
-
-CASE
-    WHEN SITUACAO_CADASTRAL_RECEITA = '01' THEN 'NULO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '02' THEN 'ATIVO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '03' THEN 'SUSPENSO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '04' THEN 'INAPTO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '08' THEN 'BAIXADO'
-    ELSE 'SITUAÇÃO NÃO ENCONTRADA'
-END AS SITUACAO_NOMINAL,
-
-CASE
-    WHEN MCC_BANDEIRA_ABECS NOT NULL THEN MCC_BANDEIRA_ABECS
-    ELSE ''
-END AS MCC_BANDEIRA,
-
-MCC_PRINCIPAL_ABECS,
-CNAE_PRINCIPAL_RECEITA,
-CNAES_SECUNDARIOS_RECEITA
-
-FROM DADOS_RECEITA 
-
-LEFT JOIN MCCS_DETERMINADOS
-ON DADOS_RECEITA.CNPJ_RECEITA = MCCS_DETERMINADOS.CNPJ_BANDEIRA_ABECS
-
-LEFT JOIN DEPARA
-ON DADOS_RECEITA.CNAE_PRINCIPAL_RECEITA = DEPARA.CNAE_PRINCIPAL_ABECS
-
-WHERE CNPJ_RECEITA = '{cnpj}'""").fetchone()
+            x = self.consultas.executa(QUERY_CONSULTA + """
+WHERE DADOS_RECEITA.CNPJ_RECEITA = ? AND DADOS_RECEITA.DV_RECEITA = ?""", (chave_cnpj(cnpj), int(cnpj[12:])))
 
             if x:
-                self.lista_resultados.append(x)
+                self.lista_resultados.append(x[0])
             else:
                 self.lista_resultados.append([cnpj,'CNPJ não encontrado','','','',''])
         
@@ -713,46 +3083,45 @@ WHERE CNPJ_RECEITA = '{cnpj}'""").fetchone()
                 raiz = ((len(raiz) - 8) * '0') + raiz
             
         
-            x = self.cursor.execute(f"""
-SELECT CNPJ_RECEITA,
-
-CASE
-    WHEN SITUACAO_CADASTRAL_RECEITA = '01' THEN 'NULO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '02' THEN 'ATIVO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '03' THEN 'SUSPENSO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '04' THEN 'INAPTO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '08' THEN 'BAIXADO'
-    ELSE 'SITUAÇÃO NÃO ENCONTRADA'
-END AS SITUACAO_NOMINAL,
+            x = self.consultas.executa(QUERY_CONSULTA + """
+WHERE DADOS_RECEITA.CNPJ_RECEITA BETWEEN ? AND ?
 
-CASE
-    WHEN MCC_BANDEIRA_ABECS NOT NULL THEN MCC_BANDEIRA_ABECS
-    ELSE ''
-END AS MCC_BANDEIRA,
-
-MCC_PRINCIPAL_ABECS,
-CNAE_PRINCIPAL_RECEITA,
-CNAES_SECUNDARIOS_RECEITA
-
-FROM DADOS_RECEITA 
+ORDER BY SITUACAO_NOMINAL""", faixa_raiz(raiz))
 
-LEFT JOIN MCCS_DETERMINADOS
-ON DADOS_RECEITA.CNPJ_RECEITA = MCCS_DETERMINADOS.CNPJ_BANDEIRA_ABECS
+            if x:
+                for z in x:
+                    self.lista_resultados.append(z)
+            else:
+                self.lista_resultados.append([raiz,'Raíz não encontrada','','','',''])
 
-LEFT JOIN DEPARA
-ON DADOS_RECEITA.CNAE_PRINCIPAL_RECEITA = DEPARA.CNAE_PRINCIPAL_ABECS
+            self.status = f'Raíz {raiz[:3]+ "." + raiz[3:6] + "." + raiz[6:8]} buscada'
+        self.force_update()
 
-WHERE CNPJ_RECEITA LIKE '{raiz}%'
 
-ORDER BY SITUACAO_NOMINAL""").fetchall()
+    def query_mcc(self, mcc : str):
+        '''Busca os CNPJs cujo CNAE principal tem o MCC (principal ou alternativo) no de:para da ABECS
+        MCC -> CNAEs -> CNPJs pelos índices, ver QUERY_CONSULTA_MCC
+        
+        params
+        ------
+        mcc : str
+            MCC a ser buscado'''
+        
+        # Retira itens que não são numéricos do MCC, o de:para guarda o MCC sem zeros à esquerda
+        mcc = ''.join(e for e in mcc if e.isdigit())
+        if mcc:
+            mcc = str(int(mcc))
+            x = self.consultas.executa(QUERY_CONSULTA_MCC, (mcc, LIMITE_CONSULTA_MCC))
 
             if x:
                 for z in x:
                     self.lista_resultados.append(z)
             else:
-                self.lista_resultados.append([raiz,'Raíz não encontrada','','','',''])
+                self.lista_resultados.append(['','MCC sem CNPJs no de:para',mcc,'','',''])
 
-            self.status = f'Raíz {raiz[:3]+ "." + raiz[3:6] + "." + raiz[6:8]} buscada'
+            self.status = f'MCC {mcc} buscado'
+            if len(x) == LIMITE_CONSULTA_MCC:
+                self.status += f', mostrando os primeiros {LIMITE_CONSULTA_MCC} CNPJs'
         self.force_update()
 
 
@@ -772,39 +3141,11 @@ ORDER BY SITUACAO_NOMINAL""").fetchall()
         for cnpj in lista:
             cnpj = self.valida_cnpj(cnpj)
             if cnpj:
-                x = self.cursor.execute(f"""
-SELECT CNPJ_RECEITA,
-
-CASE
-    WHEN SITUACAO_CADASTRAL_RECEITA = '01' THEN 'NULO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '02' THEN 'ATIVO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '03' THEN 'SUSPENSO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '04' THEN 'INAPTO'
-    WHEN SITUACAO_CADASTRAL_RECEITA = '08' THEN 'BAIXADO'
-    ELSE 'SITUAÇÃO NÃO ENCONTRADA'
-END AS SITUACAO_NOMINAL,
-
-CASE
-    WHEN MCC_BANDEIRA_ABECS NOT NULL THEN MCC_BANDEIRA_ABECS
-    ELSE ''
-END AS MCC_BANDEIRA,
-
-MCC_PRINCIPAL_ABECS,
-CNAE_PRINCIPAL_RECEITA,
-CNAES_SECUNDARIOS_RECEITA
-
-FROM DADOS_RECEITA 
-
-LEFT JOIN MCCS_DETERMINADOS
-ON DADOS_RECEITA.CNPJ_RECEITA = MCCS_DETERMINADOS.CNPJ_BANDEIRA_ABECS
-
-LEFT JOIN DEPARA
-ON DADOS_RECEITA.CNAE_PRINCIPAL_RECEITA = DEPARA.CNAE_PRINCIPAL_ABECS
-
-WHERE CNPJ_RECEITA = '{cnpj}'""").fetchone()
+                x = self.consultas.executa(QUERY_CONSULTA + """
+WHERE DADOS_RECEITA.CNPJ_RECEITA = ? AND DADOS_RECEITA.DV_RECEITA = ?""", (chave_cnpj(cnpj), int(cnpj[12:])))
 
                 if x:
-                    self.lista_resultados.append(x)
+                    self.lista_resultados.append(x[0])
                 else:
                     self.lista_resultados.append([cnpj,'CNPJ não encontrado','','','',''])
 
@@ -861,15 +3202,24 @@ class Browser():
     def __init__(self):
         self.options = webdriver.ChromeOptions()
         self.service = webdriver.ChromeService()
+        self.url_receita = URL_PAGINA_RECEITA
+        self.url_abecs = URL_ABECS
         self.aberto = False
         self.driver_atualizado = False
+        # Páginas já buscadas: {página : (momento da busca, resultado)}, ver memoriza()
+        self.cache = dict()
+        self.ttl = TTL_DESCOBERTA
+        # O webdriver só carrega uma página por vez
+        self.trava = threading.Lock()
 
              
     def add_options(self):
         '''Adiciona os argumentos de opções do browser'''
         
         # Browser headless, não vísivel
-        self.options.add_argument('--headless')
+        # O Agendador abre o navegador a cada ciclo com as mesmas opções
+        if '--headless' not in self.options.arguments:
+            self.options.add_argument('--headless')
 
 
     def versao_driver(self) -> list:
@@ -905,9 +3255,10 @@ class Browser():
         '''Tenta abrir o navegador, se consegue, altera self.aberto para True
         Se o webdriver não conseguir ser aberto, dá print na causa e mantém self.aberto como False'''
         
+        self.aberto = False
         try:
-            browser.add_options()
-            versao = browser.versao_driver()
+            self.add_options()
+            versao = self.versao_driver()
             print(f'''Versão do Navegador Chrome = {versao[0]}
 Versão do ChromeDriver = {versao[1]}
 --------------------------------------------------------------------------------''')
@@ -928,7 +3279,43 @@ Versão do ChromeDriver = {versao[1]}
             time.sleep(2)
             
 
+    def memoriza(self, pagina : str, busca):
+        '''Busca uma página uma vez só: enquanto o resultado tiver menos de self.ttl segundos, ele vem da memória
+        Buscas de várias threads esperam na trava, o navegador carrega uma página por vez
+
+        params
+        ------
+        pagina : str
+            Nome da página no cache
+        busca : function
+            Função que carrega e lê a página
+
+        returns
+        -------
+        Resultado da busca'''
+
+        with self.trava:
+            if pagina in self.cache and time.monotonic() - self.cache[pagina][0] < self.ttl:
+                return self.cache[pagina][1]
+            resultado = busca()
+            self.cache[pagina] = (time.monotonic(), resultado)
+            return resultado
+
+
     def check_receita(self) -> str:
+        '''Data da última atualização da base da receita federal, ver busca_receita()'''
+
+        return self.memoriza('receita', self.busca_receita)
+
+
+    def check_abecs(self) -> list:
+        '''Links do de:para e da lista de CNPJs da ABECS, ver busca_abecs()
+        A página é carregada uma vez e serve as duas planilhas'''
+
+        return self.memoriza('abecs', self.busca_abecs)
+
+
+    def busca_receita(self) -> str:
         '''Verifica pelo selenium headless qual a data da última atualização da base da receita federal
         Procura no XPATH da descrição da base de dados a data
         Verifica por data no formato : 'dd/mm/aaaa'
@@ -938,49 +3325,14 @@ Versão do ChromeDriver = {versao[1]}
         data : str
             Data da última atualização dos dados públicos de CNPJ'''
         
-        self.navegador.get('https://dados.gov.br/dados/conjuntos-dados/cadastro-nacional-da-pessoa-juridica---cnpj')
+        self.navegador.get(self.url_receita)
         self.navegador.implicitly_wait(10)
         # Caso o XPATH quebre o scraping, alterar ele na variável abaixo!
-        # Armazena texto do site na variável texto
         texto = self.navegador.find_element(By.XPATH, '/html/body/div/section/div/div[3]/div[1]/div/div[2]/span').text
-        # Lista de datas encontradas no texto
-        data = list()
-        
-        # Quebra o texto em caracteres individuais
-        lista = list(texto)
-        i = 0
-        numeros = {'0','1','2','3','4','5','6','7','8','9'}
-        # Itera por cada caractere do texto procurando por um valor numérico
-        while i < len(lista):
-            if lista[i] in numeros:
-                try:
-                    # Check se os próximos caracteres são números e backslashes, para entender se o texto configura uma data
-                    # [i] n/nn/nnnn => proximas posições a serem iteradas (1,3,4,6,7,8,9) devem ser números  |  posições (2,5) devem ser slashes
-                    next_num = (lista[i+1], lista[i+3], lista[i+4], lista[i+6], lista[i+7], lista[i+8], lista[i+9])
-                    next_num_bool = True
-                    next_slash = (lista[i+2], lista[i+5])
-                    next_slash_bool = True
-                    for _ in next_num:
-                        if _ not in numeros:
-                            next_num_bool = False
-                    for _ in next_slash:
-                        if _ != '/':
-                            next_slash_bool = False
-                    # Se os próximos caracteres configuram uma data, adiciona o resultado à lista
-                    if next_num_bool and next_slash_bool:
-                        z = 1
-                        res = lista[i]
-                        for e in range(9):
-                            res += str(lista[i+z])
-                            z += 1
-                        data.append(res)
-                except IndexError:
-                    pass #pass ou i+=1?
-            i += 1
-        return data[-1] # Retorna a última data encontrada no texto, configuração atual do site está disposta assim (outubro_2023)
+        return ultima_data(texto)
         
 
-    def check_abecs(self) -> list:
+    def busca_abecs(self) -> list:
         '''Verifica pelo selenium headless qual a data da última atualização do de:para da ABECS e lista de CNPJs
 
         returns
@@ -988,7 +3340,7 @@ Versão do ChromeDriver = {versao[1]}
         file : list
             Nomes dos últimos files do de_para e lista de cnpjs determinados disponibilizado pela ABECS'''
     
-        self.navegador.get('https://www.abecs.org.br/consulta-mcc-individual')
+        self.navegador.get(self.url_abecs)
         self.navegador.implicitly_wait(10)
         # Erros de XPATH devem ser corrigidos nas duas variáveis abaixo!
         depara = self.navegador.find_element(By.XPATH, '/html/body/div/main/section/div/div/div[1]/div[2]/a').get_attribute('href')
@@ -997,6 +3349,91 @@ Versão do ChromeDriver = {versao[1]}
         return [depara, cnpj]
 
 
+    def fecha(self):
+        self.navegador.quit()
+
+
+class Web():
+    '''Busca das versões por requests, sem abrir o Chrome: motor padrão do webscraping
+    Mesma interface do Browser (check_receita, check_abecs e fecha), o web_scrape() usa qualquer um dos dois
+    Com 'motor_descoberta=selenium' no config.txt o Browser é usado direto, e ele também é o reserva se esta busca falhar'''
+    def __init__(self):
+        self.url_api = URL_API_RECEITA
+        self.url_abecs = URL_ABECS
+        self.sessao = requests.Session()
+        # Páginas já buscadas: {página : (momento da busca, resultado)}, ver memoriza()
+        self.cache = dict()
+        self.ttl = TTL_DESCOBERTA
+        # Uma trava por página: receita e ABECS são buscadas ao mesmo tempo, cada uma uma vez só
+        self.travas = {'receita' : threading.Lock(), 'abecs' : threading.Lock()}
+
+
+    def memoriza(self, pagina : str, busca):
+        '''Mesmo que o Browser.memoriza(), mas páginas diferentes não esperam uma pela outra'''
+
+        with self.travas[pagina]:
+            if pagina in self.cache and time.monotonic() - self.cache[pagina][0] < self.ttl:
+                return self.cache[pagina][1]
+            resultado = busca()
+            self.cache[pagina] = (time.monotonic(), resultado)
+            return resultado
+
+
+    def check_receita(self) -> str:
+        '''Data da última atualização da base da receita federal, ver busca_receita()'''
+
+        return self.memoriza('receita', self.busca_receita)
+
+
+    def check_abecs(self) -> list:
+        '''Links do de:para e da lista de CNPJs da ABECS, ver busca_abecs()'''
+
+        return self.memoriza('abecs', self.busca_abecs)
+
+
+    def busca_receita(self) -> str:
+        '''Lê a descrição do conjunto de dados de CNPJ pela API do dados.gov.br, a mesma que a página mostra
+
+        returns
+        -------
+        data : str
+            Data da última atualização dos dados públicos de CNPJ'''
+
+        r = self.sessao.get(self.url_api, timeout=TIMEOUT_DOWNLOAD)
+        r.raise_for_status()
+        # Caso a API mude, alterar o campo abaixo!
+        return ultima_data(r.json()['notes'])
+
+
+    def busca_abecs(self) -> list:
+        '''Procura na página da ABECS os links das planilhas (.xlsx)
+
+        returns
+        -------
+        list
+            Links do de:para [0] e da lista de CNPJs determinados [1]'''
+
+        r = self.sessao.get(self.url_abecs, timeout=TIMEOUT_DOWNLOAD)
+        r.raise_for_status()
+
+        # Erros de scraping devem ser corrigidos aqui!
+        # Nome da planilha de CNPJs muda a cada versão, só a do de:para tem nome fixo ('de-para')
+        depara = ''
+        cnpj = ''
+        for link in descreve_versao(r.text, r.url, PADRAO_PLANILHA)['arquivos']:
+            if 'de-para' in link.lower():
+                depara = depara or link
+            else:
+                cnpj = cnpj or link
+        if not depara or not cnpj:
+            raise ValueError('Links das planilhas não encontrados na página da ABECS')
+        return [depara, cnpj]
+
+
+    def fecha(self):
+        self.sessao.close()
+
+
 def start_update(dados):
     '''Função que encapsula o inicío da operação de atualização de dados,
     verifica se estão habilitados os updates no .config'''
@@ -1005,10 +3442,11 @@ def start_update(dados):
     dados.read_version()
 
 
-def web_scrape(browser, dados) -> tuple:
+def web_scrape(browser, dados, inalterados : list = ()) -> tuple:
     '''Para cada item a ser buscado na web, faz um try/except.
     Cria duas listas, uma de valroes que sofreram updates.
-    Outra lista é de erros'''
+    Outra lista é de erros
+    Fontes em inalterados já foram verificadas pelo dados.verifica_sondas() e não são buscadas de novo'''
 
     print('''Buscando atualizações das bases de dados!
 --------------------------------------------------------------------------------''')
@@ -1016,17 +3454,17 @@ def web_scrape(browser, dados) -> tuple:
     res_scraping = list()
     erros_scraping = list()
 
-    '''Se o webdriver abriu, tenta fazer webscraping dos dados da receita e ABECS
+    '''Tenta fazer webscraping dos dados da receita e ABECS, pelo requests (Web) ou pelo webdriver aberto (Browser)
     Se conseguir, adiciona o item à lista de respostas
     Se não conseguir, adiciona a lista de erros
     
-    Se houver alguma erros de XPATH, corrigir nas funções:
-    check_receita() e check_abecs()
+    Se houver alguma erros de XPATH ou de scraping, corrigir nas funções:
+    busca_receita() e busca_abecs() do Browser ou do Web
     
     params
     ------
     browser
-        instância do selenium
+        instância do Web (requests) ou do Browser (selenium)
     dados : class
         Classe Dados
         
@@ -1036,50 +3474,66 @@ def web_scrape(browser, dados) -> tuple:
         tupla de versões lidas no scraping e possíveis erros no scraping
     '''
     
+    # Fontes que não mudaram, ver dados.verifica_sondas()
+    res_scraping.extend(inalterados)
+
+    # Receita e ABECS buscadas ao mesmo tempo, cada página uma vez só (ver browser.memoriza())
+    # Erros de cada busca aparecem no .result(), dentro do try da fonte
+    buscas = dict()
+    executor = ThreadPoolExecutor(2)
+    if 'receita' not in inalterados:
+        buscas['receita'] = executor.submit(browser.check_receita)
+    if 'depara_abecs' not in inalterados or 'lista_cnpj' not in inalterados:
+        buscas['abecs'] = executor.submit(browser.check_abecs)
+    executor.shutdown(wait=False)
+
     # Receita
-    try:
-        dados.current_versions['receita'].append(browser.check_receita())
-        res_scraping.append('receita')
-        print(f'Busca // Dados da Receita: {dados.current_versions["receita"][1]}')
-    except NoSuchElementException: # Erros de elemento XPATH
-        print('Não foi possível encontrar o XPATH da (receita) : Corrigir no script - Avise o responsável pela automação')
-        erros_scraping.append('receita')
-    except WebDriverException: # Erros de conexão à internet
-        print('Não foi possível conectar ao site da Receita: Verifique sua internet')
-        erros_scraping.append('receita')
-    except Exception as e: # Outros erros não mapeados
-        print(e)
-        erros_scraping.append('receita')
+    if 'receita' not in inalterados:
+        try:
+            dados.current_versions['receita'].append(buscas['receita'].result())
+            res_scraping.append('receita')
+            print(f'Busca // Dados da Receita: {dados.current_versions["receita"][1]}')
+        except NoSuchElementException: # Erros de elemento XPATH
+            print('Não foi possível encontrar o XPATH da (receita) : Corrigir no script - Avise o responsável pela automação')
+            erros_scraping.append('receita')
+        except (WebDriverException, requests.RequestException): # Erros de conexão à internet
+            print('Não foi possível conectar ao site da Receita: Verifique sua internet')
+            erros_scraping.append('receita')
+        except Exception as e: # Outros erros não mapeados
+            print(e)
+            erros_scraping.append('receita')
     
     # De Para
-    try:
-        dados.current_versions['depara_abecs'].append(browser.check_abecs()[0])
-        res_scraping.append('depara_abecs')
-        print(f'Busca // De para ABECS: {dados.current_versions["depara_abecs"][1].split("/")[-1]}')
-    except NoSuchElementException:
-        print('Não foi possível encontrar o XPATH do (de_para) : Corrigir no script - Avise o responsável pela automação')
-        erros_scraping.append('depara_abecs')        
-    except WebDriverException:
-        print('Não foi possível conectar ao site da ABECS (de_para): Verifique sua internet')
-        erros_scraping.append('depara_abecs')
-    except Exception as e:
-        print(e)
-        erros_scraping.append('depara_abecs')
+    if 'depara_abecs' not in inalterados:
+        try:
+            dados.current_versions['depara_abecs'].append(buscas['abecs'].result()[0])
+            res_scraping.append('depara_abecs')
+            print(f'Busca // De para ABECS: {dados.current_versions["depara_abecs"][1].split("/")[-1]}')
+        except NoSuchElementException:
+            print('Não foi possível encontrar o XPATH do (de_para) : Corrigir no script - Avise o responsável pela automação')
+            erros_scraping.append('depara_abecs')        
+        except (WebDriverException, requests.RequestException):
+            print('Não foi possível conectar ao site da ABECS (de_para): Verifique sua internet')
+            erros_scraping.append('depara_abecs')
+        except Exception as e:
+            print(e)
+            erros_scraping.append('depara_abecs')
     
     # CNPJs Determinados
-    try:
-        dados.current_versions['lista_cnpj'].append(browser.check_abecs()[1])
-        res_scraping.append('lista_cnpj')
-        print(f'Busca // Lista CNPJs ABECS: {dados.current_versions["lista_cnpj"][1].split("/")[-1]}')
-    except NoSuchElementException:
-        print('Não foi possível encontrar o XPATH da (lista_cnpj) : Corrigir no script - Avise o responsável pela automação')
-        erros_scraping.append('lista_cnpj')
-    except WebDriverException:
-        print('Não foi possível conectar ao site da ABECS (lista_cnpj): Verifique sua internet')
-        erros_scraping.append('lista_cnpj')
-    except Exception as e:
-        print(e)
-        erros_scraping.append('lista_cnpj')
+    if 'lista_cnpj' not in inalterados:
+        try:
+            dados.current_versions['lista_cnpj'].append(buscas['abecs'].result()[1])
+            res_scraping.append('lista_cnpj')
+            print(f'Busca // Lista CNPJs ABECS: {dados.current_versions["lista_cnpj"][1].split("/")[-1]}')
+        except NoSuchElementException:
+            print('Não foi possível encontrar o XPATH da (lista_cnpj) : Corrigir no script - Avise o responsável pela automação')
+            erros_scraping.append('lista_cnpj')
+        except (WebDriverException, requests.RequestException):
+            print('Não foi possível conectar ao site da ABECS (lista_cnpj): Verifique sua internet')
+            erros_scraping.append('lista_cnpj')
+        except Exception as e:
+            print(e)
+            erros_scraping.append('lista_cnpj')
     
     # Avisa se houver erro no webscraping
     if erros_scraping:
@@ -1088,7 +3542,7 @@ def web_scrape(browser, dados) -> tuple:
         time.sleep(2)
     
     # Fecha o navegador
-    browser.navegador.quit()
+    browser.fecha()
 
     return (res_scraping, erros_scraping)    
         
@@ -1113,15 +3567,27 @@ def end_update(dados, res_scraping : tuple):
         # dados.current[0]... != [1] verifica se a versão lida no .config é difente da lida no webscraping
         # dados.update tem que ser True, que é lido no .config
         if 'receita' in res_scraping and (dados.current_versions['receita'][0] != dados.current_versions['receita'][1]) and dados.update:
-            dados.update_download_receita()
-            dados.atualizar_receita()
-
-        if 'depara_abecs' in res_scraping and (dados.current_versions['depara_abecs'][0] != dados.current_versions['depara_abecs'][1]) and dados.update:
+            dados.etapa = 'Atualizando dados da receita'
+            # Download, leitura e inserção rodam ao mesmo tempo
+            dados.pipeline_receita()
+
+        # Planilhas da ABECS com o mesmo link da versão vigente ainda podem ter sido trocadas, ver dados.abecs_alterada()
+        if 'depara_abecs' in res_scraping and dados.update and (dados.current_versions['depara_abecs'][0] != dados.current_versions['depara_abecs'][1]
+                                                                or dados.abecs_alterada('depara_abecs')):
+            dados.etapa = 'Atualizando de:para ABECS'
             dados.update_depara_abecs()
 
-        if 'lista_cnpj' in res_scraping and (dados.current_versions['lista_cnpj'][0] != dados.current_versions['lista_cnpj'][1]) and dados.update:
+        if 'lista_cnpj' in res_scraping and dados.update and (dados.current_versions['lista_cnpj'][0] != dados.current_versions['lista_cnpj'][1]
+                                                              or dados.abecs_alterada('lista_cnpj')):
+            dados.etapa = 'Atualizando CNPJs determinados ABECS'
             dados.update_cnpjs_abecs()
 
+        # Fontes que o webscraping confirmou estarem na versão vigente: guarda os headers atuais,
+        # para o próximo verifica_sondas() já resolver sem abrir o navegador
+        for fonte in res_scraping:
+            if dados.current_versions[fonte][0] == dados.current_versions[fonte][1]:
+                dados.salva_sonda(fonte)
+
     # Se a opção de update estiver desabilitada no config.txt, dá um aviso
     if not dados.update:
         print('''Update está desabilitado!''')
@@ -1131,18 +3597,118 @@ def end_update(dados, res_scraping : tuple):
         time.sleep(1)
 
 
+class Agendador():
+    '''Verifica e atualiza as fontes em uma thread separada, para a GUI abrir na hora com o database vigente
+    Cada ciclo faz o mesmo que o programa fazia antes de abrir a GUI: sondas (ou espelho), webscraping se precisar, e os updates
+    Ciclos se repetem a cada 'intervalo_update=' horas do config.txt, e um ciclo que falhar é repetido com espera crescente'''
+    def __init__(self, consultas : Consultas):
+        self.consultas = consultas
+        # Motores do webscraping, os mesmos em todos os ciclos: guardam as páginas buscadas, ver Web.memoriza()
+        self.web = Web()
+        self.browser = Browser()
+        self.dados = None
+        self.rodando = False
+        self.status = 'Verificando atualizações'
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def mensagem(self) -> str:
+        '''Situação do update, mostrada na GUI'''
+
+        if self.rodando and self.dados and self.dados.etapa:
+            return self.dados.etapa
+        return self.status
+
+    def ciclo(self) -> bool:
+        '''Uma verificação das fontes, com update das que mudaram
+
+        returns
+        -------
+        bool
+            True se todas as fontes foram verificadas e as que mudaram foram atualizadas'''
+
+        self.dados = Dados(self.consultas)
+        dados = self.dados
+        try:
+            start_update(dados)
+            erros = list()
+            if dados.le_config('espelho', ''):
+                # Espelho interno: versões, arquivos e snapshot vêm de outra instalação, sem acessar a internet
+                fontes = dados.verifica_espelho()
+                if not fontes:
+                    erros.append('espelho')
+            else:
+                # Verifica pelos headers das urls se algo mudou, o navegador só abre se precisar
+                fontes = dados.verifica_sondas()
+                # Motor padrão é o requests, sem Chrome. O selenium só é usado com 'motor_descoberta=selenium',
+                # ou para as fontes que o requests não conseguiu ler (ex: página que só monta o conteúdo por javascript)
+                if len(fontes) < len(dados.current_versions) and dados.le_config('motor_descoberta', 'http') != 'selenium':
+                    self.web.url_api = dados.le_config('url_api_receita', URL_API_RECEITA)
+                    self.web.url_abecs = dados.le_config('url_abecs', URL_ABECS)
+                    fontes, erros = web_scrape(self.web, dados, fontes)
+                if len(fontes) < len(dados.current_versions):
+                    print('Buscando pelo navegador as fontes restantes')
+                    self.browser.url_abecs = dados.le_config('url_abecs', URL_ABECS)
+                    self.browser.abrir_navegador()
+                    if self.browser.aberto:
+                        fontes, erros = web_scrape(self.browser, dados, fontes)
+                    else:
+                        # Sem Chrome as fontes já resolvidas pelo requests são atualizadas mesmo assim,
+                        # e as restantes ficam como erro para o próximo ciclo
+                        erros = [fonte for fonte in dados.current_versions if fonte not in fontes]
+            end_update(dados, fontes)
+            # Fonte atualizada com sucesso tem a versão nova gravada no config.txt
+            pendentes = [fonte for fonte in fontes if dados.update and dados.le_config(fonte, '') != dados.current_versions[fonte][1]]
+            return not erros and not pendentes and not dados.erros_download
+        finally:
+            dados.connection.close()
+
+    def loop(self):
+        '''Roda os ciclos até o programa fechar'''
+
+        espera_erro = ESPERA_ERRO_UPDATE
+        while True:
+            self.rodando = True
+            try:
+                sucesso = self.ciclo()
+            except Exception as e:
+                print(e)
+                sucesso = False
+            self.rodando = False
+
+            intervalo = float(self.dados.le_config('intervalo_update', INTERVALO_UPDATE_HORAS)) * 3600 if self.dados else INTERVALO_UPDATE_HORAS * 3600
+            if sucesso:
+                espera = intervalo
+                espera_erro = ESPERA_ERRO_UPDATE
+                aviso = 'Dados atualizados'
+            else:
+                espera = min(espera_erro, intervalo) if intervalo > 0 else espera_erro
+                espera_erro = min(espera_erro * 2, ESPERA_MAXIMA_ERRO_UPDATE)
+                aviso = 'Update não concluído'
+            if intervalo <= 0 and sucesso:
+                self.status = aviso
+                return
+            self.status = f'{aviso}, próxima verificação às {time.strftime("%H:%M", time.localtime(time.time() + espera))}'
+            print(self.status)
+            time.sleep(espera)
+
+
 if __name__ == "__main__":
-    # Inicializa classes
-    browser = Browser()
+    # Necessário para o Pool de processos funcionar no executável gerado pelo PyInstaller (Windows)
+    multiprocessing.freeze_support()
+    # Cria database se ela não existir, antes da GUI fazer qualquer consulta
     dados = Dados()
-    interface = GUI()
-    # Cria database se ela não existir
     dados.cria_database()
-    # Verifica o arquivo 'config.txt'
-    start_update(dados)
-    # Verifica os dados na web e atualiza o .db se necessário
-    browser.abrir_navegador()
-    if browser.aberto:
-        end_update(dados, web_scrape(browser,dados)[0])
-    # Inicializa a GUI de busca de CNPJ/Raíz
+    dados.connection.close()
+    # Verificação e updates rodam em segundo plano: a GUI abre na hora com o database vigente,
+    # e passa para o database novo assim que ele for promovido
+    consultas = Consultas(dados.path_database)
+    agendador = Agendador(consultas)
+    agendador.start()
+    interface = GUI(consultas, agendador)
     interface.main_loop()
+    # A thread do update fecha junto com a janela, uma carga da receita interrompida continua na próxima abertura
+    if agendador.rodando:
+        print('Programa fechado durante o update, ele continua na próxima abertura')